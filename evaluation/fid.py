@@ -24,7 +24,8 @@ import tensorflow as tf
 from scipy import linalg
 import warnings
 from models.inception.model import load_inception_inference
-from utils.utils import load_inception_data, prep_incep_img
+from utils.profiling import StepTracer
+from utils.utils import incep_inputs_are_uint8, load_inception_data, prep_incep_img
 
 
 # Flags and constants
@@ -38,6 +39,8 @@ tf.app.flags.DEFINE_string('gen_img_folder', './test2', """Path where to load th
 tf.app.flags.DEFINE_integer('num_classes', 20, """Number of classes """)  # 20 for flowers
 tf.app.flags.DEFINE_integer('batch_size', 64, "batch size")
 tf.app.flags.DEFINE_integer('gpu', 1, "The ID of GPU to use")
+tf.app.flags.DEFINE_string('trace_batches', '', "first,last: trace the Inception runs of these batches")
+tf.app.flags.DEFINE_string('trace_dir', './logs/profile/fid/', "Path where to write the traces")
 
 # Batch normalization. Constant governing the exponential moving average of
 # the 'global' mean and variance for all activations.
@@ -53,7 +56,7 @@ class InvalidFIDException(Exception):
 # -------------------------------------------------------------------------------
 
 
-def get_activations(images, sess, batch_size, act_op, verbose=False):
+def get_activations(images, sess, batch_size, act_op, verbose=False, tracer: StepTracer=None):
     """Calculates the activations of the pool_3 layer for all x.
 
     Params:
@@ -64,6 +67,7 @@ def get_activations(images, sess, batch_size, act_op, verbose=False):
                      batch_size. A reasonable batch size depends on the disposable hardware.
     -- verbose    : If set to True and parameter out_step is given, the number of calculated
                      batches is reported.
+    -- tracer     : If given, the runs of the batches in its step ranges are traced.
     Returns:
     -- A numpy array of dimension (num x, 2048) that contains the
        activations of the given tensor when feeding inception with the query tensor.
@@ -81,6 +85,7 @@ def get_activations(images, sess, batch_size, act_op, verbose=False):
     n_batches = d0 // batch_size
     n_used_imgs = n_batches * batch_size
     pred_arr = np.empty((n_used_imgs, 2048))
+    normalize = not incep_inputs_are_uint8(sess)
     for i in range(n_batches):
         if verbose:
             print("\rPropagating batch %d/%d" % (i + 1, n_batches), end="", flush=True)
@@ -88,9 +93,12 @@ def get_activations(images, sess, batch_size, act_op, verbose=False):
         end = start + batch_size
         batch = []
         for j in range(start, end):
-            batch.append(prep_incep_img(images[j]))
+            batch.append(prep_incep_img(images[j], normalize))
 
-        pred = sess.run(act_op, {'inputs:0': batch})
+        if tracer is not None:
+            pred = tracer.run(sess, 'inception', act_op, {'inputs:0': batch}, step=i)
+        else:
+            pred = sess.run(act_op, {'inputs:0': batch})
         pred_arr[start:end] = pred
     if verbose:
         print(" done")
@@ -157,7 +165,7 @@ def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
 # -------------------------------------------------------------------------------
 
 
-def calculate_activation_statistics(images, sess, batch_size, act_op, verbose=False):
+def calculate_activation_statistics(images, sess, batch_size, act_op, verbose=False, tracer: StepTracer=None):
     """Calculation of the statistics used by the FID.
     Params:
     -- x      : Numpy array of dimension (n_images, hi, wi, 3). The values
@@ -167,13 +175,14 @@ def calculate_activation_statistics(images, sess, batch_size, act_op, verbose=Fa
                      batch_size. A reasonable batch size depends on the available hardware.
     -- verbose     : If set to True and parameter out_step is given, the number of calculated
                      batches is reported.
+    -- tracer      : If given, the Inception runs of the batches in its step ranges are traced.
     Returns:
     -- mu    : The mean over samples of the activations of the pool_3 layer of
                the incption model.
     -- sigma : The covariance matrix of the activations of the pool_3 layer of
                the incption model.
     """
-    act = get_activations(images, sess, batch_size, act_op, verbose)
+    act = get_activations(images, sess, batch_size, act_op, verbose, tracer)
     mu = np.mean(act, axis=0)
     sigma = np.cov(act, rowvar=False)
     return mu, sigma
@@ -202,8 +211,12 @@ def _handle_path(path, sess, act_op):
         m, s = f['mu'][:], f['sigma'][:]
         f.close()
     else:
+        tracer = None
+        if FLAGS.trace_batches:
+            trace_dir = os.path.join(FLAGS.trace_dir, os.path.basename(os.path.normpath(path)))
+            tracer = StepTracer(trace_dir, [FLAGS.trace_batches.split(',')])
         x = load_inception_data(path)
-        m, s = calculate_activation_statistics(x, sess, FLAGS.batch_size, act_op, verbose=True)
+        m, s = calculate_activation_statistics(x, sess, FLAGS.batch_size, act_op, verbose=True, tracer=tracer)
     return m, s
 
 
@@ -217,7 +230,8 @@ def calculate_fid_given_paths():
         raise RuntimeError("Invalid path %s" % gen_img_path)
 
     with tf.Session() as sess:
-        _, layers = load_inception_inference(sess, FLAGS.num_classes, FLAGS.batch_size, FLAGS.checkpoint_dir)
+        _, layers = load_inception_inference(sess, FLAGS.num_classes, FLAGS.batch_size, FLAGS.checkpoint_dir,
+                                             uint8_inputs=True)
         pool3 = layers['PreLogits']
         act_op = tf.reshape(pool3, shape=[FLAGS.batch_size, -1])
 
@@ -4,7 +4,7 @@ import tensorflow as tf
 from scipy import spatial
 import numpy as np
 
-from utils.utils import load_inception_data, prep_incep_img
+from utils.utils import incep_inputs_are_uint8, load_inception_data, prep_incep_img
 from models.inception.model import load_inception_inference
 
 FLAGS = tf.app.flags.FLAGS
@@ -56,6 +56,7 @@ def compute_imd(sess, real_img, gen_img, act_op, verbose=False):
     n_batches = d0 // batch_size
     n_used_imgs = n_batches * batch_size
     distances = np.empty(n_used_imgs)
+    normalize = not incep_inputs_are_uint8(sess)
     for i in range(n_batches):
         if verbose:
             print("\rComputing batch %d/%d" % (i + 1, n_batches), end="", flush=True)
@@ -64,8 +65,8 @@ def compute_imd(sess, real_img, gen_img, act_op, verbose=False):
         r_img_batch = []
         g_img_batch = []
         for j in range(start, end):
-            r_img_batch.append(prep_incep_img(real_img[j]))
-            g_img_batch.append(prep_incep_img(gen_img[j]))
+            r_img_batch.append(prep_incep_img(real_img[j], normalize))
+            g_img_batch.append(prep_incep_img(gen_img[j], normalize))
 
         pred_real = sess.run(act_op, {'inputs:0': r_img_batch})
         pred_gen = sess.run(act_op, {'inputs:0': g_img_batch})
@@ -84,7 +85,8 @@ def main(unused_argv=None):
         config.gpu_options.allow_growth = True
         with tf.Session(config=config) as sess:
             with tf.device("/gpu:%d" % FLAGS.gpu):
-                _, layers = load_inception_inference(sess, FLAGS.num_classes, FLAGS.batch_size, FLAGS.checkpoint_dir)
+                _, layers = load_inception_inference(sess, FLAGS.num_classes, FLAGS.batch_size, FLAGS.checkpoint_dir,
+                                                     uint8_inputs=True)
 
                 pool3 = layers['PreLogits']
                 act_op = tf.reshape(pool3, shape=[FLAGS.batch_size, -1])
@@ -17,7 +17,7 @@
 
 import numpy as np
 import math
-from utils.utils import prep_incep_img
+from utils.utils import incep_inputs_are_uint8, prep_incep_img
 
 
 def get_inception_from_predictions(preds, splits, verbose=True):
@@ -47,13 +47,14 @@ def get_inception_score(images, sess, batch_size, splits, pred_op, verbose=False
     n_batches = int(math.floor(float(num_examples) / float(batch_size)))
     indices = list(np.arange(num_examples))
     np.random.shuffle(indices)
+    normalize = not incep_inputs_are_uint8(sess)
     for i in range(n_batches):
         inp = []
         for j in range(batch_size):
             if (i*batch_size + j) == num_examples:
                 break
             img = images[indices[i*batch_size + j]]
-            img = prep_incep_img(img)
+            img = prep_incep_img(img, normalize)
             inp.append(img)
 
         if verbose:
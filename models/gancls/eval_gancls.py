@@ -1,6 +1,7 @@
 from random import randint
 
 from models.gancls.model import GanCls
+from utils.profiling import StepTracer
 from utils.saver import load
 from utils.utils import denormalize_images
 from preprocess.dataset import TextDataset
@@ -22,7 +23,7 @@ class GanClsEval(object):
     def evaluate_fid(self):
         incep_batch_size = self.cfg.EVAL.INCEP_BATCH_SIZE
         _, layers = load_inception_inference(self.sess, 20, incep_batch_size,
-                                             self.cfg.EVAL.INCEP_CHECKPOINT_DIR)
+                                             self.cfg.EVAL.INCEP_CHECKPOINT_DIR, self.cfg.EVAL.INCEP_UINT8_INPUTS)
         pool3 = layers['PreLogits']
         act_op = tf.reshape(pool3, shape=[incep_batch_size, -1])
 
@@ -48,25 +49,29 @@ class GanClsEval(object):
             print(" [!] Load failed...")
             raise RuntimeError('Could not load the checkpoints of the generator')
 
+        # The generator and Inception runs of the batches in PROFILE.EVAL_STEPS are traced
+        tracer = StepTracer(self.cfg.PROFILE.DIR, self.cfg.PROFILE.EVAL_STEPS, self.cfg.PROFILE.TOP)
+
         print('Generating x...')
 
         fid_size = self.cfg.EVAL.SIZE
         n_batches = fid_size // self.bs
 
         w, h, c = self.model.image_dims[0], self.model.image_dims[1], self.model.image_dims[2]
-        samples = np.zeros((n_batches * self.bs, w, h, c))
+        samples = np.zeros((n_batches * self.bs, w, h, c), dtype=np.uint8)
         for i in range(n_batches):
             start = i * self.bs
             end = start + self.bs
 
             sample_z = np.random.normal(0, 1, size=(self.bs, self.model.z_dim))
-            images, _, embed, _, _ = self.dataset.test.next_batch(self.bs, 4, embeddings=True)
+            _, _, embed, _, _ = self.dataset.test.next_batch(self.bs, 4, embeddings=True, images=False)
 
-            samples[start: end] = denormalize_images(self.sess.run(eval_gen, feed_dict={z: sample_z, cond: embed}))
+            samples[start: end] = denormalize_images(tracer.run(self.sess, 'generator', eval_gen,
+                                                                {z: sample_z, cond: embed}, step=i))
 
         print('Computing activation statistics for generated x...')
         mu_gen, sigma_gen = fid.calculate_activation_statistics(samples, self.sess, incep_batch_size, act_op,
-                                                                verbose=True)
+                                                                verbose=True, tracer=tracer)
         print("calculate FID:", end=" ", flush=True)
         try:
             FID = fid.calculate_frechet_distance(mu_gen, sigma_gen, mu_real, sigma_real)
@@ -79,7 +84,7 @@ class GanClsEval(object):
     def evaluate_inception(self):
         incep_batch_size = self.cfg.EVAL.INCEP_BATCH_SIZE
         logits, _ = load_inception_inference(self.sess, 20, incep_batch_size,
-                                             self.cfg.EVAL.INCEP_CHECKPOINT_DIR)
+                                             self.cfg.EVAL.INCEP_CHECKPOINT_DIR, self.cfg.EVAL.INCEP_UINT8_INPUTS)
         pred_op = tf.nn.softmax(logits)
 
         z = tf.placeholder(tf.float32, [self.bs, self.model.z_dim], name='z')
@@ -100,12 +105,12 @@ class GanClsEval(object):
         n_batches = size // self.bs
 
         w, h, c = self.model.image_dims[0], self.model.image_dims[1], self.model.image_dims[2]
-        samples = np.zeros((n_batches * self.bs, w, h, c))
+        samples = np.zeros((n_batches * self.bs, w, h, c), dtype=np.uint8)
         for i in range(n_batches):
             print("\rGenerating batch %d/%d" % (i + 1, n_batches), end="", flush=True)
 
             sample_z = np.random.normal(0, 1, size=(self.bs, self.model.z_dim))
-            _, _, embed, _, _ = self.dataset.test.next_batch(self.bs, 4, embeddings=True)
+            _, _, embed, _, _ = self.dataset.test.next_batch(self.bs, 4, embeddings=True, images=False)
             start = i * self.bs
             end = start + self.bs
 
@@ -0,0 +1,146 @@
+"""
+Exports the trained GanCls generator to a frozen, inference-optimised GraphDef (and optionally a SavedModel).
+
+The batch norms of the generator are folded into the weights of the preceding layers and the training-only nodes are
+removed, see utils/freeze.py. FrozenGenerator loads the exported graph without building GanCls or restoring a
+checkpoint. The benchmark compares the per-batch latency of the exported graph with the live generator.
+
+Usage: python -m models.gancls.export --cfg ./models/gancls/cfg/flowers.yml [--saved_model_dir DIR] [--benchmark]
+"""
+
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from models.gancls.model import GanCls
+from utils.config import config_from_yaml
+from utils.freeze import freeze_graph, load_graph_def, optimize_for_inference, save_graph_def
+from utils.saver import load
+
+Z_NAME = 'z'
+EMBED_NAME = 'embed'
+OUTPUT_NAME = 'generated_images'
+GRAPH_FILENAME = 'generator.pb'
+
+flags = tf.app.flags
+flags.DEFINE_string('cfg', './models/gancls/cfg/flowers.yml', 'Relative path to the config of the model')
+flags.DEFINE_string('output', '', 'The path of the exported GraphDef [CHECKPOINT_DIR/generator.pb]')
+flags.DEFINE_string('saved_model_dir', '', 'If given, also export a SavedModel to this (new) directory')
+flags.DEFINE_boolean('benchmark', False, 'Compare the latency of the exported and of the live generator')
+flags.DEFINE_integer('batch_size', 64, 'The batch size of the benchmark')
+flags.DEFINE_integer('steps', 50, 'The number of timed batches of the benchmark')
+FLAGS = flags.FLAGS
+
+
+def build_generator(model: GanCls):
+    """Builds the inference generator, with a variable batch size, and returns its inputs and output"""
+    z = tf.placeholder(tf.float32, [None, model.z_dim], name=Z_NAME)
+    embed = tf.placeholder(tf.float32, [None, model.embed_dim], name=EMBED_NAME)
+    images = tf.identity(model.generator(z, embed, is_training=False), name=OUTPUT_NAME)
+    return z, embed, images
+
+
+def restore_generator(sess: tf.Session, checkpoint_dir):
+    saver = tf.train.Saver(tf.global_variables('g_net'))
+    could_load, _ = load(saver, sess, checkpoint_dir)
+    if not could_load:
+        raise RuntimeError('Could not load the checkpoints of the generator from %s' % checkpoint_dir)
+
+
+def export_generator(cfg, path, saved_model_dir=None):
+    """Writes the frozen generator of the latest checkpoint of cfg.CHECKPOINT_DIR to path"""
+    with tf.Graph().as_default(), tf.Session() as sess:
+        build_generator(GanCls(cfg, build_model=False))
+        restore_generator(sess, cfg.CHECKPOINT_DIR)
+        graph_def = freeze_graph(sess, [OUTPUT_NAME])
+
+    num_nodes = len(graph_def.node)
+    graph_def = optimize_for_inference(graph_def, [Z_NAME, EMBED_NAME], [OUTPUT_NAME])
+    print('Optimised the frozen generator from %d to %d nodes' % (num_nodes, len(graph_def.node)))
+    save_graph_def(graph_def, path)
+    print('save to: ', path)
+
+    if saved_model_dir:
+        generator = FrozenGenerator(path)
+        tf.saved_model.simple_save(generator.sess, saved_model_dir, inputs={Z_NAME: generator.z,
+                                                                            EMBED_NAME: generator.embed},
+                                   outputs={OUTPUT_NAME: generator.images})
+        generator.close()
+        print('save to: ', saved_model_dir)
+
+
+class FrozenGenerator(object):
+    """The generator exported by export_generator, in its own graph and session"""
+
+    def __init__(self, path, config: tf.ConfigProto=None):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(load_graph_def(path), name='')
+        self.z = self.graph.get_tensor_by_name(Z_NAME + ':0')
+        self.embed = self.graph.get_tensor_by_name(EMBED_NAME + ':0')
+        self.images = self.graph.get_tensor_by_name(OUTPUT_NAME + ':0')
+        self.sess = tf.Session(graph=self.graph, config=config)
+
+    def generate(self, z, embed):
+        """Returns the images in [-1, 1] generated from the noise z and the caption embeddings embed"""
+        return self.sess.run(self.images, feed_dict={self.z: z, self.embed: embed})
+
+    def close(self):
+        self.sess.close()
+
+
+def _latencies(run, inputs, steps, warmup=5):
+    for _ in range(warmup):
+        run(*inputs)
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        run(*inputs)
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def benchmark(cfg, path, batch_size, steps):
+    """Prints the per-batch latency of the live and of the exported generator and the difference of their outputs"""
+    rng = np.random.RandomState(0)
+    z = rng.normal(0, 1, [batch_size, cfg.MODEL.Z_DIM]).astype(np.float32)
+    embed = rng.normal(0, 1, [batch_size, cfg.MODEL.EMBED_DIM]).astype(np.float32)
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        start = time.perf_counter()
+        z_live, embed_live, images_live = build_generator(GanCls(cfg, build_model=False))
+        restore_generator(sess, cfg.CHECKPOINT_DIR)
+        live_load = time.perf_counter() - start
+
+        live_outputs = sess.run(images_live, feed_dict={z_live: z, embed_live: embed})
+        live = _latencies(lambda a, b: sess.run(images_live, feed_dict={z_live: a, embed_live: b}), (z, embed), steps)
+
+    start = time.perf_counter()
+    generator = FrozenGenerator(path)
+    frozen_load = time.perf_counter() - start
+    frozen_outputs = generator.generate(z, embed)
+    frozen = _latencies(generator.generate, (z, embed), steps)
+    generator.close()
+
+    print('\nBatch size: %d, %d batches' % (batch_size, steps))
+    print('%-8s %10s %10s %10s' % ('graph', 'load ms', 'p50 ms', 'p95 ms'))
+    for name, load_time, times in [('live', live_load, live), ('frozen', frozen_load, frozen)]:
+        print('%-8s %10.1f %10.2f %10.2f' % (name, 1000 * load_time, 1000 * np.percentile(times, 50),
+                                             1000 * np.percentile(times, 95)))
+    print('Speedup: %.2fx, max output difference: %.2e' % (np.median(live) / np.median(frozen),
+                                                           np.max(np.abs(live_outputs - frozen_outputs))))
+
+
+def main(_):
+    cfg = config_from_yaml(FLAGS.cfg)
+    path = FLAGS.output or os.path.join(cfg.CHECKPOINT_DIR, GRAPH_FILENAME)
+
+    export_generator(cfg, path, FLAGS.saved_model_dir)
+    if FLAGS.benchmark:
+        benchmark(cfg, path, FLAGS.batch_size, FLAGS.steps)
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from preprocess.dataset import Dataset
+
+
+class GanClsInputPipeline(object):
+    """Graph-native input pipeline feeding GanCls through a tf.data iterator instead of feed_dict.
+
+    The dataset indices of every batch are drawn by the Dataset, so the epochs and the example order are the same as
+    with Dataset.next_batch. Every batch is then built by a single call of Dataset.get_batch (image gather, mismatching
+    images and embedding means, honouring TRAIN.WRONG_IMG_FROM_BATCH and the precomputed embedding means) in parallel
+    map calls. The uint8 images are cropped and flipped in the graph, with stateless random ops seeded from the seed
+    the Dataset draws for the batch, so the augmentation is reproducible. The batches are prefetched.
+
+    Every sess.run of the iterator would produce a new batch, so a batch is first loaded into local variables by load.
+    The images are staged as uint8 and normalized by the model. The D and G steps both read the same batch from these
+    variables without re-feeding it.
+
+    The generator of the dataset indices runs ahead of the loaded batch, so the dataset state right after every batch
+    is recorded under the index of the batch when its indices are drawn. The index goes through the pipeline with the
+    batch, and get_state returns the state of the loaded one.
+    """
+
+    def __init__(self, dataset: Dataset, cfg):
+        self.dataset = dataset
+        self.batch_size = cfg.TRAIN.BATCH_SIZE
+        self.window = cfg.TRAIN.NUM_EMBEDDINGS
+        self.wrong_from_batch = cfg.TRAIN.WRONG_IMG_FROM_BATCH
+        self.image_dims = [cfg.MODEL.IMAGE_SHAPE.H, cfg.MODEL.IMAGE_SHAPE.W, cfg.MODEL.IMAGE_SHAPE.D]
+        self.z_dim = cfg.MODEL.Z_DIM
+        self.aug_flag = dataset._aug_flag
+
+        self.source_image_shape = list(dataset.images.shape[1:])
+        self.embed_dim = dataset.embeddings.shape[-1]
+
+        # The dataset state after every batch not yet loaded and after the loaded one, by batch index
+        self._states = OrderedDict()
+        self._loaded_index = -1
+        self._lock = threading.Lock()
+
+        with tf.name_scope('input_pipeline'):
+            ids = tf.data.Dataset.from_generator(self._id_batches, (tf.int64, tf.int64, tf.int64),
+                                                 ([self.batch_size], [], []))
+            batches = ids.map(self._load_batch, num_parallel_calls=cfg.TRAIN.INPUT_PIPELINE.PARALLEL_CALLS)
+            batches = batches.prefetch(cfg.TRAIN.INPUT_PIPELINE.PREFETCH)
+
+            self.iterator = batches.make_initializable_iterator()
+            real_images, wrong_images, embed, self._batch_index = self.iterator.get_next()
+            z = tf.random_normal([self.batch_size, self.z_dim])
+
+        with tf.variable_scope('input_pipeline'):
+            # Local variables are neither initialised by global_variables_initializer nor saved in the checkpoints
+            self.batch = {
+                'real_images': self._staging_variable('real_images', [self.batch_size] + self.image_dims, tf.uint8),
+                'wrong_images': self._staging_variable('wrong_images', [self.batch_size] + self.image_dims, tf.uint8),
+                'phi_inputs': self._staging_variable('phi_inputs', [self.batch_size, self.embed_dim]),
+                'z': self._staging_variable('z', [self.batch_size, self.z_dim]),
+            }
+
+        self.load_op = tf.group(
+            tf.assign(self.batch['real_images'], tf.reshape(real_images, [self.batch_size] + self.image_dims)),
+            tf.assign(self.batch['wrong_images'], tf.reshape(wrong_images, [self.batch_size] + self.image_dims)),
+            tf.assign(self.batch['phi_inputs'], tf.reshape(embed, [self.batch_size, self.embed_dim])),
+            tf.assign(self.batch['z'], z),
+            name='load_batch')
+
+    @staticmethod
+    def _staging_variable(name, shape, dtype=tf.float32):
+        return tf.get_variable(name, shape, dtype, initializer=tf.zeros_initializer(), trainable=False,
+                               collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+    def initialize(self, sess: tf.Session):
+        with self._lock:
+            self._states.clear()
+            self._states[-1] = self.dataset.get_state()
+            self._loaded_index = -1
+        sess.run([self.iterator.initializer, tf.local_variables_initializer()])
+
+    def load(self, sess: tf.Session):
+        """Loads the next batch into the staging variables"""
+        _, index = sess.run([self.load_op, self._batch_index])
+        with self._lock:
+            self._loaded_index = index
+            # The states of the batches before the loaded one are no longer needed
+            while next(iter(self._states)) < index:
+                self._states.popitem(last=False)
+
+    def get_state(self):
+        """The dataset state right after the last loaded batch, see Dataset.get_state"""
+        with self._lock:
+            return self._states[self._loaded_index]
+
+    def _id_batches(self):
+        index = 0
+        while True:
+            ids = self.dataset.next_ids(self.batch_size)
+            # The seed of the random sampling and augmentation of the batch, as in BatchPrefetcher
+            seed = self.dataset.rng.randint(2 ** 31 - 1)
+            with self._lock:
+                self._states[index] = self.dataset.get_state()
+            yield ids, seed, index
+            index += 1
+
+    def _read_batch(self, ids, seed):
+        images, wrong_images, embed, _, _ = self.dataset.get_batch(
+            ids, window=self.window, wrong_img=True, embeddings=True, wrong_from_batch=self.wrong_from_batch,
+            normalize=False, rng=np.random.RandomState(seed), augment=False)
+        return images, wrong_images, np.asarray(embed, dtype=np.float32).reshape(len(ids), self.embed_dim)
+
+    def _augment(self, images, seed):
+        """Crops and flips every image of the batch with its own offsets and flip, drawn by stateless ops from seed"""
+        images.set_shape([self.batch_size] + self.source_image_shape)
+        if not self.aug_flag:
+            return images
+
+        height, width = self.image_dims[:2]
+        uniform = tf.contrib.stateless.stateless_random_uniform([self.batch_size, 3], seed)
+        offset_y = tf.cast(uniform[:, 0] * (self.source_image_shape[0] - height + 1), tf.int32)
+        offset_x = tf.cast(uniform[:, 1] * (self.source_image_shape[1] - width + 1), tf.int32)
+        flip = uniform[:, 2] < 0.5
+
+        def crop_and_flip(args):
+            image, y, x, flip_image = args
+            crop = tf.slice(image, tf.stack([y, x, 0]), self.image_dims)
+            return tf.cond(flip_image, lambda: tf.reverse(crop, [1]), lambda: crop)
+
+        return tf.map_fn(crop_and_flip, (images, offset_y, offset_x, flip), dtype=images.dtype)
+
+    def _load_batch(self, ids, seed, batch_index):
+        images, wrong_images, embed = tf.py_func(self._read_batch, [ids, seed], [tf.uint8, tf.uint8, tf.float32],
+                                                 stateful=False)
+        embed.set_shape([self.batch_size, self.embed_dim])
+        # The real and the mismatching images get distinct crops and flips
+        return (self._augment(images, tf.stack([seed, tf.constant(0, tf.int64)])),
+                self._augment(wrong_images, tf.stack([seed, tf.constant(1, tf.int64)])), embed, batch_index)
@@ -1,12 +1,21 @@
+from contextlib import contextmanager
+
 from utils.ops import *
 from utils.utils import *
 
 
 class GanCls(object):
-    def __init__(self, cfg, build_model=True):
+    def __init__(self, cfg, build_model=True, inputs=None):
         """
         Args:
           cfg: Config specifying all the parameters of the model.
+          inputs: Optional dictionary of input tensors (real_images, wrong_images, phi_inputs and z) replacing the
+            placeholders, e.g. the batch of a GanClsInputPipeline.
+
+        With MODEL.UINT8_INPUTS, the image placeholders take the raw uint8 images, which are normalized in the graph.
+
+        With TRAIN.TOWERS.NUM > 1, the batch is split between TRAIN.TOWERS.NUM replicas (towers) of the generator and
+        the discriminator sharing the same variables, tower i being placed on the device TRAIN.TOWERS.DEVICE % i.
         """
 
         self.name = 'GANL_CLS'
@@ -24,6 +33,14 @@ class GanCls(object):
         self.df_dim = cfg.MODEL.DF_DIM
         
         self.image_dims = [cfg.MODEL.IMAGE_SHAPE.H, cfg.MODEL.IMAGE_SHAPE.W, cfg.MODEL.IMAGE_SHAPE.D]
+        self.image_dtype = tf.uint8 if cfg.MODEL.UINT8_INPUTS else tf.float32
+        self.fused_discriminator = cfg.MODEL.FUSED_DISCRIMINATOR
+
+        self.num_towers = cfg.TRAIN.TOWERS.NUM
+        self.tower_device = cfg.TRAIN.TOWERS.DEVICE
+        if self.batch_size % self.num_towers != 0:
+            raise ValueError('The batch size %d is not divisible by the number of towers %d'
+                             % (self.batch_size, self.num_towers))
 
         self.w_init = tf.random_normal_initializer(stddev=0.02)
         self.batch_norm_init = {
@@ -31,27 +48,81 @@ class GanCls(object):
         }
 
         if build_model:
-            self.build_model()
+            self.build_model(inputs)
 
-    def build_model(self):
-        # Define the input tensor by appending the batch size dimension to the image dimension
-        self.inputs = tf.placeholder(tf.float32, [self.batch_size] + self.image_dims, name='real_images')
-        self.wrong_inputs = tf.placeholder(tf.float32, [self.batch_size] + self.image_dims, name='wrong_images')
-        self.phi_inputs = tf.placeholder(tf.float32, [self.batch_size] + [self.embed_dim], name='phi_inputs')
+    def build_model(self, inputs=None):
+        if inputs is None:
+            # Define the input tensor by appending the batch size dimension to the image dimension
+            self.inputs = tf.placeholder(self.image_dtype, [self.batch_size] + self.image_dims, name='real_images')
+            self.wrong_inputs = tf.placeholder(self.image_dtype, [self.batch_size] + self.image_dims,
+                                               name='wrong_images')
+            self.phi_inputs = tf.placeholder(tf.float32, [self.batch_size] + [self.embed_dim], name='phi_inputs')
 
-        self.z = tf.placeholder(tf.float32, [self.batch_size, self.z_dim], name='z')
+            self.z = tf.placeholder(tf.float32, [self.batch_size, self.z_dim], name='z')
+        else:
+            self.inputs = inputs['real_images']
+            self.wrong_inputs = inputs['wrong_images']
+            self.phi_inputs = inputs['phi_inputs']
+            self.z = inputs['z']
 
         self.z_sample = tf.placeholder(tf.float32, [self.sample_num] + [self.z_dim], name='z_sample')
         self.phi_sample = tf.placeholder(tf.float32, [self.sample_num] + [self.embed_dim], name='phi_sample')
 
-        self.G = self.generator(self.z, self.phi_inputs, reuse=False)
-        self.D_synthetic, self.D_synthetic_logits = self.discriminator(self.G, self.phi_inputs, reuse=False)
-        self.D_real_match, self.D_real_match_logits = self.discriminator(self.inputs, self.phi_inputs, reuse=True)
-        self.D_real_mismatch, self.D_real_mismatch_logits = self.discriminator(self.wrong_inputs, self.phi_inputs,
-                                                                               reuse=True)
+        # Raw uint8 images are normalized to [-1, 1] as the first op of the graph
+        self.real_images = uint8_to_float(self.inputs)
+        self.wrong_images = uint8_to_float(self.wrong_inputs)
+
+        self.towers = []
+        tower_inputs = [tf.split(tensor, self.num_towers) if self.num_towers > 1 else [tensor]
+                        for tensor in [self.z, self.phi_inputs, self.real_images, self.wrong_images]]
+        for i, (z, phi, real_images, wrong_images) in enumerate(zip(*tower_inputs)):
+            num_update_ops = len(tf.get_collection(tf.GraphKeys.UPDATE_OPS))
+            with self.tower_scope(i):
+                self.towers.append(self.build_tower(z, phi, real_images, wrong_images, reuse=i > 0))
+            if i == 0:
+                # The moving batch norm statistics are only updated by the first tower, every tower would otherwise
+                # apply its own update to the same variables
+                self.update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)[num_update_ops:]
+
+        # The outputs of the whole batch
+        for key in self.towers[0]:
+            outputs = [tower[key] for tower in self.towers]
+            setattr(self, key, tf.concat(outputs, axis=0) if len(outputs) > 1 else outputs[0])
+
         self.sampler = self.generator(self.z_sample, self.phi_sample, is_training=False, reuse=True)
 
-    def discriminator(self, inputs, embed, is_training=True, reuse=False):
+    @contextmanager
+    def tower_scope(self, index):
+        """The device and name scope of the ops of tower index (none with a single tower)"""
+        if self.num_towers == 1:
+            yield
+        else:
+            with tf.device(self.tower_device % index), tf.name_scope('tower_%d/' % index):
+                yield
+
+    def build_tower(self, z, phi_inputs, real_images, wrong_images, reuse=False):
+        """Builds the generator and the discriminator passes of a slice of the batch and returns their outputs"""
+        tower = {'G': self.generator(z, phi_inputs, reuse=reuse)}
+        if self.fused_discriminator:
+            # A single discriminator pass over the synthetic, matching and mismatching batches. Every batch is still
+            # batch normalized with its own statistics.
+            d_inputs = tf.concat([tower['G'], real_images, wrong_images], axis=0)
+            d_embed = tf.tile(phi_inputs, [3, 1])
+            D, D_logits = self.discriminator(d_inputs, d_embed, reuse=reuse, groups=3)
+            tower['D_synthetic'], tower['D_real_match'], tower['D_real_mismatch'] = tf.split(D, 3)
+            tower['D_synthetic_logits'], tower['D_real_match_logits'], tower['D_real_mismatch_logits'] = \
+                tf.split(D_logits, 3)
+        else:
+            tower['D_synthetic'], tower['D_synthetic_logits'] = self.discriminator(tower['G'], phi_inputs,
+                                                                                   reuse=reuse)
+            tower['D_real_match'], tower['D_real_match_logits'] = self.discriminator(real_images, phi_inputs,
+                                                                                     reuse=True)
+            tower['D_real_mismatch'], tower['D_real_mismatch_logits'] = self.discriminator(wrong_images, phi_inputs,
+                                                                                           reuse=True)
+        return tower
+
+    def discriminator(self, inputs, embed, is_training=True, reuse=False, groups=1):
+        """groups is the number of batches concatenated in inputs, which are batch normalized separately"""
         s16 = self.output_size / 16
 
         with tf.variable_scope("d_net", reuse=reuse):
@@ -60,30 +131,30 @@ class GanCls(object):
                                       kernel_initializer=self.w_init)
             net_h1 = tf.layers.conv2d(inputs=net_ho, filters=self.df_dim * 2, kernel_size=(4, 4), strides=(2, 2),
                                       padding='same', activation=None, kernel_initializer=self.w_init)
-            net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init,
+            net_h1 = batch_norm(net_h1, train=is_training, init=self.batch_norm_init, groups=groups,
                                 act=lambda l: tf.nn.leaky_relu(l, 0.2))
             net_h2 = tf.layers.conv2d(inputs=net_h1, filters=self.df_dim * 4, kernel_size=(4, 4), strides=(2, 2),
                                       padding='same', activation=None, kernel_initializer=self.w_init)
-            net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init,
+            net_h2 = batch_norm(net_h2, train=is_training, init=self.batch_norm_init, groups=groups,
                                 act=lambda l: tf.nn.leaky_relu(l, 0.2))
             net_h3 = tf.layers.conv2d(inputs=net_h2, filters=self.df_dim * 8, kernel_size=(4, 4), strides=(2, 2),
                                       padding='same', activation=None, kernel_initializer=self.w_init)
-            net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init,
+            net_h3 = batch_norm(net_h3, train=is_training, init=self.batch_norm_init, groups=groups,
                                 act=None)
             # --------------------------------------------------------
 
             # Residual layer
             net = tf.layers.conv2d(inputs=net_h3, filters=self.df_dim * 2, kernel_size=(1, 1), strides=(1, 1),
                                    padding='valid', activation=None, kernel_initializer=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init,
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, groups=groups,
                              act=lambda l: tf.nn.leaky_relu(l, 0.2))
             net = tf.layers.conv2d(inputs=net, filters=self.df_dim * 2, kernel_size=(3, 3), strides=(1, 1),
                                    padding='same', activation=None, kernel_initializer=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init,
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, groups=groups,
                              act=lambda l: tf.nn.leaky_relu(l, 0.2))
             net = tf.layers.conv2d(inputs=net, filters=self.df_dim * 8, kernel_size=(3, 3), strides=(1, 1),
                                    padding='same', activation=None, kernel_initializer=self.w_init)
-            net = batch_norm(net, train=is_training, init=self.batch_norm_init,
+            net = batch_norm(net, train=is_training, init=self.batch_norm_init, groups=groups,
                              act=None)
             net_h4 = tf.add(net_h3, net)
             net_h4 = tf.nn.leaky_relu(net_h4, 0.2)
@@ -100,7 +171,7 @@ class GanCls(object):
 
             net_h4 = tf.layers.conv2d(inputs=net_h4_concat, filters=self.df_dim * 8, kernel_size=(1, 1), strides=(1, 1),
                                       padding='valid', activation=None, kernel_initializer=self.w_init)
-            net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init,
+            net_h4 = batch_norm(net_h4, train=is_training, init=self.batch_norm_init, groups=groups,
                                 act=lambda l: tf.nn.leaky_relu(l, 0.2))
 
             net_logits = tf.layers.conv2d(inputs=net_h4, filters=1, kernel_size=(s16, s16), strides=(s16, s16),
@@ -0,0 +1,86 @@
+"""
+Scaling report of the multi-tower GanCls training: the training steps per second for every number of towers.
+
+The steps are run on random batches, so the report measures the model only, not the input pipeline.
+
+Usage: python -m models.gancls.scaling --cfg ./models/gancls/cfg/flowers.yml --towers 1,2,4,8 --steps 50
+"""
+
+import copy
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from models.gancls.model import GanCls
+from models.gancls.trainer import GanClsTrainer
+from utils.config import config_from_yaml
+
+flags = tf.app.flags
+flags.DEFINE_string('cfg', './models/gancls/cfg/flowers.yml', 'Relative path to the config of the model')
+flags.DEFINE_string('towers', '1,2,4,8', 'The comma separated numbers of towers to measure')
+flags.DEFINE_integer('steps', 50, 'The number of timed training steps per number of towers')
+flags.DEFINE_integer('warmup', 5, 'The number of untimed training steps run first')
+FLAGS = flags.FLAGS
+
+
+def steps_per_second(cfg, num_towers, steps, warmup):
+    """Returns the number of D and G training steps per second of GanCls with num_towers towers"""
+    cfg = copy.deepcopy(cfg)
+    cfg.TRAIN.TOWERS.NUM = num_towers
+
+    run_config = tf.ConfigProto()
+    run_config.gpu_options.allow_growth = True
+    run_config.intra_op_parallelism_threads = cfg.TRAIN.TOWERS.INTRA_OP_THREADS
+    run_config.inter_op_parallelism_threads = cfg.TRAIN.TOWERS.INTER_OP_THREADS
+    run_config.device_count['CPU'] = num_towers
+
+    with tf.Graph().as_default(), tf.Session(config=run_config) as sess:
+        model = GanCls(cfg)
+        trainer = GanClsTrainer(sess, model, None, cfg)
+        trainer.define_losses()
+        sess.run(tf.global_variables_initializer())
+
+        rng = np.random.RandomState(0)
+        images = rng.randint(0, 256, [model.batch_size] + model.image_dims).astype(np.uint8)
+        if not cfg.MODEL.UINT8_INPUTS:
+            images = images.astype(np.float32) * (2. / 255) - 1.
+        feed_dict = {
+            model.inputs: images,
+            model.wrong_inputs: images[::-1],
+            model.phi_inputs: rng.normal(0, 1, [model.batch_size, model.embed_dim]).astype(np.float32),
+            model.z: rng.normal(0, 1, [model.batch_size, model.z_dim]).astype(np.float32),
+        }
+
+        for step in range(warmup + steps):
+            if step == warmup:
+                start_time = time.time()
+            if cfg.TRAIN.COMBINED_STEP:
+                sess.run(trainer.DG_optim, feed_dict=feed_dict)
+            else:
+                sess.run(trainer.D_optim, feed_dict=feed_dict)
+                sess.run(trainer.G_optim, feed_dict=feed_dict)
+        return steps / (time.time() - start_time)
+
+
+def main(_):
+    cfg = config_from_yaml(FLAGS.cfg)
+    tower_counts = [int(num) for num in FLAGS.towers.split(',')]
+
+    results = []
+    for num_towers in tower_counts:
+        rate = steps_per_second(cfg, num_towers, FLAGS.steps, FLAGS.warmup)
+        results.append((num_towers, rate))
+        print('%d towers: %.3f steps/s' % (num_towers, rate))
+
+    print('\nBatch size: %d' % cfg.TRAIN.BATCH_SIZE)
+    print('%8s %10s %10s %8s %10s' % ('towers', 'steps/s', 'images/s', 'speedup', 'efficiency'))
+    base_towers, base_rate = results[0]
+    for num_towers, rate in results:
+        speedup = rate / base_rate
+        print('%8d %10.3f %10.1f %8.2f %10.2f' % (num_towers, rate, rate * cfg.TRAIN.BATCH_SIZE, speedup,
+                                                   speedup * base_towers / num_towers))
+
+
+if __name__ == '__main__':
+    tf.app.run()
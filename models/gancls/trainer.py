@@ -1,54 +1,102 @@
 from random import randint
 
 import tensorflow as tf
+from models.gancls.input_pipeline import GanClsInputPipeline
 from models.gancls.model import GanCls
+from utils.ops import average_gradients
+from utils.profiling import StepTracer
 from utils.utils import save_images, get_balanced_factorization
-from utils.saver import save, load
+from utils.saver import CheckpointManager, load, load_training_state
+from utils.distributed import Cluster
+from utils.summary import AsyncSummaryWriter
+from utils.timing import StepTimer
 from preprocess.dataset import TextDataset
+from preprocess.prefetch import BatchPrefetcher
 import numpy as np
 import time
 
 
 class GanClsTrainer(object):
-    def __init__(self, sess: tf.Session, model: GanCls, dataset: TextDataset, cfg):
+    def __init__(self, sess: tf.Session, model: GanCls, dataset: TextDataset, cfg,
+                 input_pipeline: GanClsInputPipeline=None, cluster: Cluster=None):
         self.sess = sess
         self.model = model
         self.dataset = dataset
         self.cfg = cfg
+        self.input_pipeline = input_pipeline
+        # Only the chief of a distributed training writes the summaries, the samples and the checkpoints
+        self.cluster = cluster
+        self.is_chief = cluster is None or cluster.is_chief
 
-    def define_losses(self):
-        self.D_synthetic_loss = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(logits=self.model.D_synthetic_logits,
-                                                    labels=tf.zeros_like(self.model.D_synthetic)))
-        self.D_real_match_loss = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(logits=self.model.D_real_match_logits,
-                                                    labels=tf.fill(self.model.D_real_match.get_shape(), 0.9)))
-        self.D_real_mismatch_loss = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(logits=self.model.D_real_mismatch_logits,
-                                                    labels=tf.zeros_like(self.model.D_real_mismatch)))
-        self.G_loss = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(logits=self.model.D_synthetic_logits,
-                                                    labels=tf.ones_like(self.model.D_synthetic)))
-
-        alpha = self.cfg.TRAIN.COEFF.ALPHA_MISMATCH_LOSS
-        self.D_loss = self.D_real_match_loss + alpha * self.D_real_mismatch_loss + (1.0 - alpha) * self.D_synthetic_loss
-
-        self.G_loss_summ = tf.summary.scalar("g_loss", self.G_loss)
-        self.D_loss_summ = tf.summary.scalar("d_loss", self.D_loss)
+    def tower_losses(self, tower):
+        """Returns the D_synthetic, D_real_match, D_real_mismatch and G losses of a tower of the model"""
+        d_synthetic_loss = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower['D_synthetic_logits'],
+                                                    labels=tf.zeros_like(tower['D_synthetic'])))
+        d_real_match_loss = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower['D_real_match_logits'],
+                                                    labels=tf.fill(tower['D_real_match'].get_shape(), 0.9)))
+        d_real_mismatch_loss = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower['D_real_mismatch_logits'],
+                                                    labels=tf.zeros_like(tower['D_real_mismatch'])))
+        g_loss = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower['D_synthetic_logits'],
+                                                    labels=tf.ones_like(tower['D_synthetic'])))
+        return d_synthetic_loss, d_real_match_loss, d_real_mismatch_loss, g_loss
 
+    def define_losses(self):
         t_vars = tf.trainable_variables()
 
         self.d_vars = [var for var in t_vars if 'd_net' in var.name]
         self.g_vars = [var for var in t_vars if 'g_net' in var.name]
 
+        d_opt = tf.train.AdamOptimizer(self.cfg.TRAIN.D_LR, beta1=self.cfg.TRAIN.D_BETA_DECAY)
+        g_opt = tf.train.AdamOptimizer(self.cfg.TRAIN.G_LR, beta1=self.cfg.TRAIN.G_BETA_DECAY)
+        d_global_step = g_global_step = None
+        if self.cluster is not None:
+            d_opt = self.cluster.wrap_optimizer(d_opt)
+            g_opt = self.cluster.wrap_optimizer(g_opt)
+            # The number of D and G updates applied by all the workers
+            d_global_step = tf.Variable(0, trainable=False, name='d_global_step', dtype=tf.int64)
+            g_global_step = tf.Variable(0, trainable=False, name='g_global_step', dtype=tf.int64)
+        alpha = self.cfg.TRAIN.COEFF.ALPHA_MISMATCH_LOSS
+
+        # Every tower computes the losses and the gradients of its slice of the batch on its own device
+        tower_losses, tower_d_grads, tower_g_grads = [], [], []
+        for i, tower in enumerate(self.model.towers):
+            with self.model.tower_scope(i):
+                d_synthetic_loss, d_real_match_loss, d_real_mismatch_loss, g_loss = self.tower_losses(tower)
+                d_loss = d_real_match_loss + alpha * d_real_mismatch_loss + (1.0 - alpha) * d_synthetic_loss
+                tower_losses.append([d_synthetic_loss, d_real_match_loss, d_real_mismatch_loss, g_loss, d_loss])
+                tower_d_grads.append(d_opt.compute_gradients(d_loss, var_list=self.d_vars,
+                                                             colocate_gradients_with_ops=True))
+                tower_g_grads.append(g_opt.compute_gradients(g_loss, var_list=self.g_vars,
+                                                             colocate_gradients_with_ops=True))
+
+        # The towers have the same batch size, so the mean of their losses is the loss of the whole batch
+        self.D_synthetic_loss, self.D_real_match_loss, self.D_real_mismatch_loss, self.G_loss, self.D_loss = [
+            tf.add_n(losses) / len(losses) if len(losses) > 1 else losses[0] for losses in zip(*tower_losses)]
+        d_grads = average_gradients(tower_d_grads)
+        g_grads = average_gradients(tower_g_grads)
+
         self.saver = tf.train.Saver(max_to_keep=self.cfg.TRAIN.CHECKPOINTS_TO_KEEP)
 
-        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
-        with tf.control_dependencies(update_ops):
-            self.D_optim = tf.train.AdamOptimizer(self.cfg.TRAIN.D_LR, beta1=self.cfg.TRAIN.D_BETA_DECAY) \
-                .minimize(self.D_loss, var_list=self.d_vars)
-            self.G_optim = tf.train.AdamOptimizer(self.cfg.TRAIN.G_LR, beta1=self.cfg.TRAIN.G_BETA_DECAY) \
-                .minimize(self.G_loss, var_list=self.g_vars)
+        with tf.control_dependencies(self.model.update_ops):
+            self.D_optim = d_opt.apply_gradients(d_grads, global_step=d_global_step)
+            self.G_optim = g_opt.apply_gradients(g_grads, global_step=g_global_step)
+
+            # The D and G steps in a single run, the G gradients reusing the forward pass of the D step. D is only
+            # updated once all the gradients are computed, then G is updated. A SyncReplicasOptimizer can only apply
+            # its gradients once, so there is no combined step in synchronous distributed training.
+            self.DG_optim = None
+            if self.cfg.TRAIN.COMBINED_STEP:
+                with tf.control_dependencies([grad for grad, _ in d_grads + g_grads if grad is not None]):
+                    d_step = d_opt.apply_gradients(d_grads, global_step=d_global_step)
+                with tf.control_dependencies([d_step]):
+                    self.DG_optim = g_opt.apply_gradients(g_grads, global_step=g_global_step)
+
+        if self.cluster is not None:
+            self.cluster.define_init_ops()
 
     def define_summaries(self):
         self.D_synthetic_summ = tf.summary.histogram('d_synthetic_sum', self.model.D_synthetic)
@@ -63,26 +111,71 @@ class GanClsTrainer(object):
         self.G_loss_summ = tf.summary.scalar("g_loss", self.G_loss)
         self.D_loss_summ = tf.summary.scalar("d_loss", self.D_loss)
 
-        self.G_merged_summ = tf.summary.merge([self.G_summ, self.G_loss_summ])
-        self.D_merged_summ = tf.summary.merge([self.D_real_mismatch_summ,
-                                               self.D_real_match_summ,
-                                               self.D_synthetic_summ,
-                                               self.D_synthetic_loss_summ,
-                                               self.D_real_mismatch_loss_summ,
-                                               self.D_real_match_loss_summ,
-                                               self.D_loss_summ])
+        # The cheap scalar summaries and the expensive (histogram and image) ones are evaluated at their own period
+        self.scalar_merged_summ = tf.summary.merge([self.G_loss_summ, self.D_loss_summ])
+        self.full_merged_summ = tf.summary.merge([self.G_summ,
+                                                  self.z_sum,
+                                                  self.D_real_mismatch_summ,
+                                                  self.D_real_match_summ,
+                                                  self.D_synthetic_summ,
+                                                  self.D_synthetic_loss_summ,
+                                                  self.D_real_mismatch_loss_summ,
+                                                  self.D_real_match_loss_summ])
+
+        self.writer = None
+        if self.is_chief:
+            self.writer = AsyncSummaryWriter(tf.summary.FileWriter(self.cfg.LOGS_DIR, self.sess.graph),
+                                             self.cfg.TRAIN.SUMMARY.QUEUE_SIZE)
+
+    def summaries_due(self, counter):
+        """Returns the summary ops to evaluate at step counter"""
+        summaries = []
+        if not self.is_chief:
+            return summaries
+        if np.mod(counter, self.cfg.TRAIN.SUMMARY.SCALAR_PERIOD) == 0:
+            summaries.append(self.scalar_merged_summ)
+        if np.mod(counter, self.cfg.TRAIN.SUMMARY.FULL_PERIOD) == 0:
+            summaries.append(self.full_merged_summ)
+        return summaries
 
-        self.writer = tf.summary.FileWriter(self.cfg.LOGS_DIR, self.sess.graph)
+    def next_feed_dict(self, batches: BatchPrefetcher):
+        """Prepares the inputs of the next training step and returns the feed_dict of its D and G steps"""
+        if self.input_pipeline is not None:
+            # The batch is loaded in the graph once and read by both the D and the G steps
+            self.input_pipeline.load(self.sess)
+            return {}
+
+        images, wrong_images, embed, _, _ = batches.next_batch()
+        batch_z = np.random.normal(0, 1, [self.model.batch_size, self.model.z_dim]).astype(np.float32)
+        return {
+            self.model.inputs: images,
+            self.model.wrong_inputs: wrong_images,
+            self.model.phi_inputs: embed,
+            self.model.z: batch_z
+        }
+
+    def training_state(self, batches: BatchPrefetcher):
+        """The dataset state right after the last batch trained on, saved with the checkpoints"""
+        if self.input_pipeline is not None:
+            return self.input_pipeline.get_state()
+        return batches.get_state()
+
+    def device_scope(self):
+        """The device scope of the training graph, placing the variables on the ps tasks of a cluster"""
+        return tf.device(self.cluster.device_setter() if self.cluster is not None else None)
 
     def train(self):
-        self.define_losses()
-        self.define_summaries()
+        with self.device_scope():
+            self.define_losses()
+            self.define_summaries()
 
-        tf.global_variables_initializer().run()
+        if self.is_chief:
+            tf.global_variables_initializer().run()
 
         sample_z = np.random.normal(0, 1, size=(self.model.sample_num, self.model.z_dim))
         _, sample_embed, _, captions = self.dataset.test.next_batch_test(self.model.sample_num,
-                                                                         randint(0, self.dataset.test.num_examples), 1)
+                                                                         randint(0, self.dataset.test.num_examples), 1,
+                                                                         images=False)
         sample_embed = np.squeeze(sample_embed, axis=0)
         print("sample_embed.shape: ", sample_embed.shape)
 
@@ -94,73 +187,156 @@ class GanClsTrainer(object):
 
         counter = 1
         start_time = time.time()
-        could_load, checkpoint_counter = load(self.saver, self.sess, self.cfg.CHECKPOINT_DIR)
+        could_load, checkpoint_counter = False, 0
+        if self.is_chief:
+            could_load, checkpoint_counter = load(self.saver, self.sess, self.cfg.CHECKPOINT_DIR)
         if could_load:
             counter = checkpoint_counter
             print(" [*] Load SUCCESS")
-        else:
+
+            # Continue from the position of the dataset cursor at the time of the checkpoint
+            state = load_training_state(self.cfg.CHECKPOINT_DIR)
+            if state is not None:
+                self.dataset.train.set_state(state)
+        elif self.is_chief:
             print(" [!] Load failed...")
 
-        for epoch in range(self.cfg.TRAIN.EPOCH):
-            # Updates per epoch are given by the training data size / batch size
-            updates_per_epoch = self.dataset.train.num_examples // self.model.batch_size
-
-            # Display the captions of the sampled images
-            print('\nCaptions of the sampled x:')
-            for caption_idx, caption_batch in enumerate(captions):
-                print('{}: {}'.format(caption_idx + 1, caption_batch[0]))
-            print()
-
-            for idx in range(0, updates_per_epoch):
-                images, wrong_images, embed, _, _ = self.dataset.train.next_batch(self.model.batch_size, 4,
-                                                                                  embeddings=True,
-                                                                                  wrong_img=True)
-                batch_z = np.random.normal(0, 1, [self.model.batch_size, self.model.z_dim]).astype(np.float32)
-
-                # Update D network
-                _, err_d_real_match, err_d_real_mismatch, err_d_fake, err_d, summary_str = self.sess.run(
-                    [self.D_optim, self.D_real_match_loss, self.D_real_mismatch_loss, self.D_synthetic_loss,
-                     self.D_loss, self.D_merged_summ],
-                    feed_dict={
-                        self.model.inputs: images,
-                        self.model.wrong_inputs: wrong_images,
-                        self.model.phi_inputs: embed,
-                        self.model.z: batch_z
-                    })
-                self.writer.add_summary(summary_str, counter)
-
-                # Update G network
-                _, err_g, summary_str = self.sess.run([self.G_optim, self.G_loss, self.G_merged_summ],
-                                                      feed_dict={
-                                                          self.model.inputs: images,
-                                                          self.model.wrong_inputs: wrong_images,
-                                                          self.model.phi_inputs: embed,
-                                                          self.model.z: batch_z
-                                                      })
-                self.writer.add_summary(summary_str, counter)
-
-                counter += 1
-                if np.mod(counter, 10) == 0:
-                    print("Epoch: [%2d] [%4d/%4d] time: %4.4f, d_loss: %.8f, g_loss: %.8f"
-                          % (epoch, idx, updates_per_epoch, time.time() - start_time, err_d, err_g))
-
-                if np.mod(counter, 100) == 0:
-                    try:
-                        samples = self.sess.run(self.model.sampler,
-                                                feed_dict={
-                                                            self.model.z_sample: sample_z,
-                                                            self.model.phi_sample: sample_embed,
-                                                          })
-                        save_images(samples, get_balanced_factorization(samples.shape[0]),
-                                    '{}train_{:02d}_{:04d}.png'.format(self.cfg.SAMPLE_DIR, epoch, idx))
-                        print("[Sample] d_loss: %.8f, g_loss: %.8f" % (err_d, err_g))
-
-                    except Exception as e:
-                        print("Failed to generate sample image")
-                        print(type(e))
-                        print(e.args)
-                        print(e)
-
-                if np.mod(counter, 500) == 2:
-                    save(self.saver, self.sess, self.cfg.CHECKPOINT_DIR, counter)
+        # The other workers of a cluster start from the variables restored by the chief
+        if self.cluster is not None and self.is_chief:
+            self.cluster.set_ready(self.sess)
+        elif self.cluster is not None:
+            self.cluster.wait_for_variables(self.sess)
+
+        checkpoints = CheckpointManager(self.sess, self.cfg.CHECKPOINT_DIR,
+                                        max_to_keep=self.cfg.TRAIN.CHECKPOINTS_TO_KEEP,
+                                        keep_checkpoint_every_n_hours=self.cfg.TRAIN.CHECKPOINT.KEEP_EVERY_N_HOURS,
+                                        save_steps=self.cfg.TRAIN.CHECKPOINT.STEPS,
+                                        save_secs=self.cfg.TRAIN.CHECKPOINT.SECS, is_chief=self.is_chief)
+
+        coord = tf.train.Coordinator()
+        if self.cluster is not None:
+            self.sess.run(tf.local_variables_initializer())
+            self.cluster.start(self.sess, coord)
+
+        if self.cfg.TRAIN.PRECOMPUTE_EMBEDDING_MEANS:
+            self.dataset.train.precompute_embedding_means(self.cfg.TRAIN.NUM_EMBEDDINGS)
+
+        batches = None
+        if self.input_pipeline is not None:
+            self.input_pipeline.initialize(self.sess)
+        else:
+            batches = BatchPrefetcher(self.dataset.train, self.model.batch_size,
+                                      num_workers=self.cfg.TRAIN.PREFETCH.WORKERS,
+                                      queue_size=self.cfg.TRAIN.PREFETCH.QUEUE_SIZE,
+                                      use_processes=self.cfg.TRAIN.PREFETCH.PROCESSES,
+                                      window=self.cfg.TRAIN.NUM_EMBEDDINGS, embeddings=True, wrong_img=True,
+                                      wrong_from_batch=self.cfg.TRAIN.WRONG_IMG_FROM_BATCH,
+                                      normalize=not self.cfg.MODEL.UINT8_INPUTS)
+        # The time of every phase of the training steps, reported every TRAIN.TIMING.PERIOD steps
+        timer = StepTimer(self.cfg.LOGS_DIR if self.is_chief else None, window=self.cfg.TRAIN.TIMING.WINDOW)
+        # The runs of the steps in PROFILE.TRAIN_STEPS are traced (by the chief of a cluster)
+        tracer = StepTracer(self.cfg.PROFILE.DIR, self.cfg.PROFILE.TRAIN_STEPS if self.is_chief else [],
+                            self.cfg.PROFILE.TOP)
+        # The G loss is only computed by the G updates, so the step of the last one is reported with it
+        err_g, err_g_counter = 0., -1
+
+        try:
+            for epoch in range(self.cfg.TRAIN.EPOCH):
+                # Updates per epoch are given by the training data size / batch size, the workers of a cluster sharing
+                # the epoch
+                num_workers = self.cluster.num_workers if self.cluster is not None else 1
+                updates_per_epoch = self.dataset.train.num_examples // (self.model.batch_size * num_workers)
+
+                # Display the captions of the sampled images
+                print('\nCaptions of the sampled x:')
+                for caption_idx, caption_batch in enumerate(captions):
+                    print('{}: {}'.format(caption_idx + 1, caption_batch[0]))
+                print()
+
+                for idx in range(0, updates_per_epoch):
+                    timer.start_step()
+                    with timer.time('data'):
+                        feed_dict = self.next_feed_dict(batches)
+
+                    # G is updated once every N_CRITIC D updates
+                    update_g = np.mod(counter, self.cfg.TRAIN.N_CRITIC) == 0
+                    # The summaries are evaluated with the D update, whose forward pass computes all the summarized
+                    # tensors
+                    summaries = self.summaries_due(counter)
+                    if self.cfg.TRAIN.COMBINED_STEP and update_g:
+                        # Update D and G networks in a single run
+                        with timer.time('dg_step'):
+                            _, err_d, err_g, *summary_strs = tracer.run(
+                                self.sess, 'dg_step', [self.DG_optim, self.D_loss, self.G_loss] + summaries,
+                                feed_dict, counter)
+                        err_g_counter = counter
+                    else:
+                        # Update D network
+                        with timer.time('d_step'):
+                            _, err_d, *summary_strs = tracer.run(self.sess, 'd_step',
+                                                                 [self.D_optim, self.D_loss] + summaries, feed_dict,
+                                                                 counter)
+
+                        # Update G network
+                        if update_g:
+                            with timer.time('g_step'):
+                                _, err_g = tracer.run(self.sess, 'g_step', [self.G_optim, self.G_loss], feed_dict,
+                                                      counter)
+                            err_g_counter = counter
+
+                    with timer.time('summaries'):
+                        for summary_str in summary_strs:
+                            self.writer.add_summary(summary_str, counter)
+                    timer.count('summaries', len(summary_strs))
+
+                    counter += 1
+                    if np.mod(counter, 10) == 0:
+                        print("Epoch: [%2d] [%4d/%4d] time: %4.4f, d_loss: %.8f, g_loss: %.8f (step %d), data wait: "
+                              "%.4f" % (epoch, idx, updates_per_epoch, time.time() - start_time, err_d, err_g,
+                                        err_g_counter, timer.mean('data')))
+
+                    if np.mod(counter, 100) == 0 and self.is_chief:
+                        with timer.time('sample'):
+                            try:
+                                samples = self.sess.run(self.model.sampler,
+                                                        feed_dict={
+                                                                    self.model.z_sample: sample_z,
+                                                                    self.model.phi_sample: sample_embed,
+                                                                  })
+                                save_images(samples, get_balanced_factorization(samples.shape[0]),
+                                            '{}train_{:02d}_{:04d}.png'.format(self.cfg.SAMPLE_DIR, epoch, idx))
+                                print("[Sample] d_loss: %.8f, g_loss: %.8f (step %d)" % (err_d, err_g, err_g_counter))
+
+                            except Exception as e:
+                                print("Failed to generate sample image")
+                                print(type(e))
+                                print(e.args)
+                                print(e)
+
+                    if tracer.active(counter - 1):
+                        # An extra traced run of the sampler, the inference of the generator
+                        with timer.time('sample'):
+                            tracer.run(self.sess, 'sampler', self.model.sampler,
+                                       {self.model.z_sample: sample_z, self.model.phi_sample: sample_embed},
+                                       counter - 1)
+
+                    with timer.time('checkpoint'):
+                        if checkpoints.maybe_save(counter, lambda: self.training_state(batches)):
+                            timer.count('checkpoints')
+
+                    timer.end_step(self.model.batch_size)
+                    if np.mod(counter, self.cfg.TRAIN.TIMING.PERIOD) == 0:
+                        report = timer.report(counter, self.writer)
+                        print(timer.format(*report))
+
+            checkpoints.save(counter, self.training_state(batches))
+        finally:
+            # The queued batches, the summaries and the checkpoint being written are not lost on errors
+            checkpoints.wait()
+            if batches is not None:
+                batches.close()
+            coord.request_stop()
+            if self.writer is not None:
+                self.writer.close()
+        print('Waited %.2fs for the input pipeline in %d steps' % (timer.totals.get('data', 0.), timer.num_steps))
 
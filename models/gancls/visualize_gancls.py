@@ -34,7 +34,7 @@ class GanClsVisualizer(object):
 
             # Interpolation in z space:
             # ---------------------------------------------------------------------------------------------------------
-            _, cond, _, captions = self.dataset.test.next_batch_test(1, dataset_pos, 1)
+            _, cond, _, captions = self.dataset.test.next_batch_test(1, dataset_pos, 1, images=False)
             cond = np.squeeze(cond, axis=0)
             caption = captions[0][0]
 
@@ -45,7 +45,7 @@ class GanClsVisualizer(object):
             # Interpolation in embedding space:
             # ---------------------------------------------------------------------------------------------------------
 
-            _, cond, _, caps = self.dataset.test.next_batch_test(2, dataset_pos, 1)
+            _, cond, _, caps = self.dataset.test.next_batch_test(2, dataset_pos, 1, images=False)
             cond = np.squeeze(cond, axis=0)
             cond1, cond2 = cond[0], cond[1]
             cap1, cap2 = caps[0][0], caps[1][0]
@@ -62,7 +62,7 @@ class GanClsVisualizer(object):
 
             # Generate captioned image
             # ---------------------------------------------------------------------------------------------------------
-            _, conditions, _, captions = self.dataset.test.next_batch_test(1, dataset_pos, 1)
+            _, conditions, _, captions = self.dataset.test.next_batch_test(1, dataset_pos, 1, images=False)
             conditions = np.squeeze(conditions, axis=0)
             caption = captions[0][0]
             samples = gen_captioned_img(self.sess, gen, conditions, self.model.z_dim, self.model.batch_size)
@@ -74,7 +74,7 @@ class GanClsVisualizer(object):
             print(special_pos)
             # Generate specific image
             # ---------------------------------------------------------------------------------------------------------
-            _, conditions, _, captions = self.dataset.test.next_batch_test(1, special_pos, 1)
+            _, conditions, _, captions = self.dataset.test.next_batch_test(1, special_pos, 1, images=False)
             conditions = np.squeeze(conditions, axis=0)
             caption = captions[0][0]
             samples = gen_captioned_img(self.sess, gen, conditions, self.model.z_dim, self.model.batch_size)
@@ -84,7 +84,7 @@ class GanClsVisualizer(object):
 
         # Generate some images and their closest neighbours
         # ---------------------------------------------------------------------------------------------------------
-        _, conditions, _, _ = self.dataset.test.next_batch_test(self.model.batch_size, dataset_pos, 1)
+        _, conditions, _, _ = self.dataset.test.next_batch_test(self.model.batch_size, dataset_pos, 1, images=False)
         conditions = np.squeeze(conditions)
         samples, neighbours = gen_closest_neighbour_img(self.sess, gen, conditions, self.model.z_dim,
                                                         self.model.batch_size, self.dataset)
@@ -1,6 +1,7 @@
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
 from tensorflow.contrib.slim.python.slim.nets import inception
+from utils.ops import uint8_to_float
 from utils.saver import load
 
 
@@ -18,11 +19,12 @@ def inception_net(images, num_classes, for_training=False, reuse=False):
     return logits, endpoints
 
 
-def load_inception_inference(sess, num_classes, batch_size, checkpoint_dir):
-    """Loads the inception network with the parameters from checkpoint_dir"""
+def load_inception_inference(sess, num_classes, batch_size, checkpoint_dir, uint8_inputs=False):
+    """Loads the inception network with the parameters from checkpoint_dir. With uint8_inputs, the inputs
+    placeholder takes raw uint8 images, which are normalized in the graph."""
     # Build a Graph that computes the logits predictions from the inference model.
-    inputs = tf.placeholder(tf.float32, [batch_size, 299, 299, 3], name='inputs')
-    logits, layers = inception_net(inputs, num_classes)
+    inputs = tf.placeholder(tf.uint8 if uint8_inputs else tf.float32, [batch_size, 299, 299, 3], name='inputs')
+    logits, layers = inception_net(uint8_to_float(inputs), num_classes)
 
     inception_vars = tf.global_variables('InceptionV3')
 
@@ -33,8 +33,7 @@ def main(_):
 
     # We train inception on the test dataset which contains completely other classes from the train dataset
     # (used in GAN training). This is needed for a correct evaluation of the Inception/FID score.
-    filename_test = '%s/test' % datadir
-    dataset.test = dataset.get_data(filename_test)
+    # The test split is loaded on first access by the trainer.
 
     with tf.Session(config=run_config) as sess:
         if cfg.TRAIN.FLAG:
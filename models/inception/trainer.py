@@ -1,6 +1,8 @@
 import tensorflow as tf
 from models.inception.model import inception_net
+from utils.ops import uint8_to_float
 from utils.saver import save, load
+from utils.timing import StepTimer
 from utils.utils import show_all_variables
 from preprocess.dataset import TextDataset
 import numpy as np
@@ -25,9 +27,11 @@ class InceptionTrainer(object):
         self.writer = tf.summary.FileWriter(self.cfg.LOGS_DIR, self.sess.graph)
 
     def define_model(self):
-        self.x = tf.placeholder(tf.float32, [self.cfg.TRAIN.BATCH_SIZE, 299, 299, 3], name='inputs')
+        self.uint8_inputs = self.cfg.MODEL.UINT8_INPUTS
+        self.x = tf.placeholder(tf.uint8 if self.uint8_inputs else tf.float32, [self.cfg.TRAIN.BATCH_SIZE, 299, 299, 3],
+                                name='inputs')
         self.labels = tf.placeholder(tf.int32, [self.cfg.TRAIN.BATCH_SIZE])
-        self.logits, layers = inception_net(self.x, self.cfg.MODEL.CLASSES, for_training=True)
+        self.logits, layers = inception_net(uint8_to_float(self.x), self.cfg.MODEL.CLASSES, for_training=True)
         self.pred = tf.nn.softmax(self.logits)
 
         train_correct_prediction = tf.equal(self.labels, tf.cast(tf.argmax(self.pred, 1), tf.int32))
@@ -81,36 +85,50 @@ class InceptionTrainer(object):
         sys.stdout.flush()
 
         batch_size = self.cfg.TRAIN.BATCH_SIZE
+        # The time of every phase of the training steps, reported every TRAIN.TIMING.PERIOD steps
+        timer = StepTimer(self.cfg.LOGS_DIR, window=self.cfg.TRAIN.TIMING.WINDOW)
         for idx in range(start_point + 1, self.cfg.TRAIN.MAX_STEPS):
             epoch_size = self.dataset.test.num_examples // batch_size
             epoch = idx // epoch_size
 
-            images, _, _, _, labels = self.dataset.test.next_batch(batch_size, labels=True)
+            timer.start_step()
+            with timer.time('data'):
+                images, _, _, _, labels = self.dataset.test.next_batch(batch_size, labels=True,
+                                                                       normalize=not self.uint8_inputs)
 
-            # Bring the labels in a continuous range: [0, num_classes)
-            new_labels = []
-            for label in labels:
-                new_labels.append(self.class_to_idx[label])
+                # Bring the labels in a continuous range: [0, num_classes)
+                new_labels = []
+                for label in labels:
+                    new_labels.append(self.class_to_idx[label])
 
-            assert(np.min(images) >= -1.)
-            assert(np.max(images) <= 1.)
-            assert(np.min(new_labels) >= 0)
-            assert(np.max(new_labels) < 50)  # 20 for flowers, 50 for birds
+                if not self.uint8_inputs:
+                    assert(np.min(images) >= -1.)
+                    assert(np.max(images) <= 1.)
+                assert(np.min(new_labels) >= 0)
+                assert(np.max(new_labels) < 50)  # 20 for flowers, 50 for birds
 
-            feed_dict = {
-                self.x: images,
-                self.labels: new_labels,
-            }
+                feed_dict = {
+                    self.x: images,
+                    self.labels: new_labels,
+                }
 
-            _, err = self.sess.run([self.opt_step, self.loss], feed_dict=feed_dict)
+            with timer.time('train_step'):
+                _, err = self.sess.run([self.opt_step, self.loss], feed_dict=feed_dict)
 
             summary_period = self.cfg.TRAIN.SUMMARY_PERIOD
             if np.mod(idx, summary_period) == 0:
-                summary_str, pred = self.sess.run([self.summary_op, self.pred], feed_dict=feed_dict)
-                self.writer.add_summary(summary_str, idx)
+                with timer.time('summaries'):
+                    summary_str, pred = self.sess.run([self.summary_op, self.pred], feed_dict=feed_dict)
+                    self.writer.add_summary(summary_str, idx)
 
                 print("Epoch: [%2d] [%4d] time: %4.4f, loss: %.8f" % (epoch, idx, time.time() - start_time, err))
 
             if np.mod(idx, 200) == 0:
-                save(self.saver, self.sess, self.cfg.CHECKPOINT_DIR, idx)
+                with timer.time('checkpoint'):
+                    save(self.saver, self.sess, self.cfg.CHECKPOINT_DIR, idx)
+                timer.count('checkpoints')
+
+            timer.end_step(batch_size)
+            if np.mod(idx, self.cfg.TRAIN.TIMING.PERIOD) == 0:
+                print(timer.format(*timer.report(idx, self.writer)))
             sys.stdout.flush()
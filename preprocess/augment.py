@@ -0,0 +1,76 @@
+"""
+Batched data augmentation.
+"""
+
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def crop_windows(images, height, width):
+    """Returns a read-only [N, H - height + 1, W - width + 1, height, width, C] view of all the crops of images"""
+    n, h, w, c = images.shape
+    s = images.strides
+    return as_strided(images, shape=(n, h - height + 1, w - width + 1, height, width, c),
+                      strides=(s[0], s[1], s[2], s[1], s[2], s[3]), writeable=False)
+
+
+def normalize_images(images, out=None):
+    """Maps uint8 images from [0, 255] to float32 images in [-1, 1]"""
+    if out is None:
+        out = np.empty(images.shape, dtype=np.float32)
+    np.copyto(out, images, casting='unsafe')
+    out *= np.float32(2. / 255)
+    out -= np.float32(1.)
+    return out
+
+
+class BatchAugmenter(object):
+    """Random crops and horizontal flips of a whole batch of uint8 images at once.
+
+    All the crop offsets and flips are drawn at once, the crops are gathered from a strided view of the batch and
+    normalized into a float32 output buffer. The output buffers are reused: the result of a call is only valid until
+    num_buffers further calls have been made. Crops which are not normalized are returned as a new uint8 array.
+    """
+
+    def __init__(self, out_size, flip=True, num_buffers=2):
+        self.out_size = out_size
+        self.flip = flip
+        self.num_buffers = num_buffers
+        self._buffers = {}
+        self._next_buffer = 0
+        self._lock = threading.Lock()
+
+    def reserve_buffers(self, num_buffers):
+        """Makes sure at least num_buffers results can be held at the same time"""
+        with self._lock:
+            self.num_buffers = max(self.num_buffers, num_buffers)
+
+    def _get_buffer(self, shape):
+        with self._lock:
+            ring = self._buffers.setdefault(shape, [])
+            idx = self._next_buffer % self.num_buffers
+            self._next_buffer += 1
+            if idx >= len(ring):
+                ring.append(np.empty(shape, dtype=np.float32))
+            return ring[idx]
+
+    def __call__(self, images, rng=np.random, normalize=True):
+        n, h, w, c = images.shape
+        out_h, out_w = self.out_size
+        if h < out_h or w < out_w:
+            raise ValueError('Can not crop {}x{} images from {}x{} images'.format(out_h, out_w, h, w))
+
+        offset_y = rng.randint(h - out_h + 1, size=n)
+        offset_x = rng.randint(w - out_w + 1, size=n)
+        crops = crop_windows(images, out_h, out_w)[np.arange(n), offset_y, offset_x]
+
+        if self.flip:
+            flipped = np.flatnonzero(rng.randint(2, size=n))
+            if len(flipped):
+                crops[flipped] = np.take(crops[flipped], np.arange(out_w - 1, -1, -1), axis=2)
+
+        if not normalize:
+            return crops
+        return normalize_images(crops, out=self._get_buffer((n, out_h, out_w, c)))
@@ -0,0 +1,110 @@
+"""
+Packed caption store.
+
+All the captions of a split are packed into a single store (see preprocess/store.py) holding the UTF-8 bytes of
+every caption back to back, the byte offset of every caption and, for every dataset index, the position of its
+first caption. The store is loaded once, after which a caption lookup is an in-memory slice.
+"""
+
+import os
+import pickle
+import sys
+
+import numpy as np
+
+from preprocess.store import open_store, write_store
+
+CAPTION_STORE_FILENAME = 'captions.store'
+
+
+def caption_path(workdir, filename, class_id):
+    """Returns the path of the text file holding the captions of an image"""
+    name = filename
+    if name.find('jpg/') != -1:  # flowers dataset
+        class_name = 'class_%05d/' % (class_id + 1)  # Class ids are offset by 1 for classification tasks
+        name = name.replace('jpg/', class_name)
+    return '%s/text_c10/%s.txt' % (workdir, name)
+
+
+def read_caption_file(path):
+    with open(path, "r") as f:
+        captions = f.read().split('\n')
+    return [cap for cap in captions if len(cap) > 0]
+
+
+class CaptionStore(object):
+    def __init__(self, row_ptr, offsets, data):
+        self._row_ptr = row_ptr
+        self._offsets = offsets
+        self._data = data
+
+    @classmethod
+    def from_arrays(cls, row_ptr, offsets, data):
+        # The captions are small compared to the images, so copy them in memory once
+        return cls(np.array(row_ptr), np.array(offsets), np.array(data).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        arrays = open_store(path)
+        return cls.from_arrays(arrays['row_ptr'], arrays['offsets'], arrays['data'])
+
+    def __len__(self):
+        return len(self._row_ptr) - 1
+
+    def num_captions(self, idx):
+        return int(self._row_ptr[idx + 1] - self._row_ptr[idx])
+
+    def caption(self, idx, cap_idx):
+        """Returns caption number cap_idx of the image with dataset index idx"""
+        if not 0 <= cap_idx < self.num_captions(idx):
+            raise IndexError('Image %d has no caption %d' % (idx, cap_idx))
+        pos = self._row_ptr[idx] + cap_idx
+        return self._data[self._offsets[pos]:self._offsets[pos + 1]].decode('utf-8')
+
+    def captions(self, idx):
+        """Returns all the captions of the image with dataset index idx"""
+        start, end = self._row_ptr[idx], self._row_ptr[idx + 1]
+        bounds = self._offsets[start:end + 1]
+        return [self._data[bounds[i]:bounds[i + 1]].decode('utf-8') for i in range(end - start)]
+
+
+def pack_captions(captions):
+    """Packs a list with the list of captions of every image into the row_ptr, offsets and data arrays of a store"""
+    row_ptr = [0]
+    offsets = [0]
+    chunks = []
+    for image_captions in captions:
+        for caption in image_captions:
+            chunk = caption.encode('utf-8')
+            chunks.append(chunk)
+            offsets.append(offsets[-1] + len(chunk))
+        row_ptr.append(len(offsets) - 1)
+
+    return {
+        'row_ptr': np.array(row_ptr, dtype=np.int64),
+        'offsets': np.array(offsets, dtype=np.int64),
+        'data': np.frombuffer(b''.join(chunks), dtype=np.uint8),
+    }
+
+
+def build_caption_store(workdir, split_dir):
+    """Packs the captions of all the images of a split (in the order of filenames.pickle) in one caption store"""
+    with open(os.path.join(split_dir, 'filenames.pickle'), 'rb') as f:
+        filenames = pickle.load(f)
+    with open(os.path.join(split_dir, 'class_info.pickle'), 'rb') as f:
+        # Bring classes from range [1: 102] to [0: 101]
+        class_id = np.array(pickle.load(f, encoding='bytes')) - 1
+
+    arrays = pack_captions([read_caption_file(caption_path(workdir, filename, cid))
+                            for filename, cid in zip(filenames, class_id)])
+
+    out_path = os.path.join(split_dir, CAPTION_STORE_FILENAME)
+    write_store(out_path, arrays)
+    print('Packed %d captions of %d images to %s' % (len(arrays['offsets']) - 1, len(filenames), out_path))
+
+
+if __name__ == '__main__':
+    # Usage: python -m preprocess.captions ./data/flowers
+    for data_dir in sys.argv[1:]:
+        for split in ['train', 'test']:
+            build_caption_store(data_dir, os.path.join(data_dir, split))
@@ -3,10 +3,15 @@ Parts of this code are taken from: https://github.com/hanzhanggit/StackGAN/blob/
 """
 
 import numpy as np
-from sklearn.externals import joblib
 import pickle
-import random
 import os
+import threading
+
+from preprocess.augment import BatchAugmenter, normalize_images
+from preprocess.captions import CAPTION_STORE_FILENAME, CaptionStore, caption_path, read_caption_file
+from preprocess.sampling import ClassIndex, CombinationMeanTable, mean_embeddings, pick_in_batch, \
+    sample_caption_indices
+from preprocess.store import EMBEDDING_STORE_FILENAME, image_store_name, open_embedding_store, open_image_store
 
 FINAL_SIZE_TO_ORIG = {
     4: 4,
@@ -19,21 +24,52 @@ FINAL_SIZE_TO_ORIG = {
     299: 360,
     512: 600,
 }
-W_IMSIZE = 400
-H_IMSIZE = 100
+# The size of the full resolution images every smaller image store is derived from
+SOURCE_IMAGE_SIZE = 360
+
+
+class LazyAttribute(object):
+    """An attribute which can be set to a loader function. The loader is only called on the first access."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        self.name = '_lazy_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.name)
+        if callable(value):
+            with self._lock:
+                value = getattr(obj, self.name)
+                if callable(value):
+                    value = value()
+                    setattr(obj, self.name, value)
+        return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.name, value)
+
 
 class Dataset(object):
+    # The images, embeddings and captions can be given as loader functions, so they are only loaded when needed
+    _images = LazyAttribute('images')
+    _embeddings = LazyAttribute('embeddings')
+    _captions = LazyAttribute('captions')
+
     def __init__(self, images, imsize, embeddings=None,
                  filenames=None, workdir=None,
                  labels=None, aug_flag=True,
-                 class_id=None, class_range=None):
+                 class_id=None, class_range=None, captions=None, seed=None):
         self._images = images
         self._embeddings = embeddings
         self._filenames = filenames
+        self._captions = captions
         self.workdir = workdir
         self._labels = labels
         self._epochs_completed = -1
-        self._num_examples = len(images)
+        self._num_examples = len(filenames) if filenames is not None else len(images)
         self._saveIDs = self.saveIDs()
 
         # shuffle on first run
@@ -43,6 +79,12 @@ class Dataset(object):
         self._class_range = class_range
         self._imsize = imsize
         self._perm = None
+        # The dataset indices iterated by next_ids, all of them unless the dataset is sharded
+        self._ids = None
+        self._rng = np.random.RandomState(seed)
+        self._augmenter = BatchAugmenter((imsize, imsize))
+        self._embedding_means = None
+        self._class_index = None
 
     @property
     def images(self):
@@ -64,64 +106,68 @@ class Dataset(object):
     def epochs_completed(self):
         return self._epochs_completed
 
+    @property
+    def rng(self):
+        return self._rng
+
+    def reserve_buffers(self, num_batches):
+        """Makes the augmentation buffers of num_batches batches (with wrong images) valid at the same time"""
+        self._augmenter.reserve_buffers(2 * num_batches)
+
     def saveIDs(self):
         self._saveIDs = np.arange(self._num_examples)
         np.random.shuffle(self._saveIDs)
         return self._saveIDs
 
     def readCaptions(self, filenames, class_id):
-        name = filenames
-        if name.find('jpg/') != -1:  # flowers dataset
-            class_name = 'class_%05d/' % (class_id + 1)  # Class ids are offset by 1 for classification tasks
-            name = name.replace('jpg/', class_name)
-        cap_path = '%s/text_c10/%s.txt' %\
-                   (self.workdir, name)
-        with open(cap_path, "r") as f:
-            captions = f.read().split('\n')
-        captions = [cap for cap in captions if len(cap) > 0]
-        return captions
-
-    def transform(self, images):
-        if self._aug_flag:
-            transformed_images = np.zeros([images.shape[0], W_IMSIZE, H_IMSIZE, 3])
-            ori_size = images.shape[1]
-            print("ori_size:", len(images))
-            for i in range(images.shape[0]):
-                h1 = int(np.floor((ori_size - W_IMSIZE) * np.random.random()))
-                w1 = int(np.floor((ori_size - H_IMSIZE) * np.random.random()))
-                cropped_image = images[i][w1: w1 + W_IMSIZE, h1: h1 + H_IMSIZE, :]
-                if random.random() > 0.5:
-                    cropped_image = np.fliplr(cropped_image)
-                transformed_images[i] = cropped_image
-            return transformed_images
+        return read_caption_file(caption_path(self.workdir, filenames, class_id))
+
+    def get_captions(self, idx):
+        """Returns the captions of the image with dataset index idx, from the caption store if there is one"""
+        if self._captions is not None:
+            return self._captions.captions(idx)
+        return self.readCaptions(self._filenames[idx], self._class_id[idx])
+
+    def get_caption(self, idx, cap_idx):
+        if self._captions is not None:
+            return self._captions.caption(idx, cap_idx)
+        return self.get_captions(idx)[cap_idx]
+
+    def transform(self, images, rng=None, normalize=True, augment=True):
+        """Randomly crops (to imsize x imsize) and flips a batch of uint8 images and normalizes it to [-1, 1].
+        The images are kept as uint8 when normalize is not set, and neither cropped nor flipped when augment is not."""
+        if self._aug_flag and augment:
+            return self._augmenter(images, self._rng if rng is None else rng, normalize)
+        elif normalize:
+            return normalize_images(images)
         else:
-            return images
+            return np.asarray(images)
 
-    def sample_embeddings(self, embeddings, filenames, class_id, sample_num):
+    def sample_embeddings(self, embeddings, ids, sample_num, rng=None):
         """Returns a mean of the specified number of embeddings (5 available per image)"""
+        rng = self._rng if rng is None else rng
         if len(embeddings.shape) == 2 or embeddings.shape[1] == 1:
-            return np.squeeze(embeddings)
+            return np.squeeze(embeddings), []
         else:
             batch_size, embedding_num, _ = embeddings.shape
             # Take every sample_num captions to compute the mean vector
-            sampled_embeddings = []
+            if self._embedding_means is not None and self._embedding_means.k == sample_num:
+                sampled_embeddings, randix = self._embedding_means.sample(ids, rng)
+            else:
+                randix = sample_caption_indices(batch_size, embedding_num, sample_num, rng)
+                sampled_embeddings = mean_embeddings(embeddings, randix)
+
             sampled_captions = []
-            for i in range(batch_size):
-                randix = np.random.choice(embedding_num, sample_num, replace=False)
-                if sample_num == 1:
-                    randix = int(randix)
-                    captions = self.readCaptions(filenames[i],
-                                                 class_id[i])
-                    sampled_captions.append(captions[randix])
-                    sampled_embeddings.append(embeddings[i, randix, :])
-                else:
-                    e_sample = embeddings[i, randix, :]
-                    e_mean = np.mean(e_sample, axis=0)
-                    sampled_embeddings.append(e_mean)
-            sampled_embeddings_array = np.array(sampled_embeddings)
-            return np.squeeze(sampled_embeddings_array), sampled_captions
-
-    def next_batch(self, batch_size, window=None, wrong_img=False, embeddings=False, labels=False):
+            if sample_num == 1:
+                sampled_captions = [self.get_caption(ids[i], int(randix[i, 0])) for i in range(batch_size)]
+            return np.squeeze(sampled_embeddings), sampled_captions
+
+    def precompute_embedding_means(self, k, max_bytes=2 ** 31):
+        """Precomputes the mean embedding of every k-combination of captions, see CombinationMeanTable"""
+        self._embedding_means = CombinationMeanTable(self._embeddings, k, max_bytes)
+
+    def next_batch(self, batch_size, window=None, wrong_img=False, embeddings=False, labels=False,
+                   wrong_from_batch=False, images=True, normalize=True):
         """Return the next `batch_size` examples from this data set.
 
         :arg batch_size: the size of the batch
@@ -129,49 +175,91 @@ class Dataset(object):
         :arg wrong_img: include the mismatching x in the return list
         :arg embeddings: include the text embedding is the return list
         :arg labels: include the class labels in the return list
+        :arg wrong_from_batch: take the mismatching x from the (already transformed) x of the batch when possible
+        :arg images: include the x in the return list (when False, the images are not loaded)
+        :arg normalize: normalize the x to float32 in [-1, 1] (when False, the raw uint8 x are returned)
         """
+        return self.get_batch(self.next_ids(batch_size), window, wrong_img, embeddings, labels, wrong_from_batch,
+                              images, normalize)
+
+    def get_state(self):
+        """Returns the position of the epoch cursor (and the random state), to resume from it with set_state"""
+        # The permutation is replaced, never modified, at every epoch so it does not need to be copied
+        return {
+            'epochs_completed': self._epochs_completed,
+            'index_in_epoch': self._index_in_epoch,
+            'perm': self._perm,
+            'rng': self._rng.get_state(),
+        }
+
+    def set_state(self, state):
+        self._epochs_completed = state['epochs_completed']
+        self._index_in_epoch = state['index_in_epoch']
+        self._perm = state['perm']
+        self._rng.set_state(state['rng'])
+
+    def shard(self, num_shards, index):
+        """Restricts the batches of next_ids to the examples index, index + num_shards, index + 2 * num_shards...
+        e.g. to give every worker of a distributed training its own part of the dataset. Restarts the epoch."""
+        if not 0 <= index < num_shards:
+            raise ValueError('Invalid shard %d of %d' % (index, num_shards))
+        self._ids = np.arange(index, self._num_examples, num_shards)
+        self._index_in_epoch = len(self._ids)
+
+    def next_ids(self, batch_size):
+        """Advances the epoch cursor by `batch_size` examples and returns their dataset indices"""
+        num_ids = len(self._ids) if self._ids is not None else self._num_examples
         start = self._index_in_epoch
         self._index_in_epoch += batch_size
 
-        if self._index_in_epoch > self._num_examples:
+        if self._index_in_epoch > num_ids:
             # Finished epoch
             self._epochs_completed += 1
             # Shuffle the .data
-            self._perm = np.arange(self._num_examples)
-            np.random.shuffle(self._perm)
+            self._perm = self._ids.copy() if self._ids is not None else np.arange(self._num_examples)
+            self._rng.shuffle(self._perm)
 
             # Start next epoch
             start = 0
             self._index_in_epoch = batch_size
-            assert batch_size <= self._num_examples
+            assert batch_size <= num_ids
         end = self._index_in_epoch
+        return self._perm[start:end]
 
-        current_ids = self._perm[start:end]
-        sampled_images = self._images[current_ids]
-        sampled_images = sampled_images.astype(np.float32)
-        sampled_images = sampled_images * (2. / 255) - 1.
-        sampled_images = self.transform(sampled_images)
-        ret_list = [sampled_images]
+    def get_batch(self, current_ids, window=None, wrong_img=False, embeddings=False, labels=False,
+                  wrong_from_batch=False, images=True, normalize=True, rng=None, augment=True):
+        """Builds the batch of the examples with the given dataset indices. See next_batch for the arguments.
+        With augment unset, the images are returned uncropped and unflipped, e.g. to be augmented in the graph.
+
+        The batch only depends on current_ids and rng, so batches can be built concurrently with different rngs.
+        """
+        rng = self._rng if rng is None else rng
+        batch_size = len(current_ids)
+        sampled_images = None
+        if images or (wrong_img and wrong_from_batch):
+            sampled_images = self.transform(self._images[current_ids], rng, normalize, augment)
+        ret_list = [sampled_images if images else None]
 
         if wrong_img:
-            fake_ids = np.random.randint(self._num_examples, size=batch_size)
-            collision_flag = (self._class_id[current_ids] == self._class_id[fake_ids])
-            fake_ids[collision_flag] = (fake_ids[collision_flag] + np.random.randint(100, 200)) % self._num_examples
-
-            sampled_wrong_images = self._images[fake_ids, :, :, :]
-            sampled_wrong_images = sampled_wrong_images.astype(np.float32)
-            sampled_wrong_images = sampled_wrong_images * (2. / 255) - 1.
-            sampled_wrong_images = self.transform(sampled_wrong_images)
+            class_id = self._class_id[current_ids]
+            if wrong_from_batch:
+                wrong_pos = pick_in_batch(class_id, rng)
+                sampled_wrong_images = sampled_images[np.maximum(wrong_pos, 0)]
+                missing = np.flatnonzero(wrong_pos < 0)
+                if len(missing):
+                    fake_ids = self.class_index.sample_other_class(class_id[missing], rng)
+                    sampled_wrong_images[missing] = self.transform(self._images[fake_ids], rng, normalize, augment)
+            else:
+                fake_ids = self.class_index.sample_other_class(class_id, rng)
+                sampled_wrong_images = self.transform(self._images[fake_ids], rng, normalize, augment)
             ret_list.append(sampled_wrong_images)
         else:
             ret_list.append(None)
 
-        if self._embeddings is not None and embeddings:
-            filenames = [self._filenames[i] for i in current_ids]
-            class_id = [self._class_id[i] for i in current_ids]
+        if embeddings and self._embeddings is not None:
             sampled_embeddings, sampled_captions = \
                 self.sample_embeddings(self._embeddings[current_ids],
-                                       filenames, class_id, window)
+                                       current_ids, window, rng)
             ret_list.append(sampled_embeddings)
             ret_list.append(sampled_captions)
         else:
@@ -185,7 +273,7 @@ class Dataset(object):
             ret_list.append(None)
         return ret_list
 
-    def next_batch_test(self, batch_size, start, max_captions):
+    def next_batch_test(self, batch_size, start, max_captions, images=True, normalize=True):
         """Return the next `batch_size` examples from this data set."""
         if (start + batch_size) > self._num_examples:
             end = self._num_examples
@@ -193,22 +281,17 @@ class Dataset(object):
         else:
             end = start + batch_size
 
-        sampled_images = self._images[start:end]
-        sampled_images = sampled_images.astype(np.float32)
-        sampled_images = sampled_images * (2. / 255) - 1.
+        sampled_images = None
+        if images:
+            sampled_images = self._images[start:end]
+            sampled_images = normalize_images(sampled_images) if normalize else np.asarray(sampled_images)
 ####    sampled_images = self.transform(sampled_images)		ここ削ったら動くけど大丈夫かな？
 
         sampled_embeddings = self._embeddings[start:end]
         _, embedding_num, _ = sampled_embeddings.shape
         sampled_embeddings_batchs = []
 
-        sampled_captions = []
-        sampled_filenames = self._filenames[start:end]
-        sampled_class_id = self._class_id[start:end]
-        for i in range(len(sampled_filenames)):
-            captions = self.readCaptions(sampled_filenames[i],
-                                         sampled_class_id[i])
-            sampled_captions.append(captions)
+        sampled_captions = [self.get_captions(idx) for idx in range(start, end)]
 
         for i in range(np.minimum(max_captions, embedding_num)):
             batch = sampled_embeddings[:, i, :]
@@ -221,6 +304,12 @@ class Dataset(object):
     def class_ids(self):
         return self._class_id
 
+    @property
+    def class_index(self):
+        if self._class_index is None:
+            self._class_index = ClassIndex(self._class_id)
+        return self._class_index
+
     def class_to_index(self):
         class_to_idx = {}
         for idx, class_id in enumerate(np.unique(self._class_id)):
@@ -229,12 +318,13 @@ class Dataset(object):
 
 
 class TextDataset(object):
-    def __init__(self, workdir, size):
+    def __init__(self, workdir, size, shuffle_buffer=10000):
         self.size = size
+        self.shuffle_buffer = shuffle_buffer
         if size not in FINAL_SIZE_TO_ORIG:
             raise RuntimeError('Size {} not supported'.format(size))
-        # self.image_filename = '/{}images.pickle'.format(FINAL_SIZE_TO_ORIG[size])
-        self.image_filename = '/360images.pickle'
+        # The images are stored with a margin around the output size, for the random crops
+        self.orig_size = FINAL_SIZE_TO_ORIG[size]
         self.image_shape = [size, size, 3]
         self.image_dim = self.image_shape[0] * self.image_shape[1] * 3
         self.embedding_shape = None
@@ -248,6 +338,8 @@ class TextDataset(object):
 
     @property
     def train(self) -> Dataset:
+        if self._train is None:
+            self._train = self.get_data('%s/train' % self.workdir)
         return self._train
 
     @train.setter
@@ -256,22 +348,58 @@ class TextDataset(object):
 
     @property
     def test(self) -> Dataset:
+        if self._test is None:
+            self._test = self.get_data('%s/test' % self.workdir)
         return self._test
 
     @test.setter
     def test(self, test):
         self._test = test
 
+    def load_images(self, pickle_path):
+        """Memory-maps the image store matching the output size. The crops are never drawn from the full resolution
+        store, which would train the model on a different field of view."""
+        store_path = os.path.join(pickle_path, image_store_name(self.orig_size))
+        if not os.path.exists(store_path):
+            raise RuntimeError('No image store found at %s; run `python -m preprocess.pyramid %s %d` to create it '
+                               '(and `python -m preprocess.store` first to convert the images pickles of an older '
+                               'preprocessing).' % (store_path, self.workdir, self.size))
+        return open_image_store(store_path)
+
+    def load_embeddings(self, pickle_path):
+        """Memory-maps the embedding store of a split, falling back to the (fully loaded) pickle"""
+        store_path = os.path.join(pickle_path, EMBEDDING_STORE_FILENAME)
+        if os.path.exists(store_path):
+            embeddings = open_embedding_store(store_path)
+        else:
+            print('No embedding store found at %s. Loading %s instead; run `python -m preprocess.store` to convert '
+                  'it.' % (store_path, pickle_path + self.embedding_filename))
+            with open(pickle_path + self.embedding_filename, 'rb') as f:
+                embeddings = np.asarray(pickle.load(f, encoding='bytes'), dtype=np.float32)
+        self.embedding_shape = [embeddings.shape[-1]]
+        print('embeddings: ', embeddings.shape, embeddings.dtype)
+        return embeddings
+
+    @staticmethod
+    def load_captions(pickle_path):
+        caption_store_path = os.path.join(pickle_path, CAPTION_STORE_FILENAME)
+        if os.path.exists(caption_store_path):
+            return CaptionStore.load(caption_store_path)
+        print('No caption store found at %s. Captions will be read from text_c10; '
+              'run `python -m preprocess.captions` to pack them.' % caption_store_path)
+        return None
+
     def get_data(self, pickle_path, aug_flag=True) -> Dataset:
-        images = joblib.load(pickle_path + self.image_filename)
-        images = np.array(images)
-        print('Image shape: ', images.shape)
-
-        with open(pickle_path + self.embedding_filename, 'rb') as f:
-            embeddings = pickle.load(f, encoding='bytes')
-            embeddings = np.array(embeddings)
-            self.embedding_shape = [embeddings.shape[-1]]
-            print('embeddings: ', embeddings.shape)
+        """Loads the filenames and classes of a split. The images, embeddings and captions are loaded lazily."""
+        from preprocess.shards import MANIFEST_FILENAME, StreamingDataset
+        if os.path.exists(os.path.join(pickle_path, MANIFEST_FILENAME)):
+            return StreamingDataset(pickle_path, self.image_shape[0], aug_flag, self.shuffle_buffer)
+
+        def images():
+            loaded = self.load_images(pickle_path)
+            print('Image shape: ', loaded.shape)
+            return loaded
+
         with open(pickle_path + '/filenames.pickle', 'rb') as f:
             list_filenames = pickle.load(f)
             print('list_filenames: ', len(list_filenames), list_filenames[0])
@@ -282,9 +410,9 @@ class TextDataset(object):
             print('Class ids:')
             print(np.unique(class_id))
 
-        return Dataset(images, self.image_shape[0], embeddings,
+        return Dataset(images, self.image_shape[0], lambda: self.load_embeddings(pickle_path),
                        list_filenames, self.workdir, class_id,
-                       aug_flag, class_id)
+                       aug_flag, class_id, captions=lambda: self.load_captions(pickle_path))
 
     @property
     def name(self):
@@ -0,0 +1,132 @@
+"""
+Incremental image preprocessing.
+
+A manifest next to the image stores of a split records, for every key, the path, size, modification time and
+SHA-1 hash of its source image and the row it is stored at. A rerun only decodes the images which are new or whose
+content changed. When the rows of the unchanged images do not move (images changed in place or appended at the end
+of filenames.pickle), the stores are patched and grown in place. Otherwise the unchanged rows are copied to new
+stores, which is still much cheaper than decoding them again.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from preprocess.parallel import fill_image_stores, write_image_stores
+from preprocess.store import IMAGES_KEY, create_store, open_image_store, read_header, resize_store
+
+MANIFEST_FILENAME = 'preprocess_manifest.json'
+
+
+def file_hash(path, block_size=2 ** 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def _stores_match(manifest, outputs, out_paths):
+    """Whether the stores at out_paths are the complete outputs recorded by the manifest"""
+    if manifest is None or not manifest['complete'] or manifest['outputs'] != outputs:
+        return False
+    for path in out_paths:
+        if not os.path.exists(path) or read_header(path)['arrays'][0]['shape'][0] != manifest['num_rows']:
+            return False
+    return True
+
+
+def _copy_rows(src_paths, dst_paths, src_rows, dst_rows, chunk_size=1024):
+    for src_path, dst_path in zip(src_paths, dst_paths):
+        src = open_image_store(src_path)
+        dst = open_image_store(dst_path, mode='r+')
+        for start in range(0, len(src_rows), chunk_size):
+            dst[dst_rows[start:start + chunk_size]] = src[src_rows[start:start + chunk_size]]
+        dst.flush()
+
+
+def update_image_stores(keys, source_paths, load_fn, out_paths, shapes, manifest_path, num_workers=None,
+                        chunk_size=64):
+    """Brings the image stores at out_paths up to date with the source images, row i holding the images of keys[i].
+
+    :arg keys: the keys of the images (e.g. the content of filenames.pickle), in the order of the rows
+    :arg source_paths: the path of the source image of every key
+    :arg load_fn: a picklable function returning the list of images (one per output store) of a key
+    :arg out_paths: the paths of the output image stores
+    :arg shapes: the [H, W, C] shape of the images of every output store
+    :arg manifest_path: the path of the manifest of the stores
+    :arg chunk_size: the number of rows written by a worker task, see write_image_stores
+    """
+    outputs = [{'path': os.path.basename(path), 'shape': list(shape)} for path, shape in zip(out_paths, shapes)]
+    manifest = load_manifest(manifest_path)
+    old_entries = manifest['entries'] if _stores_match(manifest, outputs, out_paths) else {}
+    if manifest is not None and not old_entries:
+        print('The image stores do not match %s, rebuilding them' % manifest_path)
+
+    entries = {}
+    copy_src, copy_dst, decode_rows = [], [], []
+    for row, (key, path) in enumerate(zip(keys, source_paths)):
+        stat = os.stat(path)
+        entry = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'row': row}
+        old = old_entries.get(key)
+        if old is not None and old['size'] == entry['size'] and old['mtime'] == entry['mtime']:
+            entry['hash'] = old['hash']
+        else:
+            entry['hash'] = file_hash(path)
+
+        if old is not None and old['hash'] == entry['hash']:
+            copy_src.append(old['row'])
+            copy_dst.append(row)
+        else:
+            decode_rows.append(row)
+        entries[key] = entry
+
+    print('%d unchanged, %d new or changed and %d removed images'
+          % (len(copy_src), len(decode_rows), len(set(old_entries) - set(entries))))
+
+    in_place = bool(old_entries) and copy_src == copy_dst
+    if in_place:
+        if not decode_rows and len(keys) == manifest['num_rows']:
+            print('The image stores are up to date')
+            save_manifest(manifest_path, {'complete': True, 'outputs': outputs, 'num_rows': len(keys),
+                                          'entries': entries})
+            return
+        # An interrupted update leaves the stores in an unknown state, which forces a rebuild on the next run
+        manifest['complete'] = False
+        save_manifest(manifest_path, manifest)
+        for path in out_paths:
+            resize_store(path, len(keys))
+        if decode_rows:
+            fill_image_stores(out_paths, decode_rows, [keys[row] for row in decode_rows], load_fn, num_workers,
+                              chunk_size)
+    elif not copy_src:
+        write_image_stores(keys, load_fn, out_paths, shapes, num_workers, chunk_size)
+    else:
+        tmp_paths = [path + '.tmp' for path in out_paths]
+        for path, shape in zip(tmp_paths, shapes):
+            create_store(path, [(IMAGES_KEY, (len(keys),) + tuple(shape), np.uint8)])
+        _copy_rows(out_paths, tmp_paths, np.array(copy_src), np.array(copy_dst))
+        if decode_rows:
+            fill_image_stores(tmp_paths, decode_rows, [keys[row] for row in decode_rows], load_fn, num_workers,
+                              chunk_size)
+        for tmp_path, path in zip(tmp_paths, out_paths):
+            os.replace(tmp_path, path)
+            print('save to: ', path)
+
+    save_manifest(manifest_path, {'complete': True, 'outputs': outputs, 'num_rows': len(keys), 'entries': entries})
@@ -0,0 +1,138 @@
+"""
+Multiprocess image preprocessing.
+
+The examples are split in chunks processed by a pool of worker processes. The output image stores are created
+upfront and every worker memory-maps them and writes its rows in place, so the decoded images are never pickled
+back to the main process and at most one decoded image per worker is held in memory. The stores are written to
+temporary files which are only renamed once all the rows are written.
+
+The chunks written to the temporary files are checkpointed to a progress file, so an interrupted run resumes from
+the last checkpoint instead of starting over.
+"""
+
+import hashlib
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from preprocess.store import IMAGES_KEY, create_store, open_store
+
+# The output arrays and the image loader of a worker process, set by _init_worker
+_worker_outputs = None
+_worker_load = None
+
+
+def _init_worker(paths, load_fn):
+    global _worker_outputs, _worker_load
+    _worker_outputs = [open_store(path, mode='r+')[IMAGES_KEY] for path in paths]
+    _worker_load = load_fn
+
+
+def _process_chunk(args):
+    idx, rows, keys = args
+    for row, key in zip(rows, keys):
+        for out, image in zip(_worker_outputs, _worker_load(key)):
+            out[row] = image
+    # The rows must be on disk before the chunk is checkpointed
+    for out in _worker_outputs:
+        out.flush()
+    return idx, len(keys)
+
+
+class ChunkProgress(object):
+    """The set of the chunks already written to a set of output files, saved to path at most every save_period
+    seconds. A saved progress is only reused by a run with the same fingerprint."""
+
+    def __init__(self, path, fingerprint, save_period=10.):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.save_period = save_period
+        self.done = set()
+        self._last_save = time.time()
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                progress = json.load(f)
+            if progress['fingerprint'] == fingerprint:
+                self.done = set(progress['done'])
+
+    def mark(self, idx):
+        self.done.add(idx)
+        if time.time() - self._last_save > self.save_period:
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'done': sorted(self.done)}, f)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.time()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def fill_image_stores(paths, rows, keys, load_fn, num_workers=None, chunk_size=64, progress=None):
+    """Writes the images returned by load_fn(keys[i]) to row rows[i] of the existing image stores at paths.
+    The chunks already marked as done in progress (a ChunkProgress) are skipped."""
+    chunks = [(idx, rows[start:start + chunk_size], keys[start:start + chunk_size])
+              for idx, start in enumerate(range(0, len(keys), chunk_size))]
+    done = 0
+    if progress is not None:
+        done = sum(len(chunk[2]) for chunk in chunks if chunk[0] in progress.done)
+        chunks = [chunk for chunk in chunks if chunk[0] not in progress.done]
+        if done:
+            print('Resuming after %d already processed images' % done)
+    num_workers = num_workers or os.cpu_count()
+    print('Processing %d images with %d workers' % (len(keys) - done, num_workers))
+
+    start_time = time.time()
+    start_done = done
+    with Pool(num_workers, initializer=_init_worker, initargs=(paths, load_fn)) as pool:
+        try:
+            for idx, count in pool.imap_unordered(_process_chunk, chunks):
+                if progress is not None:
+                    progress.mark(idx)
+                done += count
+                elapsed = time.time() - start_time
+                print('\rProcessed %d/%d images (%.1f images/s)'
+                      % (done, len(keys), (done - start_done) / max(elapsed, 1e-6)), end="", flush=True)
+        finally:
+            if progress is not None:
+                progress.save()
+    print()
+
+
+def _fingerprint(keys, out_paths, shapes, chunk_size):
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps([list(keys), list(out_paths), [list(shape) for shape in shapes], chunk_size]).encode())
+    return sha1.hexdigest()
+
+
+def write_image_stores(keys, load_fn, out_paths, shapes, num_workers=None, chunk_size=64):
+    """Writes the image stores at out_paths, row i of every store holding the images returned by load_fn(keys[i]).
+
+    :arg keys: the keys (e.g. file names) of the images, in the order of the rows
+    :arg load_fn: a picklable function returning the list of images (one per output store) of a key
+    :arg out_paths: the paths of the output image stores
+    :arg shapes: the [H, W, C] shape of the images of every output store
+    :arg num_workers: the number of worker processes, all the cores by default
+    :arg chunk_size: the number of rows written by a worker task (and the granularity of the checkpoints)
+    """
+    tmp_paths = [path + '.tmp' for path in out_paths]
+    progress = ChunkProgress(out_paths[0] + '.progress', _fingerprint(keys, out_paths, shapes, chunk_size))
+    if not progress.done or not all(os.path.exists(path) for path in tmp_paths):
+        progress.done = set()
+        for path, shape in zip(tmp_paths, shapes):
+            create_store(path, [(IMAGES_KEY, (len(keys),) + tuple(shape), np.uint8)])
+
+    fill_image_stores(tmp_paths, list(range(len(keys))), keys, load_fn, num_workers, chunk_size, progress)
+
+    for tmp_path, path in zip(tmp_paths, out_paths):
+        os.replace(tmp_path, path)
+        print('save to: ', path)
+    progress.remove()
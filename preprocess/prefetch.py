@@ -0,0 +1,110 @@
+"""
+Background prefetching of training batches.
+"""
+
+import collections
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+# The dataset of a worker process, set by _init_worker. The workers are forked, so they inherit it without pickling the
+# (memory-mapped) arrays.
+_worker_dataset = None
+
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _make_batch_in_worker(ids, seed, batch_kwargs):
+    return _worker_dataset.get_batch(ids, rng=np.random.RandomState(seed), **batch_kwargs)
+
+
+class BatchPrefetcher(object):
+    """Prepares the next batches of a Dataset in the background while the current one is being used.
+
+    The dataset indices of every batch are drawn in the calling thread, so the epoch counter and the order of the
+    examples are the same as with Dataset.next_batch. The batches themselves (gather, augmentation, wrong image and
+    embedding sampling) are built by num_workers threads or, if use_processes is set, forked worker processes. At
+    most queue_size batches are prepared ahead.
+
+    A batch returned by next_batch is only valid until the following call of next_batch.
+    """
+
+    def __init__(self, dataset, batch_size, num_workers=2, queue_size=4, use_processes=False, **batch_kwargs):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self._batch_kwargs = batch_kwargs
+        self._use_processes = use_processes
+
+        if use_processes:
+            self._executor = ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('fork'),
+                                                 initializer=_init_worker, initargs=(dataset,))
+        else:
+            # The queued batches and the one being used must not share augmentation buffers
+            dataset.reserve_buffers(queue_size + num_workers + 1)
+            self._executor = ThreadPoolExecutor(num_workers)
+
+        self._pending = collections.deque()
+        self._epochs_completed = dataset.epochs_completed
+        self.wait_time = 0.
+        self.num_batches = 0
+
+        for _ in range(queue_size):
+            self._submit()
+
+    @property
+    def epochs_completed(self):
+        """The epoch of the last batch returned by next_batch"""
+        return self._epochs_completed
+
+    @property
+    def num_examples(self):
+        return self.dataset.num_examples
+
+    def get_state(self):
+        """The dataset state right after the last batch returned by next_batch, see Dataset.get_state"""
+        return self._pending[0][2] if self._pending else self.dataset.get_state()
+
+    def _submit(self):
+        state = self.dataset.get_state()
+        ids = self.dataset.next_ids(self.batch_size)
+        seed = self.dataset.rng.randint(2 ** 31 - 1)
+        if self._use_processes:
+            future = self._executor.submit(_make_batch_in_worker, ids, seed, self._batch_kwargs)
+        else:
+            future = self._executor.submit(self.dataset.get_batch, ids, rng=np.random.RandomState(seed),
+                                           **self._batch_kwargs)
+        self._pending.append((future, self.dataset.epochs_completed, state))
+
+    def next_batch(self):
+        """Returns the next batch, in the same format as Dataset.next_batch"""
+        future, epoch, _ = self._pending.popleft()
+        start_time = time.time()
+        batch = future.result()
+        self.wait_time += time.time() - start_time
+        self.num_batches += 1
+
+        self._epochs_completed = epoch
+        self._submit()
+        return batch
+
+    def average_wait(self):
+        """The average time (in seconds) next_batch had to wait for a batch to be ready"""
+        return self.wait_time / max(self.num_batches, 1)
+
+    def close(self):
+        for future, _, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,64 @@
+"""
+Multi-resolution image stores.
+
+A model with an output size of s is trained on s x s random crops of images of size FINAL_SIZE_TO_ORIG[s] (e.g. 76
+for 64), as in StackGAN. One image store is kept per size, next to the full resolution (360) store of the split,
+so the batches are not read and augmented at a much larger resolution than the one the model consumes.
+
+The smaller stores are square, as the model inputs are. The NLVR images are 400x100, so their aspect ratio is not
+kept: they are squashed to e.g. 76x76, not cropped, and every square crop still covers the whole scene.
+"""
+
+import os
+import sys
+
+import numpy as np
+import scipy.misc
+
+from preprocess.dataset import FINAL_SIZE_TO_ORIG, SOURCE_IMAGE_SIZE
+from preprocess.store import IMAGES_KEY, create_store, image_store_name, open_image_store, open_store
+
+
+def resize_images(images, size):
+    """Bicubically resizes a batch of uint8 [N, H, W, C] images to [N, size, size, C]"""
+    out = np.empty((len(images), size, size, images.shape[-1]), dtype=np.uint8)
+    for i, image in enumerate(images):
+        out[i] = scipy.misc.imresize(image, [size, size], 'bicubic')
+    return out
+
+
+def build_image_store(split_dir, size, source_size=SOURCE_IMAGE_SIZE, chunk_size=256):
+    """Writes the size x size image store of a split from its source_size store, chunk by chunk. Images that are not
+    square (NLVR) are squashed to size x size, not cropped."""
+    source = open_image_store(os.path.join(split_dir, image_store_name(source_size)))
+    out_path = os.path.join(split_dir, image_store_name(size))
+    tmp_path = out_path + '.tmp'
+
+    create_store(tmp_path, [(IMAGES_KEY, (len(source), size, size, source.shape[-1]), np.uint8)],
+                 attrs={'source_size': source_size})
+    images = open_store(tmp_path, mode='r+')[IMAGES_KEY]
+    for start in range(0, len(source), chunk_size):
+        images[start:start + chunk_size] = resize_images(source[start:start + chunk_size], size)
+        print('\rResized %d/%d images to %dx%d' % (min(start + chunk_size, len(source)), len(source), size, size),
+              end="", flush=True)
+    print()
+    images.flush()
+    del images
+    os.replace(tmp_path, out_path)
+
+
+def build_pyramid(split_dir, output_sizes, source_size=SOURCE_IMAGE_SIZE):
+    """Writes the image store matching every model output size in output_sizes (e.g. the 76 store for 64)"""
+    for output_size in output_sizes:
+        size = FINAL_SIZE_TO_ORIG[output_size]
+        if size == source_size or os.path.exists(os.path.join(split_dir, image_store_name(size))):
+            continue
+        build_image_store(split_dir, size, source_size)
+
+
+if __name__ == '__main__':
+    # Usage: python -m preprocess.pyramid ./data/flowers 64 128
+    data_dir = sys.argv[1]
+    sizes = [int(size) for size in sys.argv[2:]]
+    for split in ['train', 'test']:
+        build_pyramid(os.path.join(data_dir, split), sizes)
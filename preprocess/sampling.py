@@ -0,0 +1,92 @@
+"""
+Batched sampling of the caption embeddings.
+"""
+
+import itertools
+
+import numpy as np
+
+
+def sample_caption_indices(batch_size, num_captions, k, rng=np.random):
+    """Draws k distinct caption indices out of num_captions for every row of a batch at once"""
+    if k > num_captions:
+        raise ValueError('Can not sample %d out of %d captions' % (k, num_captions))
+    keys = rng.random_sample((batch_size, num_captions))
+    if k == num_captions:
+        return np.argsort(keys, axis=1)
+    # The indices of the k smallest of n i.i.d. keys form a uniformly random k-subset
+    return np.argpartition(keys, k - 1, axis=1)[:, :k]
+
+
+def mean_embeddings(embeddings, indices):
+    """Gathers embeddings[i, indices[i]] of a [batch_size, num_captions, dim] array and averages them per row"""
+    rows = np.arange(embeddings.shape[0])[:, None]
+    return np.mean(embeddings[rows, indices], axis=1, dtype=np.float32)
+
+
+class CombinationMeanTable(object):
+    """The mean embedding of every k-combination of the captions of every image.
+
+    The table has C(num_captions, k) entries per image, so sampling the mean of k random captions becomes a single
+    index lookup. It is only practical for small k.
+    """
+
+    def __init__(self, embeddings, k, max_bytes=2 ** 31, chunk_size=256):
+        num_examples, num_captions, dim = embeddings.shape
+        self.k = k
+        self.combinations = np.array(list(itertools.combinations(range(num_captions), k)), dtype=np.int64)
+
+        nbytes = num_examples * len(self.combinations) * dim * np.dtype(np.float32).itemsize
+        if nbytes > max_bytes:
+            raise ValueError('The table of the %d-combination means would take %.1fGB (limit is %.1fGB)'
+                             % (k, nbytes / 2. ** 30, max_bytes / 2. ** 30))
+
+        self.table = np.empty((num_examples, len(self.combinations), dim), dtype=np.float32)
+        for start in range(0, num_examples, chunk_size):
+            chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+            self.table[start:start + chunk_size] = np.mean(chunk[:, self.combinations], axis=2)
+
+    def sample(self, ids, rng=np.random):
+        """Returns the mean embeddings of a random k-combination per id and the caption indices of the combinations"""
+        choice = rng.randint(len(self.combinations), size=len(ids))
+        return self.table[ids, choice], self.combinations[choice]
+
+
+class ClassIndex(object):
+    """CSR-style index of the dataset indices of every class, used to draw mismatching (negative) examples.
+
+    The dataset indices are sorted by class, so the examples of class classes[i] are
+    order[offsets[i]:offsets[i] + counts[i]].
+    """
+
+    def __init__(self, class_id):
+        class_id = np.asarray(class_id)
+        self.order = np.argsort(class_id, kind='mergesort')
+        self.classes, self.offsets, self.counts = np.unique(class_id[self.order], return_index=True,
+                                                            return_counts=True)
+        self.num_examples = len(class_id)
+        if len(self.classes) < 2:
+            raise ValueError('Mismatching examples need at least two classes')
+
+    def sample_other_class(self, class_ids, rng=np.random):
+        """Draws, for every class id, a uniformly random dataset index of a different class in O(1)"""
+        pos = np.searchsorted(self.classes, class_ids)
+        start, count = self.offsets[pos], self.counts[pos]
+        # Draw among the examples of all the other classes, then skip over the block of the own class
+        r = (rng.random_sample(len(pos)) * (self.num_examples - count)).astype(np.int64)
+        r += count * (r >= start)
+        return self.order[r]
+
+
+def pick_in_batch(class_ids, rng=np.random):
+    """For every example of a batch, picks the position of a random example of a different class from the same batch.
+
+    Returns -1 for the examples whose class is the only one of the batch.
+    """
+    class_ids = np.asarray(class_ids)
+    mismatch = class_ids[:, None] != class_ids[None, :]
+    keys = rng.random_sample(mismatch.shape)
+    keys[~mismatch] = -1.
+    pos = np.argmax(keys, axis=1)
+    pos[~mismatch[np.arange(len(pos)), pos]] = -1
+    return pos
@@ -0,0 +1,249 @@
+"""
+Sharded, streaming dataset format for corpora larger than the memory.
+
+A sharded split is a directory with a manifest.json listing the shards and their sizes. Every shard is a store
+(see preprocess/store.py) with the images, embeddings, class ids, packed captions and the index of every row in the
+source dataset. Row r of shard s has the global index manifest['shards'][s]['start'] + r.
+
+The StreamingDataset shuffles at two levels: the shard order is shuffled every epoch and the rows, read
+sequentially from the shards, go through a shuffle buffer. Only the rows of the current shuffle window are read
+from disk, so memory stays bounded by the shuffle buffer whatever the size of the corpus.
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from preprocess.captions import CaptionStore, pack_captions
+from preprocess.dataset import Dataset, TextDataset
+from preprocess.store import open_store, write_store
+
+MANIFEST_FILENAME = 'manifest.json'
+CAPTION_KEYS = ['row_ptr', 'offsets', 'data']
+
+
+class Shard(object):
+    def __init__(self, path, start, num_examples):
+        self.path = path
+        self.start = start
+        self.num_examples = num_examples
+        self._arrays = None
+        self._captions = None
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            self._arrays = open_store(self.path)
+        return self._arrays
+
+    @property
+    def captions(self) -> CaptionStore:
+        if self._captions is None:
+            self._captions = CaptionStore.from_arrays(*[self.arrays['caption_' + key] for key in CAPTION_KEYS])
+        return self._captions
+
+
+class ShardedArray(object):
+    """Array-like view of the concatenation of the same array of all the shards. Supports slices and index arrays."""
+
+    def __init__(self, shards, name):
+        self._shards = shards
+        self._name = name
+        self._starts = np.array([shard.start for shard in shards], dtype=np.int64)
+        first = shards[0].arrays[name]
+        self.shape = (sum(shard.num_examples for shard in shards),) + first.shape[1:]
+        self.dtype = first.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            ids = np.arange(*key.indices(len(self)))
+        else:
+            ids = np.asarray(key, dtype=np.int64)
+
+        out = np.empty((len(ids),) + self.shape[1:], dtype=self.dtype)
+        shard_ids = np.searchsorted(self._starts, ids, side='right') - 1
+        for shard_id in np.unique(shard_ids):
+            pos = np.flatnonzero(shard_ids == shard_id)
+            shard = self._shards[shard_id]
+            rows = ids[pos] - shard.start
+            # Read the rows of a shard in increasing order
+            order = np.argsort(rows, kind='mergesort')
+            out[pos[order]] = shard.arrays[self._name][rows[order]]
+        return out
+
+
+class ShardedCaptions(object):
+    def __init__(self, shards):
+        self._shards = shards
+        self._starts = np.array([shard.start for shard in shards], dtype=np.int64)
+
+    def _locate(self, idx):
+        shard = self._shards[np.searchsorted(self._starts, idx, side='right') - 1]
+        return shard, idx - shard.start
+
+    def captions(self, idx):
+        shard, row = self._locate(idx)
+        return shard.captions.captions(row)
+
+    def caption(self, idx, cap_idx):
+        shard, row = self._locate(idx)
+        return shard.captions.caption(row, cap_idx)
+
+
+class StreamingDataset(Dataset):
+    """A Dataset reading a sharded split. The batches are drawn through a two-level (shard order, shuffle buffer)
+    shuffle instead of a permutation of the whole dataset."""
+
+    def __init__(self, shard_dir, imsize, aug_flag=True, shuffle_buffer=10000, seed=None):
+        with open(os.path.join(shard_dir, MANIFEST_FILENAME), 'r') as f:
+            self.manifest = json.load(f)
+
+        self._shards = [Shard(os.path.join(shard_dir, shard['path']), shard['start'], shard['num_examples'])
+                        for shard in self.manifest['shards']]
+        class_id = np.concatenate([shard.arrays['class_id'] for shard in self._shards])
+
+        super().__init__(ShardedArray(self._shards, 'images'), imsize, ShardedArray(self._shards, 'embeddings'),
+                         workdir=shard_dir, labels=class_id, aug_flag=aug_flag, class_id=class_id,
+                         captions=ShardedCaptions(self._shards), seed=seed)
+
+        self._shuffle_buffer = min(shuffle_buffer, self._num_examples)
+        self._buffer = None
+        # The pass over the shards every row of the buffer was read in, an epoch being completed once the last row of
+        # its pass has left the buffer
+        self._buffer_pass = None
+        self._stream_pass = -1
+        # The shards read by this dataset, all of them unless the dataset is sharded
+        self._shard_ids = np.arange(len(self._shards))
+        self._shard_order = np.zeros(0, dtype=np.int64)
+        self._shard_pos = 0
+        self._row_pos = 0
+
+    def _start_pass(self):
+        self._stream_pass += 1
+        self._shard_order = self._rng.permutation(self._shard_ids)
+        self._shard_pos = 0
+        self._row_pos = 0
+
+    def _read_stream(self, n):
+        """Returns the global indices of the next n rows, read sequentially from the shards in the shuffled order, and
+        the pass they were read in"""
+        ids = np.empty(n, dtype=np.int64)
+        passes = np.empty(n, dtype=np.int64)
+        filled = 0
+        while filled < n:
+            if self._shard_pos >= len(self._shard_order):
+                self._start_pass()
+            shard = self._shards[self._shard_order[self._shard_pos]]
+            take = min(n - filled, shard.num_examples - self._row_pos)
+            ids[filled:filled + take] = shard.start + self._row_pos + np.arange(take)
+            passes[filled:filled + take] = self._stream_pass
+            filled += take
+            self._row_pos += take
+            if self._row_pos == shard.num_examples:
+                self._shard_pos += 1
+                self._row_pos = 0
+        return ids, passes
+
+    def shard(self, num_shards, index):
+        """Restricts the stream to the shards index, index + num_shards... of the split. Restarts the epoch."""
+        if not 0 <= index < num_shards:
+            raise ValueError('Invalid shard %d of %d' % (index, num_shards))
+        if len(self._shards) < num_shards:
+            raise ValueError('The split has %d shards, fewer than the %d dataset shards requested'
+                             % (len(self._shards), num_shards))
+        self._shard_ids = np.arange(index, len(self._shards), num_shards)
+        num_rows = sum(self._shards[shard_id].num_examples for shard_id in self._shard_ids)
+        self._shuffle_buffer = min(self._shuffle_buffer, num_rows)
+        self._buffer = None
+        self._buffer_pass = None
+        self._shard_order = np.zeros(0, dtype=np.int64)
+        self._shard_pos = 0
+        self._row_pos = 0
+
+    def get_state(self):
+        return {
+            'epochs_completed': self._epochs_completed,
+            'buffer': None if self._buffer is None else self._buffer.copy(),
+            'buffer_pass': None if self._buffer_pass is None else self._buffer_pass.copy(),
+            'stream_pass': self._stream_pass,
+            'shard_order': self._shard_order,
+            'shard_pos': self._shard_pos,
+            'row_pos': self._row_pos,
+            'rng': self._rng.get_state(),
+        }
+
+    def set_state(self, state):
+        self._epochs_completed = state['epochs_completed']
+        self._buffer = state['buffer']
+        self._buffer_pass = state['buffer_pass']
+        self._stream_pass = state['stream_pass']
+        self._shard_order = state['shard_order']
+        self._shard_pos = state['shard_pos']
+        self._row_pos = state['row_pos']
+        self._rng.set_state(state['rng'])
+
+    def next_ids(self, batch_size):
+        if self._buffer is None:
+            self._buffer, self._buffer_pass = self._read_stream(self._shuffle_buffer)
+        assert batch_size <= len(self._buffer)
+
+        slots = self._rng.choice(len(self._buffer), batch_size, replace=False)
+        current_ids = self._buffer[slots]
+        self._buffer[slots], self._buffer_pass[slots] = self._read_stream(batch_size)
+        # The rows of the buffer are read ahead of the batches, the epoch only ends once they are all drawn
+        self._epochs_completed = int(self._buffer_pass.min())
+        return current_ids
+
+
+def write_shards(dataset: Dataset, out_dir, shard_size=10000, shuffle=True, seed=0):
+    """Writes a Dataset to a sharded split in out_dir. The examples are shuffled across the shards by default."""
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    order = np.arange(dataset.num_examples)
+    if shuffle:
+        np.random.RandomState(seed).shuffle(order)
+
+    shards = []
+    for start in range(0, dataset.num_examples, shard_size):
+        source_ids = order[start:start + shard_size]
+        # Read the source in increasing order, then put the rows back in the shuffled order
+        sorted_ids = np.sort(source_ids)
+        unsort = np.argsort(np.argsort(source_ids, kind='mergesort'), kind='mergesort')
+
+        arrays = {
+            'images': np.asarray(dataset.images[sorted_ids])[unsort],
+            'embeddings': np.asarray(dataset.embeddings[sorted_ids])[unsort],
+            'class_id': np.asarray(dataset.class_ids, dtype=np.int64)[source_ids],
+            'source_index': source_ids.astype(np.int64),
+        }
+        captions = pack_captions([dataset.get_captions(idx) for idx in source_ids])
+        for key in CAPTION_KEYS:
+            arrays['caption_' + key] = captions[key]
+
+        name = 'shard-%05d.store' % len(shards)
+        write_store(os.path.join(out_dir, name), arrays)
+        shards.append({'path': name, 'start': start, 'num_examples': len(source_ids)})
+        print('\rWrote %d/%d examples' % (start + len(source_ids), dataset.num_examples), end="", flush=True)
+    print()
+
+    manifest = {'num_examples': dataset.num_examples, 'shards': shards}
+    tmp_path = os.path.join(out_dir, MANIFEST_FILENAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_FILENAME))
+
+
+if __name__ == '__main__':
+    # Usage: python -m preprocess.shards ./data/flowers ./data/flowers_sharded [shard_size]
+    in_dir, out_dir = sys.argv[1], sys.argv[2]
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    text_dataset = TextDataset(in_dir, 64)
+    for split in ['train', 'test']:
+        split_dataset = text_dataset.get_data(os.path.join(in_dir, split))
+        write_shards(split_dataset, os.path.join(out_dir, split), size)
@@ -0,0 +1,187 @@
+"""
+A raw, memory-mappable on-disk array store.
+
+A store file starts with a small JSON header describing the arrays it contains (name, dtype, shape and byte
+offset), followed by the raw array bytes. The arrays are opened through np.memmap, so opening a store is
+near-instant, pages are only read from disk when they are touched and several processes reading the same store
+share the page cache.
+
+Layout:
+    MAGIC (8 bytes) | header length (uint64, little endian) | JSON header | padding | array data ...
+"""
+
+import json
+import os
+import pickle
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'T2ISTORE'
+VERSION = 1
+ALIGN = 4096
+IMAGES_KEY = 'images'
+IMAGE_STORE_TEMPLATE = '%dimages.store'
+EMBEDDINGS_KEY = 'embeddings'
+EMBEDDING_PICKLE_FILENAME = 'char-CNN-RNN-embeddings.pickle'
+EMBEDDING_STORE_FILENAME = 'char-CNN-RNN-embeddings.store'
+
+
+def _round_up(x, align=ALIGN):
+    return (x + align - 1) // align * align
+
+
+def _layout(specs, attrs):
+    """Computes the header of a store containing the arrays given by specs = [(name, shape, dtype), ...]"""
+    arrays = []
+    for name, shape, dtype in specs:
+        arrays.append({'name': name,
+                       'shape': [int(d) for d in shape],
+                       'dtype': np.dtype(dtype).str})
+    header = {'version': VERSION, 'arrays': arrays, 'attrs': attrs or {}}
+
+    # The header size depends on the offsets it contains, so reserve a full page for it upfront
+    data_start = _round_up(len(MAGIC) + 8 + len(json.dumps(header)) + 64 * len(arrays) + 64)
+    offset = data_start
+    for array in arrays:
+        array['offset'] = offset
+        nbytes = int(np.prod(array['shape'])) * np.dtype(array['dtype']).itemsize
+        offset = _round_up(offset + nbytes, 64)
+    header['data_start'] = data_start
+    return header, offset
+
+
+def _write_header(f, header):
+    raw = json.dumps(header).encode('utf-8')
+    if len(MAGIC) + 8 + len(raw) > header['data_start']:
+        raise RuntimeError('Store header does not fit in the reserved space')
+    f.seek(0)
+    f.write(MAGIC)
+    f.write(struct.pack('<Q', len(raw)))
+    f.write(raw)
+
+
+def read_header(path):
+    """Reads the JSON header of the store at path"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise RuntimeError('{} is not an array store'.format(path))
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode('utf-8'))
+    if header['version'] != VERSION:
+        raise RuntimeError('Unsupported store version {} in {}'.format(header['version'], path))
+    return header
+
+
+def create_store(path, specs, attrs=None):
+    """Creates an empty (zero filled) store at path for the arrays given by specs = [(name, shape, dtype), ...]"""
+    header, size = _layout(specs, attrs)
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        _write_header(f, header)
+    return header
+
+
+def resize_store(path, num_rows):
+    """Changes the number of rows (first dimension) of the last array of a store in place, e.g. to append images to
+    an image store. The existing rows are kept, the new ones are zero filled."""
+    header = read_header(path)
+    array = max(header['arrays'], key=lambda a: a['offset'])
+    array['shape'][0] = int(num_rows)
+    nbytes = int(np.prod(array['shape'])) * np.dtype(array['dtype']).itemsize
+    with open(path, 'r+b') as f:
+        _write_header(f, header)
+        f.truncate(_round_up(array['offset'] + nbytes, 64))
+
+
+def open_store(path, mode='r'):
+    """Memory-maps all the arrays of the store at path. Returns a dictionary from array name to np.memmap."""
+    header = read_header(path)
+    arrays = {}
+    for array in header['arrays']:
+        shape = tuple(array['shape'])
+        if np.prod(shape) == 0:
+            # np.memmap can not map empty arrays
+            arrays[array['name']] = np.empty(shape, dtype=array['dtype'])
+            continue
+        arrays[array['name']] = np.memmap(path, dtype=array['dtype'], mode=mode,
+                                          offset=array['offset'], shape=shape)
+    return arrays
+
+
+def store_attrs(path):
+    return read_header(path)['attrs']
+
+
+def write_store(path, arrays, attrs=None):
+    """Atomically writes the dictionary of arrays to a store at path"""
+    names = sorted(arrays.keys())
+    specs = [(name, np.shape(arrays[name]), np.asarray(arrays[name]).dtype) for name in names]
+
+    tmp_path = path + '.tmp'
+    create_store(tmp_path, specs, attrs)
+    mapped = open_store(tmp_path, mode='r+')
+    for name in names:
+        if mapped[name].size:
+            mapped[name][...] = arrays[name]
+            mapped[name].flush()
+    del mapped
+    os.replace(tmp_path, path)
+
+
+def image_store_name(size):
+    """The file name of the image store holding the images of the given (pre-crop) size"""
+    return IMAGE_STORE_TEMPLATE % size
+
+
+def open_image_store(path, mode='r'):
+    """Memory-maps the uint8 [N, H, W, C] image array of an image store"""
+    return open_store(path, mode)[IMAGES_KEY]
+
+
+def convert_image_pickle(pickle_path, store_path):
+    """Converts a joblib image pickle (e.g. 360images.pickle) to an image store"""
+    from sklearn.externals import joblib
+
+    images = np.asarray(joblib.load(pickle_path), dtype=np.uint8)
+    print('Converting %s %s to %s' % (pickle_path, images.shape, store_path))
+    write_store(store_path, {IMAGES_KEY: images})
+
+
+def open_embedding_store(path, mode='r'):
+    """Memory-maps the [N, num_captions, dim] float32 (or float16) embedding array of an embedding store"""
+    return open_store(path, mode)[EMBEDDINGS_KEY]
+
+
+def convert_embedding_pickle(pickle_path, store_path, dtype=np.float32):
+    """Converts a char-CNN-RNN embedding pickle to an embedding store of the given dtype"""
+    with open(pickle_path, 'rb') as f:
+        embeddings = np.asarray(pickle.load(f, encoding='bytes'), dtype=dtype)
+    print('Converting %s %s to %s (%s)' % (pickle_path, embeddings.shape, store_path, embeddings.dtype))
+    write_store(store_path, {EMBEDDINGS_KEY: embeddings})
+
+
+def convert_split_dir(split_dir, embedding_dtype=np.float32):
+    """Converts every *images.pickle and the embedding pickle from a dataset split directory (e.g. ./data/nlvr/train)
+    to stores"""
+    for name in sorted(os.listdir(split_dir)):
+        if name.endswith('images.pickle'):
+            pickle_path = os.path.join(split_dir, name)
+            store_path = os.path.join(split_dir, name[:-len('.pickle')] + '.store')
+            convert_image_pickle(pickle_path, store_path)
+
+    embedding_path = os.path.join(split_dir, EMBEDDING_PICKLE_FILENAME)
+    if os.path.exists(embedding_path):
+        convert_embedding_pickle(embedding_path, os.path.join(split_dir, EMBEDDING_STORE_FILENAME), embedding_dtype)
+
+
+if __name__ == '__main__':
+    # Usage: python -m preprocess.store [--float16] ./data/nlvr/train ./data/nlvr/test
+    args = sys.argv[1:]
+    dtype = np.float32
+    if '--float16' in args:
+        args.remove('--float16')
+        dtype = np.float16
+    for split_dir in args:
+        convert_split_dir(split_dir, dtype)
@@ -2,21 +2,17 @@
 Some codes from
 https://github.com/openai/improved-gan/blob/master/imagenet/utils.py
 """
+import math
 import numpy as np
-import scipy.misc
 import os
 import errno
+from PIL import Image
 from preprocess.dataset import TextDataset
 
 
-def get_image(image_path, image_size, is_crop=False, bbox=None):
-    global index
-    return transform(imread(image_path), image_size, is_crop, bbox)
-
-
-def custom_crop(img, bbox):
-    # bbox = [x-left, y-top, width, height]
-    imsiz = img.shape  # [height, width, channel]
+def crop_box(imsiz, bbox):
+    """Returns the (y1, y2, x1, x2) square crop around a bbox = [x-left, y-top, width, height] in an image of size
+    imsiz = [height, width]"""
     # if box[0] + box[2] >= imsiz[1] or\
     #     box[1] + box[3] >= imsiz[0] or\
     #     box[0] <= 0 or\
@@ -32,33 +28,36 @@ def custom_crop(img, bbox):
     y2 = np.minimum(imsiz[0], center_y + R)
     x1 = np.maximum(0, center_x - R)
     x2 = np.minimum(imsiz[1], center_x + R)
-    img_cropped = img[y1:y2, x1:x2, :]
-    return img_cropped
+    return y1, y2, x1, x2
 
 
-def transform(image, image_size, is_crop, bbox):
-    image = colorize(image)
-    if is_crop:
-        image = custom_crop(image, bbox)
+def custom_crop(img, bbox):
+    # bbox = [x-left, y-top, width, height]
+    y1, y2, x1, x2 = crop_box(img.shape, bbox)  # [height, width, channel]
+    img_cropped = img[y1:y2, x1:x2, :]
+    return img_cropped
 
-    transformed_image = scipy.misc.imresize(image, [image_size, image_size], 'bicubic')
-    return np.array(transformed_image)
 
+def load_image_sizes(image_path, shapes, bbox=None):
+    """Decodes an image once and returns it bicubically resized to every (height, width) of shapes, as uint8 RGB.
 
-def imread(path):
-    img = scipy.misc.imread(path)
-    if len(img.shape) == 0:
-        raise ValueError(path + " got loaded as a dimensionless array!")
-    return img.astype(np.float)
+    JPEG images are decoded at a reduced resolution (draft mode) when the largest shape is much smaller than the
+    image, and the bbox crop (see custom_crop) is applied before resizing. draft is a no-op for the other formats, so
+    the .png images of NLVR are always decoded at full resolution.
+    """
+    img = Image.open(image_path)
+    width, height = img.size
+    y1, y2, x1, x2 = crop_box([height, width], bbox) if bbox is not None else (0, height, 0, width)
 
+    # Request a decode size at which the cropped region still covers the largest output size
+    scale = max(max(h / (y2 - y1), w / (x2 - x1)) for h, w in shapes)
+    img.draft('RGB', (int(math.ceil(width * scale)), int(math.ceil(height * scale))))
+    img = img.convert('RGB')
 
-def colorize(img):
-    if img.ndim == 2:
-        img = img.reshape(img.shape[0], img.shape[1], 1)
-        img = np.concatenate([img, img, img], axis=2)
-    if img.shape[2] == 4:
-        img = img[:, :, 0:3]
-    return img
+    if bbox is not None:
+        sx, sy = img.size[0] / width, img.size[1] / height
+        img = img.crop((int(x1 * sx), int(y1 * sy), int(x2 * sx), int(y2 * sy)))
+    return [np.asarray(img.resize((w, h), Image.BICUBIC), dtype=np.uint8) for h, w in shapes]
 
 
 def mkdir_p(path):
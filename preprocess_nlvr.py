@@ -1,7 +1,9 @@
 import os
-from preprocess.utils import get_image
-import scipy.misc
-import numpy as np
+import sys
+from functools import partial
+from preprocess.utils import load_image_sizes
+from preprocess.incremental import MANIFEST_FILENAME, update_image_stores
+from preprocess.store import image_store_name
 from sklearn.externals import joblib
 
 
@@ -9,8 +11,16 @@ from sklearn.externals import joblib
 # このリストを編集して作成するファイルを指定してください。
 IMG_WIDTH = 400
 IMG_HEIGHT = 100
-IMG_SIZES = [360]
-LOAD_SIZE = 600
+# The image sizes before cropping (see FINAL_SIZE_TO_ORIG), e.g. 76 for a 64x64 model. The 400x100 images are
+# squashed to these square sizes, so the model sees them with a 4:1 horizontal squeeze.
+IMG_SIZES = [76, 360]
+# The shape of the images of a size, when they are not square. The full resolution store keeps the array shape of the
+# original preprocessing.
+IMG_SHAPES = {360: (IMG_WIDTH, IMG_HEIGHT)}
+# The number of preprocessing processes, all the cores when None
+NUM_WORKERS = None
+# The number of images written (and checkpointed) at once by a worker
+CHUNK_SIZE = 64
 FLOWER_DIR = './data/flowers'
 NLVR_DIR = './data/nlvr'
 
@@ -24,29 +34,22 @@ def load_filenames(data_dir):
     return filenames
 
 
-def save_data_list(inpath, outpath, filenames):
-
-    for size in IMG_SIZES:
-        print('Processing images of size %d' % size)
+def source_path(inpath, key):
+    return '%s/%s.png' % (inpath, key)
 
-        cnt = 0
-        images = np.ndarray(shape=(len(filenames), IMG_WIDTH, IMG_HEIGHT, 3), dtype=np.uint8)
-        for idx, key in enumerate(filenames):
-            f_name = '%s/%s.png' % (inpath, key)
-            img = get_image(f_name, LOAD_SIZE, is_crop=False)
-            img = scipy.misc.imresize(img, [IMG_WIDTH, IMG_HEIGHT], 'bicubic')
-            img = img.astype('uint8')
-            images[idx, :, :, :] = np.array(img)
 
-            cnt += 1
-            if cnt % 100 == 0:
-                print('\rLoad %d......' % cnt, end="", flush=True)
+def load_image(inpath, key):
+    """Decodes an image once and resizes it to all the sizes"""
+    return load_image_sizes(source_path(inpath, key), [IMG_SHAPES.get(size, (size, size)) for size in IMG_SIZES])
 
-        print('Images processed: %d', len(filenames))
 
-        outfile = outpath + str(size) + 'images.pickle'
-        joblib.dump(images, outfile)
-        print('save to: ', outfile)
+def save_data_list(inpath, outpath, filenames):
+    print('Processing images of sizes %s' % IMG_SIZES)
+    out_paths = [os.path.join(outpath, image_store_name(size)) for size in IMG_SIZES]
+    shapes = [IMG_SHAPES.get(size, (size, size)) + (3,) for size in IMG_SIZES]
+    # Only the new and changed images are processed again, see preprocess/incremental.py
+    update_image_stores(filenames, [source_path(inpath, key) for key in filenames], partial(load_image, inpath),
+                        out_paths, shapes, os.path.join(outpath, MANIFEST_FILENAME), NUM_WORKERS, CHUNK_SIZE)
 
 
 def convert_nlvr_dataset_pickle(inpath):
@@ -62,5 +65,8 @@ def convert_nlvr_dataset_pickle(inpath):
 
 
 if __name__ == '__main__':
+    # Usage: python preprocess_nlvr.py [num_workers]
+    if len(sys.argv) > 1:
+        NUM_WORKERS = int(sys.argv[1])
     # convert_flowers_dataset_pickle(FLOWER_DIR)
     convert_nlvr_dataset_pickle(NLVR_DIR)
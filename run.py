@@ -1,11 +1,13 @@
 import os
 
 from models.gancls.eval_gancls import GanClsEval
+from models.gancls.input_pipeline import GanClsInputPipeline
 from models.gancls.model import GanCls
 from models.gancls.trainer import GanClsTrainer
 from models.gancls.visualize_gancls import GanClsVisualizer
 from utils.utils import pp, show_all_variables
 from utils.config import config_from_yaml
+from utils.distributed import Cluster
 from preprocess.dataset import TextDataset
 
 import tensorflow as tf
@@ -13,6 +15,8 @@ import tensorflow as tf
 flags = tf.app.flags
 flags.DEFINE_string('cfg', './cfg/nlvr.yml',
                     'Relative path to the config of the model [.cfg/nlvr.yml]')
+flags.DEFINE_string('job_name', 'worker', 'The job of this task with DISTRIBUTED.FLAG (ps or worker)')
+flags.DEFINE_integer('task_index', 0, 'The index of this task in its job with DISTRIBUTED.FLAG')
 FLAGS = flags.FLAGS
 
 
@@ -30,17 +34,28 @@ def main(_):
 
     run_config = tf.ConfigProto()
     run_config.gpu_options.allow_growth = True
+    run_config.intra_op_parallelism_threads = cfg.TRAIN.TOWERS.INTRA_OP_THREADS
+    run_config.inter_op_parallelism_threads = cfg.TRAIN.TOWERS.INTER_OP_THREADS
+    # One CPU device per tower, so that the towers placed on /cpu:i are scheduled independently
+    run_config.device_count['CPU'] = max(cfg.TRAIN.TOWERS.NUM, 1)
 
     datadir = cfg.DATASET_DIR
-    dataset = TextDataset(datadir, 64)
+    dataset = TextDataset(datadir, cfg.MODEL.OUTPUT_SIZE)
 
-    filename_test = '%s/test' % datadir
-    dataset._test = dataset.get_data(filename_test)
+    cluster = None
+    target = ''
+    if cfg.TRAIN.FLAG and cfg.DISTRIBUTED.FLAG:
+        cluster = Cluster(cfg, FLAGS.job_name, FLAGS.task_index)
+        server = cluster.start_server(run_config)
+        if cluster.is_ps:
+            print('Serving the variables as task %d of the ps job' % FLAGS.task_index)
+            server.join()
+            return
+        target = server.target
+        # Every worker trains on its own part of the dataset
+        dataset.train.shard(cluster.num_workers, cluster.task_index)
 
-    filename_train = '%s/train' % datadir
-    dataset.train = dataset.get_data(filename_train)
-
-    with tf.Session(config=run_config) as sess:
+    with tf.Session(target, config=run_config) as sess:
 
         if cfg.EVAL.FLAG:
             gancls = GanCls(cfg, build_model=False)
@@ -51,13 +66,21 @@ def main(_):
                 cfg=cfg)
             eval.evaluate_inception()
         elif cfg.TRAIN.FLAG:
-            gancls = GanCls(cfg)
+            input_pipeline = None
+            if cfg.TRAIN.INPUT_PIPELINE.FLAG:
+                # The staging variables of the batch stay on the worker
+                with tf.device(cluster.worker_device if cluster else None):
+                    input_pipeline = GanClsInputPipeline(dataset.train, cfg)
+            with tf.device(cluster.device_setter() if cluster else None):
+                gancls = GanCls(cfg, inputs=input_pipeline.batch if input_pipeline else None)
             show_all_variables()
             gancls_trainer = GanClsTrainer(
                 sess=sess,
                 model=gancls,
                 dataset=dataset,
                 cfg=cfg,
+                input_pipeline=input_pipeline,
+                cluster=cluster,
             )
             gancls_trainer.train()
         else:
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from preprocess.augment import BatchAugmenter, crop_windows, normalize_images
+
+
+def _images(n=4, h=9, w=7, c=3, seed=0):
+    return np.random.RandomState(seed).randint(256, size=(n, h, w, c)).astype(np.uint8)
+
+
+def test_crop_windows_match_naive_crops():
+    images = _images()
+    windows = crop_windows(images, 5, 4)
+    assert windows.shape == (4, 5, 4, 5, 4, 3)
+    for i in range(images.shape[0]):
+        for y in range(windows.shape[1]):
+            for x in range(windows.shape[2]):
+                np.testing.assert_array_equal(windows[i, y, x], images[i, y:y + 5, x:x + 4])
+
+
+def test_normalize_images_range():
+    images = np.array([0, 255, 128], dtype=np.uint8)
+    np.testing.assert_allclose(normalize_images(images), [-1., 1., 128 * 2. / 255 - 1.], atol=1e-6)
+
+
+@pytest.mark.parametrize('flip', [False, True])
+def test_augmenter_matches_naive_crop_and_flip(flip):
+    images = _images(n=16)
+    out = BatchAugmenter((5, 4), flip=flip)(images, np.random.RandomState(3))
+
+    # Replay the same draws with a per-image crop and flip
+    rng = np.random.RandomState(3)
+    offset_y = rng.randint(9 - 5 + 1, size=16)
+    offset_x = rng.randint(7 - 4 + 1, size=16)
+    flips = rng.randint(2, size=16) if flip else np.zeros(16, dtype=np.int64)
+    for i in range(16):
+        crop = images[i, offset_y[i]:offset_y[i] + 5, offset_x[i]:offset_x[i] + 4]
+        if flips[i]:
+            crop = crop[:, ::-1]
+        np.testing.assert_allclose(out[i], crop.astype(np.float32) * (2. / 255) - 1., atol=1e-6)
+
+
+def test_augmenter_reuses_its_buffers():
+    augmenter = BatchAugmenter((5, 4), num_buffers=2)
+    images = _images()
+    first = augmenter(images)
+    second = augmenter(images)
+    third = augmenter(images)
+    assert first is not second
+    assert third is first
+
+
+def test_reserve_buffers_grows_the_ring():
+    augmenter = BatchAugmenter((5, 4), num_buffers=2)
+    augmenter.reserve_buffers(3)
+    images = _images()
+    results = [augmenter(images) for _ in range(4)]
+    assert len(set(map(id, results[:3]))) == 3
+    assert results[3] is results[0]
+
+
+def test_augmenter_rejects_small_images():
+    with pytest.raises(ValueError):
+        BatchAugmenter((10, 4))(_images())
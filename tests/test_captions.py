@@ -0,0 +1,50 @@
+import os
+import pickle
+
+import pytest
+
+from preprocess.captions import CAPTION_STORE_FILENAME, CaptionStore, build_caption_store
+
+CAPTIONS = {
+    'jpg/image_00001': ['a red flower', 'petals with a yellow centre'],
+    'jpg/image_00002': ['une fleur rosée'],
+    'jpg/image_00003': [],
+    'jpg/image_00004': ['white', 'white and round', 'a white flower'],
+}
+CLASS_INFO = [1, 1, 2, 7]
+
+
+@pytest.fixture
+def split_dir(tmpdir):
+    workdir = str(tmpdir)
+    split_dir = os.path.join(workdir, 'train')
+    os.makedirs(split_dir)
+    with open(os.path.join(split_dir, 'filenames.pickle'), 'wb') as f:
+        pickle.dump(list(CAPTIONS), f)
+    with open(os.path.join(split_dir, 'class_info.pickle'), 'wb') as f:
+        pickle.dump(CLASS_INFO, f)
+    for (filename, captions), class_info in zip(CAPTIONS.items(), CLASS_INFO):
+        path = '%s/text_c10/%s.txt' % (workdir, filename.replace('jpg/', 'class_%05d/' % class_info))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(captions) + '\n')
+    build_caption_store(workdir, split_dir)
+    return split_dir
+
+
+def test_caption_store_round_trip(split_dir):
+    store = CaptionStore.load(os.path.join(split_dir, CAPTION_STORE_FILENAME))
+    assert len(store) == len(CAPTIONS)
+    for idx, captions in enumerate(CAPTIONS.values()):
+        assert store.num_captions(idx) == len(captions)
+        assert store.captions(idx) == captions
+        for cap_idx, caption in enumerate(captions):
+            assert store.caption(idx, cap_idx) == caption
+
+
+def test_caption_out_of_range(split_dir):
+    store = CaptionStore.load(os.path.join(split_dir, CAPTION_STORE_FILENAME))
+    with pytest.raises(IndexError):
+        store.caption(0, 2)
+    with pytest.raises(IndexError):
+        store.caption(2, 0)
@@ -0,0 +1,118 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from preprocess.dataset import Dataset, LazyAttribute, TextDataset
+from preprocess.store import EMBEDDING_STORE_FILENAME, EMBEDDINGS_KEY, IMAGES_KEY, image_store_name, write_store
+
+NUM_EXAMPLES = 6
+CLASS_INFO = [1, 1, 2, 2, 3, 3]
+
+
+class Counted(object):
+    """A loader function counting its calls"""
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+@pytest.fixture
+def workdir(tmpdir):
+    workdir = str(tmpdir)
+    split_dir = os.path.join(workdir, 'train')
+    os.makedirs(split_dir)
+    with open(os.path.join(split_dir, 'filenames.pickle'), 'wb') as f:
+        pickle.dump(['image_%d' % i for i in range(NUM_EXAMPLES)], f)
+    with open(os.path.join(split_dir, 'class_info.pickle'), 'wb') as f:
+        pickle.dump(CLASS_INFO, f)
+    with open(os.path.join(split_dir, 'char-CNN-RNN-embeddings.pickle'), 'wb') as f:
+        pickle.dump(np.random.RandomState(0).randn(NUM_EXAMPLES, 5, 8).astype(np.float32), f)
+    for size in [76, 360]:
+        images = np.full((NUM_EXAMPLES, size, size, 3), size % 256, dtype=np.uint8)
+        write_store(os.path.join(split_dir, image_store_name(size)), {IMAGES_KEY: images})
+    return workdir
+
+
+def test_lazy_attribute_loads_once():
+    class Holder(object):
+        value = LazyAttribute('value')
+
+    holder = Holder()
+    loader = Counted(42)
+    holder.value = loader
+    assert loader.calls == 0
+    assert holder.value == 42
+    assert holder.value == 42
+    assert loader.calls == 1
+
+
+def test_dataset_loads_its_arrays_on_first_use():
+    images = Counted(np.zeros((4, 8, 8, 3), dtype=np.uint8))
+    embeddings = Counted(np.ones((4, 5, 3), dtype=np.float32))
+    dataset = Dataset(images, 8, embeddings, filenames=['a', 'b', 'c', 'd'], class_id=np.array([0, 0, 1, 1]),
+                      aug_flag=False, seed=0)
+
+    _, _, embed, _, _ = dataset.next_batch(2, window=2, embeddings=True, images=False)
+    assert embed.shape == (2, 3)
+    assert images.calls == 0 and embeddings.calls == 1
+
+    batch_images, _, _, _, _ = dataset.next_batch(2)
+    assert batch_images.shape == (2, 8, 8, 3)
+    assert images.calls == 1 and embeddings.calls == 1
+
+
+def test_text_dataset_opens_a_split_on_first_access(workdir):
+    dataset = TextDataset(workdir, 64)
+    # The test split does not exist, it is never read as long as it is not accessed
+    assert dataset._train is None and dataset._test is None
+
+    train = dataset.train
+    assert train.num_examples == NUM_EXAMPLES
+    assert callable(train._lazy_images) and callable(train._lazy_embeddings)
+
+    _, _, embed, _, _ = train.next_batch(4, window=2, embeddings=True, images=False)
+    assert embed.shape == (4, 8)
+    assert callable(train._lazy_images)
+
+    images = train.images
+    assert isinstance(images, np.memmap)
+    assert dataset.train is train
+
+
+def test_text_dataset_opens_the_store_of_its_size(workdir):
+    # The 64x64 crops are drawn from the 76x76 images
+    images = TextDataset(workdir, 64).train.images
+    assert images.shape == (NUM_EXAMPLES, 76, 76, 3) and np.all(images == 76)
+    batch_images, _, _, _, _ = TextDataset(workdir, 64).train.next_batch(3)
+    assert batch_images.shape == (3, 64, 64, 3)
+
+
+def test_float16_embeddings_are_averaged_in_float32(workdir):
+    split_dir = os.path.join(workdir, 'train')
+    with open(os.path.join(split_dir, 'char-CNN-RNN-embeddings.pickle'), 'rb') as f:
+        embeddings = pickle.load(f)
+    write_store(os.path.join(split_dir, EMBEDDING_STORE_FILENAME), {EMBEDDINGS_KEY: embeddings.astype(np.float16)})
+
+    train = TextDataset(workdir, 64).train
+    assert train.embeddings.dtype == np.float16
+    ids = train.next_ids(4)
+    _, _, embed, _, _ = train.get_batch(ids, window=5, embeddings=True, images=False)
+    assert embed.dtype == np.float32
+    np.testing.assert_allclose(embed, embeddings[ids].mean(axis=1), atol=1e-2)
+
+
+def test_embedding_pickle_is_loaded_as_float32(workdir):
+    assert TextDataset(workdir, 64).train.embeddings.dtype == np.float32
+
+
+def test_text_dataset_requires_the_store_of_its_size(workdir):
+    # Only the 76 and 360 stores exist, the 128x128 crops are never drawn from the full resolution images
+    with pytest.raises(RuntimeError, match='preprocess.pyramid'):
+        TextDataset(workdir, 128).train.images
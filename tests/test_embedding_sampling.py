@@ -0,0 +1,52 @@
+import itertools
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from preprocess.sampling import CombinationMeanTable, mean_embeddings, sample_caption_indices
+
+
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_sample_caption_indices_are_distinct(k):
+    indices = sample_caption_indices(500, 5, k, rng=np.random.RandomState(0))
+    assert indices.shape == (500, k)
+    assert np.all((indices >= 0) & (indices < 5))
+    assert all(len(set(row)) == k for row in indices)
+
+
+def test_sample_caption_indices_cover_every_subset():
+    indices = sample_caption_indices(20000, 4, 2, rng=np.random.RandomState(0))
+    counts = Counter(tuple(sorted(row)) for row in indices)
+    assert set(counts) == set(itertools.combinations(range(4), 2))
+    # Every one of the 6 subsets is drawn about 20000 / 6 times
+    assert min(counts.values()) > 3000 and max(counts.values()) < 3700
+
+
+def test_sample_caption_indices_too_many():
+    with pytest.raises(ValueError):
+        sample_caption_indices(2, 3, 4)
+
+
+def test_mean_embeddings_match_naive_mean():
+    rng = np.random.RandomState(0)
+    embeddings = rng.randn(8, 5, 6).astype(np.float32)
+    indices = sample_caption_indices(8, 5, 3, rng=rng)
+    expected = np.stack([embeddings[i, indices[i]].mean(axis=0) for i in range(8)])
+    np.testing.assert_allclose(mean_embeddings(embeddings, indices), expected, rtol=1e-5)
+
+
+def test_combination_mean_table_samples():
+    rng = np.random.RandomState(0)
+    embeddings = rng.randn(10, 5, 6).astype(np.float32)
+    table = CombinationMeanTable(embeddings, 2, chunk_size=3)
+    assert table.table.shape == (10, 10, 6)
+
+    ids = rng.randint(10, size=50)
+    means, captions = table.sample(ids, rng=rng)
+    np.testing.assert_allclose(means, mean_embeddings(embeddings[ids], captions), rtol=1e-5)
+
+
+def test_combination_mean_table_size_limit():
+    with pytest.raises(ValueError):
+        CombinationMeanTable(np.zeros((100, 5, 6), dtype=np.float32), 2, max_bytes=1000)
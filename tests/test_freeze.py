@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+pytest.importorskip('easydict')
+
+from models.gancls.export import EMBED_NAME, OUTPUT_NAME, Z_NAME, FrozenGenerator, build_generator, \
+    export_generator
+from models.gancls.model import GanCls
+from utils.config import config_from_yaml
+from utils.freeze import load_graph_def
+from utils.saver import save
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _cfg(checkpoint_dir):
+    cfg = config_from_yaml(os.path.join(ROOT, 'models', 'gancls', 'cfg', 'flowers.yml'))
+    cfg.CHECKPOINT_DIR = checkpoint_dir
+    cfg.MODEL.Z_DIM = 8
+    cfg.MODEL.EMBED_DIM = 16
+    cfg.MODEL.COMPRESSED_EMBED_DIM = 8
+    cfg.MODEL.GF_DIM = 8
+    return cfg
+
+
+def _train_generator(cfg, rng):
+    """Saves a generator whose batch norm parameters and statistics are far from their initial values"""
+    with tf.Graph().as_default(), tf.Session() as sess:
+        build_generator(GanCls(cfg, build_model=False))
+        sess.run(tf.global_variables_initializer())
+        for var in tf.global_variables('g_net'):
+            name = var.op.name
+            if name.endswith('moving_variance'):
+                value = rng.uniform(0.5, 2., var.shape.as_list())
+            elif name.endswith('moving_mean') or name.endswith('beta') or name.endswith('bias'):
+                value = rng.normal(0., 0.5, var.shape.as_list())
+            elif name.endswith('gamma'):
+                value = rng.uniform(0.5, 1.5, var.shape.as_list())
+            else:
+                continue
+            var.load(value.astype(np.float32), sess)
+        save(tf.train.Saver(tf.global_variables('g_net')), sess, cfg.CHECKPOINT_DIR, 1)
+
+
+def test_frozen_generator_matches_the_live_generator(tmpdir):
+    cfg = _cfg(os.path.join(str(tmpdir), 'checkpoints') + '/')
+    rng = np.random.RandomState(0)
+    _train_generator(cfg, rng)
+    path = os.path.join(str(tmpdir), 'generator.pb')
+    export_generator(cfg, path)
+
+    graph_def = load_graph_def(path)
+    assert not any(node.op.startswith('FusedBatchNorm') for node in graph_def.node)
+    assert not any(node.op == 'VariableV2' for node in graph_def.node)
+    assert set([Z_NAME, EMBED_NAME, OUTPUT_NAME]) <= set(node.name for node in graph_def.node)
+
+    z = rng.normal(0, 1, [6, cfg.MODEL.Z_DIM]).astype(np.float32)
+    embed = rng.normal(0, 1, [6, cfg.MODEL.EMBED_DIM]).astype(np.float32)
+    with tf.Graph().as_default(), tf.Session() as sess:
+        z_live, embed_live, images_live = build_generator(GanCls(cfg, build_model=False))
+        tf.train.Saver(tf.global_variables('g_net')).restore(sess, tf.train.latest_checkpoint(cfg.CHECKPOINT_DIR))
+        live = sess.run(images_live, feed_dict={z_live: z, embed_live: embed})
+
+    generator = FrozenGenerator(path)
+    frozen = generator.generate(z, embed)
+    generator.close()
+
+    assert frozen.shape == live.shape == (6, cfg.MODEL.OUTPUT_SIZE, cfg.MODEL.OUTPUT_SIZE, 3)
+    np.testing.assert_allclose(frozen, live, rtol=1e-4, atol=1e-4)
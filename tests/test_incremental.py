@@ -0,0 +1,136 @@
+import json
+import os
+from functools import partial
+
+import numpy as np
+
+from preprocess.incremental import load_manifest, update_image_stores
+from preprocess.store import open_image_store
+
+SHAPES = [(2, 2, 3), (4, 4, 3)]
+
+
+def _load(log_dir, key):
+    """The images of a source file holding a number, the decoded keys being logged to log_dir"""
+    with open(key, 'r') as f:
+        value = int(f.read())
+    with open(os.path.join(log_dir, str(os.getpid())), 'a') as f:
+        f.write(key + '\n')
+    return [np.full(shape, value, dtype=np.uint8) for shape in SHAPES]
+
+
+class Sources(object):
+    def __init__(self, tmpdir):
+        self.dir = str(tmpdir)
+        self.log_dir = os.path.join(self.dir, 'log')
+        os.makedirs(self.log_dir)
+        self.out_paths = [os.path.join(self.dir, '%d_images.npstore' % shape[0]) for shape in SHAPES]
+        self.manifest_path = os.path.join(self.dir, 'manifest.json')
+        self.num_writes = 0
+
+    def write(self, name, value):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(str(value))
+        # A distinct modification time for every write, whatever the resolution of the file system
+        self.num_writes += 1
+        os.utime(path, ns=(self.num_writes * 10 ** 9, self.num_writes * 10 ** 9))
+        return path
+
+    def update(self, keys):
+        for name in os.listdir(self.log_dir):
+            os.remove(os.path.join(self.log_dir, name))
+        update_image_stores(keys, keys, partial(_load, self.log_dir), self.out_paths, SHAPES, self.manifest_path,
+                            num_workers=1, chunk_size=2)
+        decoded = []
+        for name in os.listdir(self.log_dir):
+            with open(os.path.join(self.log_dir, name), 'r') as f:
+                decoded += f.read().split()
+        return sorted(decoded)
+
+    def link(self):
+        """Hard links the stores, so that whether they were patched in place or replaced can be told apart"""
+        for path in self.out_paths:
+            os.link(path, path + '.link')
+
+    def replaced(self):
+        return [os.stat(path).st_nlink == 1 for path in self.out_paths]
+
+    def check(self, keys, values):
+        for path, shape in zip(self.out_paths, SHAPES):
+            images = open_image_store(path)
+            assert images.shape == (len(keys),) + shape
+            for row, value in enumerate(values):
+                assert np.all(images[row] == value)
+        manifest = load_manifest(self.manifest_path)
+        assert manifest['complete'] and manifest['num_rows'] == len(keys)
+        assert [manifest['entries'][key]['row'] for key in keys] == list(range(len(keys)))
+
+
+def test_first_run_decodes_everything(tmpdir):
+    sources = Sources(tmpdir)
+    keys = [sources.write('%d.txt' % i, i) for i in range(5)]
+    assert sources.update(keys) == sorted(keys)
+    sources.check(keys, range(5))
+
+
+def test_unchanged_sources_are_not_decoded(tmpdir):
+    sources = Sources(tmpdir)
+    keys = [sources.write('%d.txt' % i, i) for i in range(5)]
+    sources.update(keys)
+    sources.link()
+    assert sources.update(keys) == []
+    assert not any(sources.replaced())
+    sources.check(keys, range(5))
+
+
+def test_changed_and_appended_sources_patch_the_stores_in_place(tmpdir):
+    sources = Sources(tmpdir)
+    keys = [sources.write('%d.txt' % i, i) for i in range(5)]
+    sources.update(keys)
+    sources.link()
+
+    sources.write('2.txt', 20)
+    keys += [sources.write('%d.txt' % i, i) for i in range(5, 8)]
+    assert sources.update(keys) == sorted([keys[2]] + keys[5:])
+    assert not any(sources.replaced())
+    sources.check(keys, [0, 1, 20, 3, 4, 5, 6, 7])
+
+
+def test_moved_rows_are_copied_to_new_stores(tmpdir):
+    sources = Sources(tmpdir)
+    keys = [sources.write('%d.txt' % i, i) for i in range(5)]
+    sources.update(keys)
+    sources.link()
+
+    # Removing a key moves the rows after it
+    keys = keys[:1] + keys[2:] + [sources.write('new.txt', 9)]
+    sources.write('4.txt', 40)
+    assert sources.update(keys) == sorted(keys[3:])
+    assert all(sources.replaced())
+    assert not any(os.path.exists(path + '.tmp') for path in sources.out_paths)
+    sources.check(keys, [0, 2, 3, 40, 9])
+
+
+def test_mismatching_stores_are_rebuilt(tmpdir):
+    sources = Sources(tmpdir)
+    keys = [sources.write('%d.txt' % i, i) for i in range(4)]
+    sources.update(keys)
+
+    # A missing store does not match the manifest
+    os.remove(sources.out_paths[1])
+    assert sources.update(keys) == sorted(keys)
+    sources.check(keys, range(4))
+
+
+def test_interrupted_update_is_rebuilt(tmpdir):
+    sources = Sources(tmpdir)
+    keys = [sources.write('%d.txt' % i, i) for i in range(4)]
+    sources.update(keys)
+
+    manifest = load_manifest(sources.manifest_path)
+    manifest['complete'] = False
+    with open(sources.manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    assert sources.update(keys) == sorted(keys)
+    sources.check(keys, range(4))
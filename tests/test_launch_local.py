@@ -0,0 +1,109 @@
+import os
+import pickle
+import socket
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+yaml = pytest.importorskip('yaml')
+pytest.importorskip('easydict')
+
+from preprocess.captions import CAPTION_STORE_FILENAME, pack_captions
+from preprocess.store import EMBEDDINGS_KEY, EMBEDDING_STORE_FILENAME, IMAGES_KEY, image_store_name, \
+    write_store
+from utils.launch_local import launch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUM_EXAMPLES = 16
+EMBED_DIM = 8
+
+
+def _free_ports(n):
+    sockets = [socket.socket() for _ in range(n)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def _write_split(split_dir, rng):
+    os.makedirs(split_dir)
+    with open(os.path.join(split_dir, 'filenames.pickle'), 'wb') as f:
+        pickle.dump(['image_%05d' % i for i in range(NUM_EXAMPLES)], f)
+    with open(os.path.join(split_dir, 'class_info.pickle'), 'wb') as f:
+        pickle.dump([i % 4 + 1 for i in range(NUM_EXAMPLES)], f)
+    write_store(os.path.join(split_dir, image_store_name(76)),
+                {IMAGES_KEY: rng.randint(256, size=(NUM_EXAMPLES, 76, 76, 3)).astype(np.uint8)})
+    write_store(os.path.join(split_dir, EMBEDDING_STORE_FILENAME),
+                {EMBEDDINGS_KEY: rng.normal(size=(NUM_EXAMPLES, 5, EMBED_DIM)).astype(np.float32)})
+    write_store(os.path.join(split_dir, CAPTION_STORE_FILENAME),
+                pack_captions([['caption %d %d' % (i, j) for j in range(5)] for i in range(NUM_EXAMPLES)]))
+
+
+def _write_cfg(tmpdir):
+    with open(os.path.join(ROOT, 'models', 'gancls', 'cfg', 'flowers.yml'), 'r') as f:
+        cfg = yaml.safe_load(f)
+
+    rng = np.random.RandomState(0)
+    data_dir = os.path.join(tmpdir, 'data')
+    for split in ['train', 'test']:
+        _write_split(os.path.join(data_dir, split), rng)
+
+    cfg['DATASET_DIR'] = data_dir
+    cfg['CHECKPOINT_DIR'] = os.path.join(tmpdir, 'checkpoints') + '/'
+    cfg['LOGS_DIR'] = os.path.join(tmpdir, 'logs') + '/'
+    cfg['SAMPLE_DIR'] = os.path.join(tmpdir, 'samples') + '/'
+    cfg['PROFILE']['DIR'] = os.path.join(tmpdir, 'profile') + '/'
+    cfg['MODEL'].update(Z_DIM=4, EMBED_DIM=EMBED_DIM, COMPRESSED_EMBED_DIM=4, GF_DIM=4, DF_DIM=4)
+    # Every worker trains on 8 examples, 2 steps per epoch
+    cfg['TRAIN'].update(FLAG=True, BATCH_SIZE=4, SAMPLE_NUM=4, EPOCH=2, NUM_EMBEDDINGS=2, COMBINED_STEP=False,
+                        N_CRITIC=1)
+    cfg['TRAIN']['CHECKPOINT'].update(STEPS=1, SECS=0)
+    cfg['TRAIN']['SUMMARY'].update(SCALAR_PERIOD=1, FULL_PERIOD=2)
+    cfg['TRAIN']['TIMING']['PERIOD'] = 1
+    cfg['TRAIN']['PREFETCH'].update(WORKERS=1, QUEUE_SIZE=1)
+    ports = _free_ports(3)
+    cfg['DISTRIBUTED'] = {'FLAG': True, 'SYNC': True,
+                          'CLUSTER': {'ps': ['localhost:%d' % ports[0]],
+                                      'worker': ['localhost:%d' % port for port in ports[1:]]}}
+
+    path = os.path.join(tmpdir, 'cluster.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(cfg, f)
+    return path
+
+
+def _read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def test_local_cluster_trains_and_only_the_chief_writes(tmpdir, monkeypatch, capsys):
+    tmpdir = str(tmpdir)
+    cfg_path = _write_cfg(tmpdir)
+    log_dir = os.path.join(tmpdir, 'cluster_logs')
+    # The tasks import the packages of the project from the working directory
+    monkeypatch.chdir(ROOT)
+
+    assert launch(os.path.join('models', 'gancls', 'run.py'), cfg_path, log_dir, poll_period=0.5, timeout=600)
+    out = capsys.readouterr().out
+    for task_index in range(2):
+        assert 'The worker task %d exited with code 0' % task_index in out
+
+    chief_log = _read(os.path.join(log_dir, 'worker-0.log'))
+    worker_log = _read(os.path.join(log_dir, 'worker-1.log'))
+    assert ' [*] Saved ' in chief_log
+    assert ' [*] Saved ' not in worker_log
+    assert 'Reading checkpoints' not in worker_log
+
+    checkpoint_dir = os.path.join(tmpdir, 'checkpoints')
+    assert tf.train.get_checkpoint_state(checkpoint_dir + '/') is not None
+    assert any(name.endswith('.state') for name in os.listdir(checkpoint_dir))
+
+    # A single summary writer, the timing logs of the chief only
+    logs = os.listdir(os.path.join(tmpdir, 'logs'))
+    assert len([name for name in logs if name.startswith('events.out.tfevents')]) == 1
+    assert 'timing.csv' in logs
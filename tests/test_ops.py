@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+pytest.importorskip('easydict')
+
+from models.gancls.model import GanCls
+from utils.config import config_from_yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BATCH_SIZE = 4
+
+
+def _cfg():
+    cfg = config_from_yaml(os.path.join(ROOT, 'models', 'gancls', 'cfg', 'flowers.yml'))
+    cfg.MODEL.EMBED_DIM = 16
+    cfg.MODEL.COMPRESSED_EMBED_DIM = 8
+    cfg.MODEL.DF_DIM = 8
+    return cfg
+
+
+def _moving_statistics():
+    return {var.op.name: var for var in tf.global_variables()
+            if var.op.name.endswith('moving_mean') or var.op.name.endswith('moving_variance')}
+
+
+def _separate_discriminators(model, images, embed):
+    """Runs the discriminator over every batch, as build_tower without MODEL.FUSED_DISCRIMINATOR, then the batch norm
+    updates of every batch in turn"""
+    with tf.Graph().as_default(), tf.Session() as sess:
+        inputs = [tf.constant(batch) for batch in images]
+        logits, update_ops = [], []
+        for i, batch in enumerate(inputs):
+            num_updates = len(tf.get_collection(tf.GraphKeys.UPDATE_OPS))
+            logits.append(model.discriminator(batch, tf.constant(embed), reuse=i > 0)[1])
+            update_ops.append(tf.get_collection(tf.GraphKeys.UPDATE_OPS)[num_updates:])
+
+        sess.run(tf.global_variables_initializer())
+        values = {var.op.name: sess.run(var) for var in tf.global_variables()}
+        out = sess.run(logits)
+        for ops in update_ops:
+            sess.run(ops)
+        return values, np.concatenate(out), sess.run(_moving_statistics())
+
+
+def _fused_discriminator(model, images, embed, values):
+    """Runs the discriminator once over the concatenated batches, as build_tower with MODEL.FUSED_DISCRIMINATOR, and
+    its batch norm updates from the given variable values"""
+    with tf.Graph().as_default(), tf.Session() as sess:
+        _, logits = model.discriminator(tf.constant(np.concatenate(images)), tf.constant(np.tile(embed, [3, 1])),
+                                        groups=3)
+        updates = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+        variables = tf.global_variables()
+        assert sorted(var.op.name for var in variables) == sorted(values)
+        for var in variables:
+            var.load(values[var.op.name], sess)
+        out, _ = sess.run([logits, updates])
+        return out, sess.run(_moving_statistics())
+
+
+def test_fused_discriminator_matches_the_separate_passes():
+    cfg = _cfg()
+    rng = np.random.RandomState(0)
+    # Three batches with distinct statistics, as the synthetic, matching and mismatching batches
+    images = [rng.normal(mean, std, [BATCH_SIZE, 64, 64, 3]).astype(np.float32)
+              for mean, std in [(-0.5, 0.2), (0., 1.), (0.3, 0.5)]]
+    embed = rng.normal(0, 1, [BATCH_SIZE, cfg.MODEL.EMBED_DIM]).astype(np.float32)
+
+    model = GanCls(cfg, build_model=False)
+    values, separate_logits, separate_statistics = _separate_discriminators(model, images, embed)
+    fused_logits, fused_statistics = _fused_discriminator(model, images, embed, values)
+
+    np.testing.assert_allclose(fused_logits, separate_logits, rtol=1e-4, atol=1e-4)
+    assert sorted(fused_statistics) == sorted(separate_statistics) and len(fused_statistics) > 0
+    for name, value in separate_statistics.items():
+        # The statistics moved away from their initial values, in the same way
+        assert not np.allclose(value, values[name])
+        np.testing.assert_allclose(fused_statistics[name], value, rtol=1e-4, atol=1e-5)
+
+
+def test_average_gradients():
+    from utils.ops import average_gradients
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        a = tf.Variable(0.)
+        b = tf.Variable(0.)
+        tower_grads = [[(tf.constant(1.), a), (None, b)], [(tf.constant(3.), a), (None, b)]]
+        averaged = average_gradients(tower_grads)
+        assert [var for _, var in averaged] == [a, b]
+        assert averaged[1][0] is None
+        assert sess.run(averaged[0][0]) == 2.
+        assert average_gradients(tower_grads[:1]) is tower_grads[0]
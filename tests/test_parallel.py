@@ -0,0 +1,108 @@
+import json
+import os
+from functools import partial
+
+import numpy as np
+import pytest
+
+from preprocess.parallel import ChunkProgress, write_image_stores
+from preprocess.store import open_image_store
+
+SHAPES = [(2, 2, 3), (4, 4, 3)]
+
+
+def _load(key):
+    """The images of a key, filled with its number"""
+    return [np.full(shape, int(key), dtype=np.uint8) for shape in SHAPES]
+
+
+def test_write_image_stores(tmpdir):
+    keys = [str(i) for i in range(11)]
+    out_paths = [os.path.join(str(tmpdir), '%dimages.store' % shape[0]) for shape in SHAPES]
+    write_image_stores(keys, _load, out_paths, SHAPES, num_workers=2, chunk_size=3)
+
+    for path, shape in zip(out_paths, SHAPES):
+        images = open_image_store(path)
+        assert images.shape == (len(keys),) + shape
+        for i, key in enumerate(keys):
+            assert np.all(images[i] == int(key))
+    assert sorted(os.listdir(str(tmpdir))) == sorted(os.path.basename(path) for path in out_paths)
+
+
+def _load_logged(log_dir, fail_key, key):
+    """The images of a key, logging the decoded keys to log_dir and failing on fail_key"""
+    if key == fail_key:
+        raise RuntimeError('Can not decode %s' % key)
+    with open(os.path.join(log_dir, str(os.getpid())), 'a') as f:
+        f.write(key + '\n')
+    return _load(key)
+
+
+def _decoded(log_dir):
+    decoded = []
+    for name in os.listdir(log_dir):
+        with open(os.path.join(log_dir, name), 'r') as f:
+            decoded += f.read().split()
+        os.remove(os.path.join(log_dir, name))
+    return sorted(decoded, key=int)
+
+
+def test_chunk_progress_is_reloaded_with_the_same_fingerprint(tmpdir):
+    path = os.path.join(str(tmpdir), 'stores.progress')
+    progress = ChunkProgress(path, 'abc', save_period=3600.)
+    progress.mark(0)
+    progress.mark(3)
+    assert not os.path.exists(path)
+    progress.save()
+
+    assert ChunkProgress(path, 'abc').done == {0, 3}
+    assert ChunkProgress(path, 'other').done == set()
+    progress.remove()
+    assert not os.path.exists(path)
+
+
+def test_chunk_progress_saves_periodically(tmpdir):
+    path = os.path.join(str(tmpdir), 'stores.progress')
+    progress = ChunkProgress(path, 'abc', save_period=0.)
+    progress.mark(2)
+    with open(path, 'r') as f:
+        assert json.load(f) == {'fingerprint': 'abc', 'done': [2]}
+
+
+def test_interrupted_run_resumes_from_the_written_chunks(tmpdir):
+    out_dir = os.path.join(str(tmpdir), 'out')
+    log_dir = os.path.join(str(tmpdir), 'log')
+    os.makedirs(out_dir)
+    os.makedirs(log_dir)
+    keys = [str(i) for i in range(10)]
+    out_paths = [os.path.join(out_dir, '%dimages.store' % shape[0]) for shape in SHAPES]
+
+    with pytest.raises(RuntimeError):
+        write_image_stores(keys, partial(_load_logged, log_dir, '7'), out_paths, SHAPES, num_workers=1, chunk_size=3)
+    # The chunks [0, 3) and [3, 6) were written, the one of the key 7 failed. The worker may have gone on with the
+    # last chunk before the pool was terminated, but it was never checkpointed.
+    assert _decoded(log_dir)[:7] == keys[:7]
+    assert not any(os.path.exists(path) for path in out_paths)
+
+    write_image_stores(keys, partial(_load_logged, log_dir, None), out_paths, SHAPES, num_workers=1, chunk_size=3)
+    assert _decoded(log_dir) == keys[6:]
+    for path, shape in zip(out_paths, SHAPES):
+        images = open_image_store(path)
+        for i, key in enumerate(keys):
+            assert np.all(images[i] == int(key))
+    assert sorted(os.listdir(out_dir)) == sorted(os.path.basename(path) for path in out_paths)
+
+
+def test_rerun_with_another_chunk_size_starts_over(tmpdir):
+    out_dir = os.path.join(str(tmpdir), 'out')
+    log_dir = os.path.join(str(tmpdir), 'log')
+    os.makedirs(out_dir)
+    os.makedirs(log_dir)
+    keys = [str(i) for i in range(10)]
+    out_paths = [os.path.join(out_dir, '%dimages.store' % shape[0]) for shape in SHAPES]
+
+    with pytest.raises(RuntimeError):
+        write_image_stores(keys, partial(_load_logged, log_dir, '7'), out_paths, SHAPES, num_workers=1, chunk_size=3)
+    _decoded(log_dir)
+    write_image_stores(keys, partial(_load_logged, log_dir, None), out_paths, SHAPES, num_workers=1, chunk_size=4)
+    assert _decoded(log_dir) == keys
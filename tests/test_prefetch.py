@@ -0,0 +1,74 @@
+import multiprocessing
+import pickle
+
+import numpy as np
+import pytest
+
+from preprocess.dataset import Dataset
+from preprocess.prefetch import BatchPrefetcher
+
+BATCH_SIZE = 8
+BATCH_KWARGS = dict(window=2, embeddings=True, wrong_img=True)
+
+
+def _dataset():
+    rng = np.random.RandomState(0)
+    images = rng.randint(256, size=(50, 12, 12, 3)).astype(np.uint8)
+    embeddings = rng.normal(size=(50, 5, 4)).astype(np.float32)
+    return Dataset(images, 10, embeddings=embeddings, class_id=np.arange(50) % 4, seed=1)
+
+
+def _next_batches(batches, n):
+    # A batch is only valid until the next call of next_batch
+    return [[np.array(array) for array in batches.next_batch()[:3]] for _ in range(n)]
+
+
+@pytest.mark.parametrize('use_processes', [False, True])
+def test_resumed_prefetcher_continues_mid_epoch(use_processes):
+    with BatchPrefetcher(_dataset(), BATCH_SIZE, use_processes=use_processes, **BATCH_KWARGS) as batches:
+        # 50 examples make 6 batches per epoch, so the state is saved in the middle of the second epoch
+        _next_batches(batches, 9)
+        state = pickle.loads(pickle.dumps(batches.get_state()))
+        epoch = batches.epochs_completed
+        expected = _next_batches(batches, 7)
+
+    dataset = _dataset()
+    dataset.set_state(state)
+    with BatchPrefetcher(dataset, BATCH_SIZE, use_processes=use_processes, **BATCH_KWARGS) as batches:
+        assert batches.epochs_completed == epoch == 1
+        resumed = _next_batches(batches, 7)
+
+    for expected_batch, resumed_batch in zip(expected, resumed):
+        for expected_array, resumed_array in zip(expected_batch, resumed_batch):
+            np.testing.assert_array_equal(expected_array, resumed_array)
+
+
+def test_prefetcher_state_is_the_state_of_the_returned_batches():
+    dataset = _dataset()
+    reference = _dataset()
+    with BatchPrefetcher(dataset, BATCH_SIZE, **BATCH_KWARGS) as batches:
+        for _ in range(10):
+            batches.next_batch()
+            reference.next_ids(BATCH_SIZE)
+            reference.rng.randint(2 ** 31 - 1)
+            state, expected = batches.get_state(), reference.get_state()
+            assert state['epochs_completed'] == expected['epochs_completed']
+            assert state['index_in_epoch'] == expected['index_in_epoch']
+            np.testing.assert_array_equal(state['perm'], expected['perm'])
+
+
+
+
+def test_worker_processes_are_forked_whatever_the_default_start_method():
+    with BatchPrefetcher(_dataset(), BATCH_SIZE, **BATCH_KWARGS) as reference:
+        expected = _next_batches(reference, 3)
+
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method('spawn', force=True)
+    try:
+        with BatchPrefetcher(_dataset(), BATCH_SIZE, use_processes=True, **BATCH_KWARGS) as batches:
+            for batch, expected_batch in zip(_next_batches(batches, 3), expected):
+                for array, expected_array in zip(batch, expected_batch):
+                    np.testing.assert_array_equal(array, expected_array)
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
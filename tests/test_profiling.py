@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from utils.profiling import OTHER_NETWORK, StepTracer, node_scope  # noqa: E402
+
+
+@pytest.mark.parametrize('node_name, scope', [
+    ('d_net/h0/conv/Conv2D', ('d_net', 'd_net/h0', False)),
+    ('tower_1/g_net/h1/BiasAdd', ('g_net', 'g_net/h1', False)),
+    ('gradients/d_net/h2/conv/Conv2D_grad/Conv2DBackpropInput', ('d_net', 'd_net/h2', True)),
+    ('tower_0/gradients_1/g_net/h0/MatMul_grad/MatMul', ('g_net', 'g_net/h0', True)),
+    ('InceptionV3/Mixed_5b/concat', ('InceptionV3', 'InceptionV3/Mixed_5b', False)),
+    ('input_pipeline/load_batch', (OTHER_NETWORK, OTHER_NETWORK, False)),
+])
+def test_node_scope(node_name, scope):
+    assert node_scope(node_name) == scope
+
+
+def test_tracer_only_traces_the_chosen_steps(tmpdir):
+    out_dir = os.path.join(str(tmpdir), 'profile')
+    tracer = StepTracer(out_dir, [[2, 3], [10, 10]], top=5)
+    assert [step for step in range(12) if tracer.active(step)] == [2, 3, 10]
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        x = tf.placeholder(tf.float32, [4, 4])
+        with tf.variable_scope('d_net'):
+            y = tf.matmul(x, x) + 1.
+        value = np.eye(4, dtype=np.float32)
+
+        np.testing.assert_array_equal(tracer.run(sess, 'd_step', y, {x: value}, step=1), value + 1.)
+        assert not os.path.exists(out_dir)
+        np.testing.assert_array_equal(tracer.run(sess, 'd_step', y, {x: value}, step=2), value + 1.)
+
+    assert sorted(os.listdir(out_dir)) == ['d_step_step2.ops.txt', 'd_step_step2.trace.json']
+    with open(os.path.join(out_dir, 'd_step_step2.ops.txt'), 'r') as f:
+        table = f.read()
+    assert table.startswith('network') and 'd_net' in table
@@ -0,0 +1,24 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy.misc')
+
+from preprocess.pyramid import build_pyramid, resize_images  # noqa: E402
+from preprocess.store import IMAGES_KEY, image_store_name, open_image_store, store_attrs, write_store  # noqa: E402
+
+
+def test_build_pyramid_resizes_every_image(tmpdir):
+    split_dir = str(tmpdir)
+    images = np.random.RandomState(0).randint(256, size=(5, 360, 360, 3)).astype(np.uint8)
+    write_store(os.path.join(split_dir, image_store_name(360)), {IMAGES_KEY: images})
+
+    build_pyramid(split_dir, [64, 299])
+    resized = open_image_store(os.path.join(split_dir, image_store_name(76)))
+    assert resized.shape == (5, 76, 76, 3)
+    np.testing.assert_array_equal(resized, resize_images(images, 76))
+    assert store_attrs(os.path.join(split_dir, image_store_name(76))) == {'source_size': 360}
+    # 299 is trained on the source images themselves
+    assert not os.path.exists(os.path.join(split_dir, image_store_name(360) + '.tmp'))
+    assert sorted(os.listdir(split_dir)) == [image_store_name(360), image_store_name(76)]
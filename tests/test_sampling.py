@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from preprocess.sampling import ClassIndex, pick_in_batch
+
+
+def _class_ids(counts):
+    class_id = np.repeat(np.arange(len(counts)), counts)
+    return np.random.RandomState(0).permutation(class_id)
+
+
+@pytest.mark.parametrize('counts', [[1, 1], [5, 3, 7, 1, 4], [10000, 1], [1, 10000], [3, 10000, 2]])
+def test_sample_other_class_never_returns_the_own_class(counts):
+    class_id = _class_ids(counts)
+    index = ClassIndex(class_id)
+    rng = np.random.RandomState(1)
+    for c in np.unique(class_id):
+        queries = np.full(2000, c)
+        sampled = index.sample_other_class(queries, rng=rng)
+        assert np.all(class_id[sampled] != c)
+        assert np.all((sampled >= 0) & (sampled < len(class_id)))
+
+
+def test_sample_other_class_covers_the_other_examples():
+    class_id = _class_ids([2, 3, 4])
+    index = ClassIndex(class_id)
+    sampled = index.sample_other_class(np.zeros(5000, dtype=np.int64), rng=np.random.RandomState(0))
+    assert set(sampled) == set(np.flatnonzero(class_id != 0))
+
+
+def test_class_index_needs_two_classes():
+    with pytest.raises(ValueError):
+        ClassIndex(np.zeros(10, dtype=np.int64))
+
+
+def test_pick_in_batch_picks_another_class():
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        class_ids = rng.randint(3, size=16)
+        pos = pick_in_batch(class_ids, rng=rng)
+        single = len(np.unique(class_ids)) == 1
+        if single:
+            assert np.all(pos == -1)
+        else:
+            assert np.all(pos >= 0)
+            assert np.all(class_ids[pos] != class_ids)
+
+
+def test_pick_in_batch_of_a_single_class():
+    assert np.all(pick_in_batch(np.full(8, 4)) == -1)
+
+
+def test_pick_in_batch_with_one_dominant_class():
+    class_ids = np.array([7] * 63 + [2])
+    pos = pick_in_batch(class_ids, rng=np.random.RandomState(0))
+    assert np.all(pos[:63] == 63)
+    assert class_ids[pos[63]] == 7
@@ -0,0 +1,134 @@
+import pickle
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from preprocess.captions import CaptionStore, pack_captions
+from preprocess.dataset import Dataset
+from preprocess.shards import ShardedArray, StreamingDataset, write_shards
+
+NUM_EXAMPLES = 50
+SHARD_SIZE = 10
+
+
+def _source_dataset():
+    rng = np.random.RandomState(0)
+    images = rng.randint(256, size=(NUM_EXAMPLES, 6, 6, 3)).astype(np.uint8)
+    # The first embedding value of every example is its index, so rows can be traced back
+    embeddings = rng.randn(NUM_EXAMPLES, 5, 4).astype(np.float32)
+    embeddings[:, :, 0] = np.arange(NUM_EXAMPLES)[:, None]
+    captions = [['caption %d of %d' % (c, i) for c in range(1 + i % 3)] for i in range(NUM_EXAMPLES)]
+    class_id = np.arange(NUM_EXAMPLES) % 4
+    return Dataset(images, 4, embeddings, filenames=['%d' % i for i in range(NUM_EXAMPLES)], class_id=class_id,
+                   captions=CaptionStore.from_arrays(**pack_captions(captions)))
+
+
+@pytest.fixture
+def shard_dir(tmpdir):
+    write_shards(_source_dataset(), str(tmpdir), shard_size=SHARD_SIZE)
+    return str(tmpdir)
+
+
+def test_sharded_split_round_trip(shard_dir):
+    source = _source_dataset()
+    dataset = StreamingDataset(shard_dir, 4, seed=0)
+    assert dataset.num_examples == NUM_EXAMPLES and len(dataset._shards) == NUM_EXAMPLES // SHARD_SIZE
+
+    # Row r of the sharded split comes from the example source_index[r] of the source dataset
+    source_index = np.concatenate([shard.arrays['source_index'] for shard in dataset._shards])
+    assert sorted(source_index) == list(range(NUM_EXAMPLES))
+    np.testing.assert_array_equal(dataset.images[:], source.images[source_index])
+    np.testing.assert_array_equal(dataset.embeddings[:], source.embeddings[source_index])
+    np.testing.assert_array_equal(dataset.class_ids, source.class_ids[source_index])
+    for idx in range(NUM_EXAMPLES):
+        assert dataset.get_captions(idx) == source.get_captions(source_index[idx])
+        assert dataset.get_caption(idx, 0) == source.get_caption(source_index[idx], 0)
+
+
+def test_sharded_array_indexing(shard_dir):
+    dataset = StreamingDataset(shard_dir, 4, seed=0)
+    array = dataset.images
+    assert isinstance(array, ShardedArray)
+    assert len(array) == NUM_EXAMPLES and array.shape == (NUM_EXAMPLES, 6, 6, 3) and array.dtype == np.uint8
+
+    full = np.concatenate([np.asarray(shard.arrays['images']) for shard in dataset._shards])
+    ids = np.random.RandomState(1).randint(NUM_EXAMPLES, size=30)
+    np.testing.assert_array_equal(array[ids], full[ids])
+    np.testing.assert_array_equal(array[[49, 0, 10, 9, 9]], full[[49, 0, 10, 9, 9]])
+    np.testing.assert_array_equal(array[5:37:3], full[5:37:3])
+    assert array[[]].shape == (0, 6, 6, 3)
+
+
+@pytest.mark.parametrize('shuffle_buffer', [1, 10, 20, NUM_EXAMPLES])
+def test_every_row_is_read_once_per_pass(shard_dir, shuffle_buffer):
+    dataset = StreamingDataset(shard_dir, 4, shuffle_buffer=shuffle_buffer, seed=0)
+    # The rows drawn plus the rows still in the shuffle buffer are the rows read from the shards
+    num_drawn = 3 * NUM_EXAMPLES - shuffle_buffer
+    drawn = np.concatenate([dataset.next_ids(1) for _ in range(num_drawn)])
+    counts = Counter(np.concatenate([drawn, dataset._buffer]).tolist())
+    assert counts == Counter({idx: 3 for idx in range(NUM_EXAMPLES)})
+
+
+def test_shard_order_and_rows_are_shuffled(shard_dir):
+    dataset = StreamingDataset(shard_dir, 4, shuffle_buffer=20, seed=0)
+    drawn = np.concatenate([dataset.next_ids(10) for _ in range(3)])
+    assert sorted(drawn) != list(drawn)
+
+    orders = set()
+    for _ in range(5):
+        dataset._start_pass()
+        orders.add(tuple(dataset._shard_order))
+    assert len(orders) > 1
+
+
+
+@pytest.mark.parametrize('shuffle_buffer', [1, 20, NUM_EXAMPLES])
+def test_an_epoch_ends_once_its_rows_are_drawn(shard_dir, shuffle_buffer):
+    dataset = StreamingDataset(shard_dir, 4, shuffle_buffer=shuffle_buffer, seed=0)
+    assert dataset.epochs_completed == -1
+    drawn = set()
+    epochs = []
+    for _ in range(10 * NUM_EXAMPLES):
+        drawn.update(dataset.next_ids(1).tolist())
+        epochs.append(dataset.epochs_completed)
+        if dataset.epochs_completed >= 1:
+            assert len(drawn) == NUM_EXAMPLES
+    # The rows read ahead in the buffer do not end the epoch early
+    assert epochs[:NUM_EXAMPLES - 1] == [0] * (NUM_EXAMPLES - 1)
+    assert epochs == sorted(epochs) and 1 <= epochs[-1] <= 10
+
+
+def test_a_restored_state_gives_the_same_batches(shard_dir):
+    dataset = StreamingDataset(shard_dir, 4, shuffle_buffer=20, seed=0)
+    for _ in range(7):
+        dataset.next_ids(8)
+    state = pickle.loads(pickle.dumps(dataset.get_state()))
+    expected = [dataset.next_ids(8) for _ in range(20)]
+    epoch = dataset.epochs_completed
+
+    restored = StreamingDataset(shard_dir, 4, shuffle_buffer=20, seed=1)
+    restored.set_state(state)
+    for ids in expected:
+        np.testing.assert_array_equal(restored.next_ids(8), ids)
+    assert restored.epochs_completed == epoch
+
+
+def test_shards_split_the_rows_between_the_workers(shard_dir):
+    rows = []
+    for index in range(2):
+        dataset = StreamingDataset(shard_dir, 4, shuffle_buffer=10, seed=0)
+        dataset.shard(2, index)
+        shard_rows = {shard_id * SHARD_SIZE + row for shard_id in range(index, 5, 2) for row in range(SHARD_SIZE)}
+        ids = np.concatenate([dataset.next_ids(5) for _ in range(40)])
+        assert set(ids.tolist()) == shard_rows
+        rows.append(shard_rows)
+    assert not rows[0] & rows[1] and len(rows[0] | rows[1]) == NUM_EXAMPLES
+
+
+def test_invalid_shards(shard_dir):
+    dataset = StreamingDataset(shard_dir, 4, seed=0)
+    with pytest.raises(ValueError):
+        dataset.shard(2, 2)
+    with pytest.raises(ValueError):
+        dataset.shard(6, 0)
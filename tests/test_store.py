@@ -0,0 +1,62 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from preprocess.store import EMBEDDING_PICKLE_FILENAME, EMBEDDING_STORE_FILENAME, IMAGES_KEY, convert_split_dir, \
+    open_embedding_store, open_image_store, open_store, read_header, store_attrs, write_store
+
+
+def test_write_store_round_trip(tmpdir):
+    path = os.path.join(str(tmpdir), 'arrays.store')
+    arrays = {
+        IMAGES_KEY: np.random.RandomState(0).randint(256, size=(7, 5, 4, 3)).astype(np.uint8),
+        'labels': np.arange(7, dtype=np.int64),
+        'embeddings': np.random.RandomState(1).randn(7, 10, 3).astype(np.float32),
+    }
+    write_store(path, arrays, attrs={'source': 'test'})
+
+    mapped = open_store(path)
+    assert sorted(mapped.keys()) == sorted(arrays.keys())
+    for name, array in arrays.items():
+        assert mapped[name].dtype == array.dtype
+        np.testing.assert_array_equal(mapped[name], array)
+    np.testing.assert_array_equal(open_image_store(path), arrays[IMAGES_KEY])
+    assert store_attrs(path) == {'source': 'test'}
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_arrays_are_page_aligned_memmaps(tmpdir):
+    path = os.path.join(str(tmpdir), 'arrays.store')
+    write_store(path, {'a': np.ones((3, 3), dtype=np.uint8), 'b': np.zeros(5, dtype=np.float64)})
+    for array in read_header(path)['arrays']:
+        assert array['offset'] % 64 == 0
+    assert isinstance(open_store(path)['a'], np.memmap)
+
+
+def test_empty_arrays(tmpdir):
+    path = os.path.join(str(tmpdir), 'empty.store')
+    write_store(path, {IMAGES_KEY: np.zeros((0, 4, 4, 3), dtype=np.uint8)})
+    assert open_image_store(path).shape == (0, 4, 4, 3)
+
+
+def test_not_a_store(tmpdir):
+    path = os.path.join(str(tmpdir), 'images.pickle')
+    with open(path, 'wb') as f:
+        f.write(b'not a store at all')
+    with pytest.raises(RuntimeError):
+        read_header(path)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float16])
+def test_convert_embedding_pickle(tmpdir, dtype):
+    split_dir = str(tmpdir)
+    embeddings = np.random.RandomState(0).randn(6, 5, 8)
+    with open(os.path.join(split_dir, EMBEDDING_PICKLE_FILENAME), 'wb') as f:
+        pickle.dump(embeddings, f)
+
+    convert_split_dir(split_dir, dtype)
+    mapped = open_embedding_store(os.path.join(split_dir, EMBEDDING_STORE_FILENAME))
+    assert mapped.dtype == dtype and mapped.shape == (6, 5, 8)
+    np.testing.assert_allclose(mapped, embeddings, rtol=1e-3 if dtype == np.float16 else 1e-6)
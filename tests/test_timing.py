@@ -0,0 +1,66 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from utils.timing import STEP_PHASE, StepTimer  # noqa: E402
+
+
+def _run_steps(timer, data_times, sample_every=None):
+    for i, data_time in enumerate(data_times):
+        timer.start_step()
+        timer.add('data', data_time)
+        if sample_every is not None and i % sample_every == sample_every - 1:
+            timer.add('sample', 1.)
+            timer.count('samples')
+        timer.end_step(4)
+
+
+def test_phase_statistics_over_the_window():
+    timer = StepTimer(window=100)
+    _run_steps(timer, [0.01 * i for i in range(1, 201)])
+    stats, images_per_sec = timer.stats()
+    # Only the last 100 steps are in the window
+    np.testing.assert_allclose(stats['data']['mean'], np.mean([0.01 * i for i in range(101, 201)]))
+    np.testing.assert_allclose(stats['data']['p50'], np.percentile([0.01 * i for i in range(101, 201)], 50))
+    assert stats['data']['p50'] <= stats['data']['p95'] <= stats['data']['p99']
+    np.testing.assert_allclose(timer.mean('data'), np.mean([0.01 * i for i in range(1, 201)]))
+    assert list(stats) == ['data', STEP_PHASE]
+    assert images_per_sec > 0
+    assert timer.counters['images'] == 800
+
+
+def test_phases_not_run_count_as_zero():
+    timer = StepTimer()
+    _run_steps(timer, [0.] * 10, sample_every=5)
+    stats, _ = timer.stats()
+    # The sample phase was first used in the fifth step and ran twice in 10 steps
+    np.testing.assert_allclose(stats['sample']['mean'], 0.2)
+    assert stats['sample']['p50'] == 0.
+    assert timer.counters['samples'] == 2
+
+
+def test_report_appends_to_the_logs(tmpdir):
+    timer = StepTimer(str(tmpdir))
+    assert timer.report(0) is None
+    _run_steps(timer, [0.5, 0.5])
+    timer.report(2)
+    _run_steps(timer, [0.5])
+    stats, images_per_sec = timer.report(3)
+
+    with open(os.path.join(str(tmpdir), 'timing.csv'), 'r', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['step', 'phase', 'mean', 'p50', 'p95', 'p99', 'images_per_sec']
+    assert [row[:2] for row in rows[1:]] == [['2', 'data'], ['2', STEP_PHASE], ['3', 'data'], ['3', STEP_PHASE]]
+    assert float(rows[-2][2]) == pytest.approx(0.5)
+
+    with open(os.path.join(str(tmpdir), 'timing.jsonl'), 'r') as f:
+        reports = [json.loads(line) for line in f]
+    assert [report['step'] for report in reports] == [2, 3]
+    assert reports[-1]['counters']['images'] == 12
+    assert reports[-1]['phases']['data']['mean'] == pytest.approx(stats['data']['mean'])
+    assert '[Timing]' in timer.format(stats, images_per_sec)
@@ -0,0 +1,169 @@
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+pytest.importorskip('easydict')
+
+from models.gancls.model import GanCls  # noqa: E402
+from models.gancls.trainer import GanClsTrainer  # noqa: E402
+from utils.config import config_from_yaml  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BATCH_SIZE = 4
+
+
+def _cfg():
+    cfg = config_from_yaml(os.path.join(ROOT, 'models', 'gancls', 'cfg', 'flowers.yml'))
+    cfg.MODEL.Z_DIM = 10
+    cfg.MODEL.EMBED_DIM = 16
+    cfg.MODEL.COMPRESSED_EMBED_DIM = 8
+    cfg.MODEL.GF_DIM = 8
+    cfg.MODEL.DF_DIM = 8
+    cfg.MODEL.UINT8_INPUTS = False
+    cfg.TRAIN.BATCH_SIZE = BATCH_SIZE
+    cfg.TRAIN.SAMPLE_NUM = BATCH_SIZE
+    cfg.TRAIN.COMBINED_STEP = True
+    return cfg
+
+
+def _feed_dict(model, seed=0):
+    rng = np.random.RandomState(seed)
+    return {
+        model.inputs: rng.uniform(-1, 1, [BATCH_SIZE] + model.image_dims).astype(np.float32),
+        model.wrong_inputs: rng.uniform(-1, 1, [BATCH_SIZE] + model.image_dims).astype(np.float32),
+        model.phi_inputs: rng.normal(0, 1, [BATCH_SIZE, model.embed_dim]).astype(np.float32),
+        model.z: rng.normal(0, 1, [BATCH_SIZE, model.z_dim]).astype(np.float32),
+    }
+
+
+def _build(sess, cfg):
+    model = GanCls(cfg)
+    trainer = GanClsTrainer(sess, model, None, cfg)
+    trainer.define_losses()
+    sess.run(tf.global_variables_initializer())
+    return model, trainer
+
+
+def _changed(sess, variables, before):
+    return [not np.array_equal(value, before[var.op.name]) for var, value in zip(variables, sess.run(variables))]
+
+
+def test_combined_step_updates_d_and_g_from_one_forward_pass():
+    with tf.Graph().as_default(), tf.Session() as sess:
+        model, trainer = _build(sess, _cfg())
+        feed_dict = _feed_dict(model)
+        before = {var.op.name: value for var, value in
+                  zip(tf.global_variables(), sess.run(tf.global_variables()))}
+        d_loss, g_loss = sess.run([trainer.D_loss, trainer.G_loss], feed_dict=feed_dict)
+
+        _, step_d_loss, step_g_loss = sess.run([trainer.DG_optim, trainer.D_loss, trainer.G_loss],
+                                               feed_dict=feed_dict)
+        # The losses of the step are the ones of the variables before any update of the step
+        np.testing.assert_allclose(step_d_loss, d_loss, rtol=1e-5)
+        np.testing.assert_allclose(step_g_loss, g_loss, rtol=1e-5)
+        assert all(_changed(sess, trainer.d_vars, before))
+        assert all(_changed(sess, trainer.g_vars, before))
+
+
+def test_d_step_leaves_g_unchanged():
+    with tf.Graph().as_default(), tf.Session() as sess:
+        model, trainer = _build(sess, _cfg())
+        before = {var.op.name: value for var, value in
+                  zip(tf.global_variables(), sess.run(tf.global_variables()))}
+        sess.run(trainer.D_optim, feed_dict=_feed_dict(model))
+        assert all(_changed(sess, trainer.d_vars, before))
+        assert not any(_changed(sess, trainer.g_vars, before))
+
+
+def test_combined_step_is_only_built_when_enabled():
+    cfg = _cfg()
+    cfg.TRAIN.COMBINED_STEP = False
+    with tf.Graph().as_default(), tf.Session() as sess:
+        _, trainer = _build(sess, cfg)
+        assert trainer.DG_optim is None
+
+
+def test_summaries_are_evaluated_at_their_period(tmpdir):
+    cfg = _cfg()
+    cfg.LOGS_DIR = str(tmpdir)
+    cfg.TRAIN.SUMMARY.SCALAR_PERIOD = 10
+    cfg.TRAIN.SUMMARY.FULL_PERIOD = 50
+    with tf.Graph().as_default(), tf.Session() as sess:
+        _, trainer = _build(sess, cfg)
+        trainer.define_summaries()
+        try:
+            assert trainer.summaries_due(7) == []
+            assert trainer.summaries_due(20) == [trainer.scalar_merged_summ]
+            assert trainer.summaries_due(100) == [trainer.scalar_merged_summ, trainer.full_merged_summ]
+        finally:
+            trainer.writer.close()
+
+
+class _ListWriter(object):
+    def __init__(self):
+        self.summaries = []
+        self.closed = False
+
+    def add_summary(self, summary, step):
+        self.summaries.append((summary, step))
+
+    def close(self):
+        self.closed = True
+
+
+def test_async_summary_writer_writes_every_summary_in_order():
+    from utils.summary import AsyncSummaryWriter
+
+    writer = _ListWriter()
+    async_writer = AsyncSummaryWriter(writer, max_queue=2)
+    for step in range(20):
+        async_writer.add_summary(b'summary %d' % step, step)
+    async_writer.close()
+    assert writer.summaries == [(b'summary %d' % step, step) for step in range(20)]
+    assert writer.closed
+
+
+def _tower_outputs(num_towers, feed, values=None):
+    """The generator and discriminator outputs of GanCls with num_towers towers and the given variable values"""
+    cfg = _cfg()
+    cfg.TRAIN.TOWERS.NUM = num_towers
+    with tf.Graph().as_default(), tf.Session(config=tf.ConfigProto(device_count={'CPU': num_towers})) as sess:
+        model = GanCls(cfg)
+        sess.run(tf.global_variables_initializer())
+        if values is not None:
+            for var in tf.global_variables():
+                var.load(values[var.op.name], sess)
+        values = {var.op.name: value for var, value in zip(tf.global_variables(), sess.run(tf.global_variables()))}
+        outputs = sess.run([model.G, model.D_synthetic_logits, model.D_real_match_logits],
+                           feed_dict={getattr(model, name): value for name, value in feed.items()})
+        return values, outputs, len(model.update_ops)
+
+
+def test_towers_share_the_variables_of_a_single_tower():
+    rng = np.random.RandomState(0)
+    half = BATCH_SIZE // 2
+
+    def repeated(shape):
+        # Both halves of the batch are the same, so that each tower sees the batch norm statistics of the whole batch
+        return np.tile(rng.uniform(-1, 1, [half] + shape).astype(np.float32), [2] + [1] * len(shape))
+
+    feed = {'inputs': repeated([64, 64, 3]), 'wrong_inputs': repeated([64, 64, 3]), 'phi_inputs': repeated([16]),
+            'z': repeated([10])}
+    values, single, num_update_ops = _tower_outputs(1, feed)
+    tower_values, towers, tower_update_ops = _tower_outputs(2, feed, values)
+
+    assert sorted(tower_values) == sorted(values)
+    assert tower_update_ops == num_update_ops
+    for tower_output, single_output in zip(towers, single):
+        assert tower_output.shape[0] == BATCH_SIZE
+        np.testing.assert_allclose(tower_output, single_output, rtol=1e-4, atol=1e-4)
+
+
+def test_towers_need_a_divisible_batch():
+    cfg = _cfg()
+    cfg.TRAIN.TOWERS.NUM = 3
+    with tf.Graph().as_default():
+        with pytest.raises(ValueError):
+            GanCls(cfg)
@@ -0,0 +1,88 @@
+"""
+Distributed (between-graph replicated) training.
+
+The cluster is described by cfg.DISTRIBUTED.CLUSTER, a dictionary of the host:port addresses of the 'ps' and
+'worker' jobs. Every task of the cluster runs the same script with its --job_name and --task_index. The ps tasks
+only serve the variables, which replica_device_setter spreads over them. Every worker builds its own copy of the
+graph and trains on its own shard of the dataset.
+
+With DISTRIBUTED.SYNC, the gradients of all the workers are aggregated by a SyncReplicasOptimizer before every
+update. Otherwise the workers update the variables asynchronously. The first worker (the chief) initializes and
+restores the variables and writes the summaries and the checkpoints. The other workers only start training once the
+chief has marked the variables as ready, after their restore.
+"""
+
+import time
+
+import tensorflow as tf
+
+PS_JOB = 'ps'
+WORKER_JOB = 'worker'
+
+
+class Cluster(object):
+    def __init__(self, cfg, job_name, task_index):
+        if job_name not in [PS_JOB, WORKER_JOB]:
+            raise ValueError('Unknown job %s, expected %s or %s' % (job_name, PS_JOB, WORKER_JOB))
+
+        self.spec = tf.train.ClusterSpec({job: list(addresses) for job, addresses in cfg.DISTRIBUTED.CLUSTER.items()})
+        self.job_name = job_name
+        self.task_index = task_index
+        self.num_workers = self.spec.num_tasks(WORKER_JOB)
+        self.is_ps = job_name == PS_JOB
+        self.is_chief = job_name == WORKER_JOB and task_index == 0
+        self.worker_device = '/job:%s/task:%d' % (WORKER_JOB, task_index)
+
+        self.sync = cfg.DISTRIBUTED.SYNC
+        if self.sync and (cfg.TRAIN.COMBINED_STEP or cfg.TRAIN.N_CRITIC != 1):
+            # Every worker must run the same sequence of D and G updates, each of them applied once
+            raise ValueError('Synchronous distributed training requires TRAIN.COMBINED_STEP: False and '
+                             'TRAIN.N_CRITIC: 1')
+
+        self._sync_optimizers = []
+        self._ready = None
+
+    def start_server(self, config: tf.ConfigProto=None) -> tf.train.Server:
+        return tf.train.Server(self.spec, job_name=self.job_name, task_index=self.task_index, config=config)
+
+    def device_setter(self):
+        """The device function placing the variables on the ps tasks and the other ops on this worker"""
+        return tf.train.replica_device_setter(worker_device=self.worker_device, cluster=self.spec)
+
+    def wrap_optimizer(self, optimizer: tf.train.Optimizer) -> tf.train.Optimizer:
+        """Returns the optimizer applying the gradients of the workers, synchronously with DISTRIBUTED.SYNC"""
+        if not self.sync:
+            return optimizer
+        optimizer = tf.train.SyncReplicasOptimizer(optimizer, replicas_to_aggregate=self.num_workers,
+                                                   total_num_replicas=self.num_workers)
+        self._sync_optimizers.append(optimizer)
+        return optimizer
+
+    def define_init_ops(self):
+        """Defines the ops of set_ready, wait_for_variables and start. Must be called once the train ops are defined,
+        in the device scope of device_setter."""
+        # Initialized by the chief once the variables are restored. It is in no collection, so it is neither
+        # initialized by global_variables_initializer nor saved in the checkpoints.
+        self._ready = tf.Variable(True, trainable=False, name='variables_ready', collections=[])
+        self._is_ready = tf.is_variable_initialized(self._ready)
+        if self.is_chief:
+            self._sync_init_ops = [[opt.chief_init_op, opt.get_init_tokens_op()] for opt in self._sync_optimizers]
+        else:
+            self._sync_init_ops = [opt.local_step_init_op for opt in self._sync_optimizers]
+
+    def set_ready(self, sess: tf.Session):
+        """Marks the variables as initialized and restored, run by the chief"""
+        sess.run(self._ready.initializer)
+
+    def wait_for_variables(self, sess: tf.Session, period=1.):
+        """Waits for the chief to initialize and restore the variables, see set_ready"""
+        while not sess.run(self._is_ready):
+            print('Waiting for the chief to initialize and restore the variables')
+            time.sleep(period)
+
+    def start(self, sess: tf.Session, coord: tf.train.Coordinator):
+        """Starts the synchronous updates, once the variables are initialized (and restored by the chief)"""
+        sess.run(self._sync_init_ops)
+        if self.is_chief:
+            for opt in self._sync_optimizers:
+                opt.get_chief_queue_runner().create_threads(sess, coord=coord, daemon=True, start=True)
@@ -0,0 +1,146 @@
+"""
+Frozen inference graphs.
+
+freeze_graph turns the variables needed by the outputs into constants. optimize_for_inference then folds the
+inference batch normalizations (see batch_norm in utils/ops.py) into the weights and biases of the preceding
+convolution, transposed convolution or dense layer. It also removes the training-only nodes and keeps only the
+nodes needed by the outputs.
+
+A fused batch norm y = (x - mean) * gamma / sqrt(variance + eps) + beta over x = conv(input, W) + b is equivalent to
+conv(input, W * s) + (b - mean) * s + beta with s = gamma / sqrt(variance + eps), s scaling the output channels of W.
+"""
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import node_def_pb2
+from tensorflow.python.framework import tensor_util
+
+FUSED_BATCH_NORM_OPS = ['FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3']
+# The axis of the output channels in the weights of every foldable op
+OUTPUT_CHANNEL_AXIS = {
+    'Conv2D': 3,
+    'Conv2DBackpropInput': 2,
+    'MatMul': 1,
+}
+
+
+def _node_name(tensor_name):
+    """The name of the node of an input ('^name', 'name' or 'name:1')"""
+    return tensor_name.lstrip('^').split(':')[0]
+
+
+def _output_index(tensor_name):
+    parts = tensor_name.split(':')
+    return int(parts[1]) if len(parts) > 1 else 0
+
+
+def _const_value(nodes, name):
+    """The value of the constant node name, following the Identity nodes, or None if it is not a constant"""
+    node = nodes[_node_name(name)]
+    while node.op == 'Identity':
+        node = nodes[_node_name(node.input[0])]
+    if node.op != 'Const':
+        return None
+    return tensor_util.MakeNdarray(node.attr['value'].tensor)
+
+
+def _const_node(name, value):
+    node = node_def_pb2.NodeDef()
+    node.op = 'Const'
+    node.name = name
+    node.attr['dtype'].CopyFrom(tf.AttrValue(type=tf.as_dtype(value.dtype).as_datatype_enum))
+    node.attr['value'].CopyFrom(tf.AttrValue(tensor=tf.make_tensor_proto(value)))
+    return node
+
+
+def fold_batch_norms(graph_def: tf.GraphDef) -> tf.GraphDef:
+    """Folds the inference fused batch norms over BiasAdd(Conv2D | Conv2DBackpropInput | MatMul), possibly
+    reshaped, into the constant weights and biases of the layer. The other batch norms are left unchanged."""
+    folded_graph = tf.GraphDef()
+    folded_graph.CopyFrom(graph_def)
+    nodes = {node.name: node for node in folded_graph.node}
+
+    consumers = {}
+    for node in folded_graph.node:
+        for tensor_name in node.input:
+            consumers.setdefault(_node_name(tensor_name), []).append((node, tensor_name))
+
+    def value_consumers(name):
+        # The Shape ops (e.g. of the reshapes around the batch norm of a dense layer) do not read the values
+        return [node for node, _ in consumers.get(name, []) if node.op != 'Shape']
+
+    num_folded = 0
+    for bn in list(folded_graph.node):
+        if bn.op not in FUSED_BATCH_NORM_OPS or bn.attr['is_training'].b:
+            continue
+        if bn.attr['data_format'].s not in [b'', b'NHWC']:
+            continue
+        # Only the normalized output (0) of the batch norm is used for inference
+        if any(_output_index(tensor_name) != 0 for _, tensor_name in consumers.get(bn.name, [])):
+            continue
+
+        bias_add = nodes[_node_name(bn.input[0])]
+        if bias_add.op == 'Reshape':
+            # The batch norm of a dense layer reshapes its [N, C] input to [N, 1, 1, C]
+            bias_add = nodes[_node_name(bias_add.input[0])]
+        if bias_add.op != 'BiasAdd' or bias_add.attr['data_format'].s not in [b'', b'NHWC']:
+            continue
+        layer = nodes[_node_name(bias_add.input[0])]
+        if layer.op not in OUTPUT_CHANNEL_AXIS or (layer.op == 'MatMul' and layer.attr['transpose_b'].b):
+            continue
+        # The layer and its bias must only feed the batch norm, whose statistics are about to be folded in them
+        if len(value_consumers(layer.name)) != 1 or len(value_consumers(bias_add.name)) != 1:
+            continue
+
+        weights = _const_value(nodes, layer.input[1])
+        bias = _const_value(nodes, bias_add.input[1])
+        gamma, beta, mean, variance = [_const_value(nodes, name) for name in bn.input[1:5]]
+        if any(value is None for value in [weights, bias, gamma, beta, mean, variance]):
+            continue
+
+        scale = gamma / np.sqrt(variance + bn.attr['epsilon'].f)
+        shape = [1] * weights.ndim
+        shape[OUTPUT_CHANNEL_AXIS[layer.op]] = -1
+        folded_weights = (weights * scale.reshape(shape)).astype(weights.dtype)
+        folded_bias = ((bias - mean) * scale + beta).astype(bias.dtype)
+
+        folded_graph.node.extend([_const_node(layer.name + '/folded_weights', folded_weights),
+                                  _const_node(bias_add.name + '/folded_bias', folded_bias)])
+        layer.input[1] = layer.name + '/folded_weights'
+        bias_add.input[1] = bias_add.name + '/folded_bias'
+
+        # The batch norm becomes an identity, so its consumers are unchanged
+        x, dtype = bn.input[0], bn.attr['T']
+        bn.op = 'Identity'
+        del bn.input[:]
+        bn.input.append(x)
+        bn.attr.clear()
+        bn.attr['T'].CopyFrom(dtype)
+        num_folded += 1
+
+    print('Folded %d batch norms' % num_folded)
+    return folded_graph
+
+
+def freeze_graph(sess: tf.Session, output_names) -> tf.GraphDef:
+    """The graph of the session needed by the output nodes, with its variables turned into constants"""
+    return tf.graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), output_names)
+
+
+def optimize_for_inference(graph_def: tf.GraphDef, input_names, output_names) -> tf.GraphDef:
+    """Folds the batch norms and removes the nodes which are not needed by the outputs for inference"""
+    graph_def = fold_batch_norms(graph_def)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=input_names + output_names)
+    return tf.graph_util.extract_sub_graph(graph_def, output_names)
+
+
+def save_graph_def(graph_def: tf.GraphDef, path):
+    with tf.gfile.GFile(path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+
+def load_graph_def(path) -> tf.GraphDef:
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
@@ -0,0 +1,76 @@
+"""
+Runs every task of the cluster of a config as a process on this machine, e.g. to try distributed training without
+a cluster. The output of every task is written to <log_dir>/<job>-<task>.log. The ps tasks are stopped once all the
+workers are done, and all the tasks are stopped if a worker fails or if the workers are not done after timeout seconds.
+
+Usage: python -m utils.launch_local ./models/gancls/cfg/flowers.yml ./models/gancls/run.py [log_dir]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from utils.config import config_from_yaml
+from utils.distributed import PS_JOB, WORKER_JOB
+
+LOCAL_HOSTS = ['localhost', '127.0.0.1']
+
+
+def launch(script, cfg_path, log_dir, poll_period=1., timeout=None):
+    cfg = config_from_yaml(cfg_path)
+    if not cfg.DISTRIBUTED.FLAG:
+        raise ValueError('DISTRIBUTED.FLAG is not set in %s' % cfg_path)
+    for job, addresses in cfg.DISTRIBUTED.CLUSTER.items():
+        for address in addresses:
+            if address.rsplit(':', 1)[0] not in LOCAL_HOSTS:
+                raise ValueError('The %s task at %s is not on this machine' % (job, address))
+
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    # The tasks import the packages of the project from the working directory, as this module does
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+
+    processes = {}
+    for job in [PS_JOB, WORKER_JOB]:
+        for task_index in range(len(cfg.DISTRIBUTED.CLUSTER[job])):
+            log_path = os.path.join(log_dir, '%s-%d.log' % (job, task_index))
+            with open(log_path, 'w') as log:
+                processes[(job, task_index)] = subprocess.Popen(
+                    [sys.executable, script, '--cfg', cfg_path, '--job_name', job, '--task_index', str(task_index)],
+                    stdout=log, stderr=subprocess.STDOUT, env=env)
+            print('Started the %s task %d, logging to %s' % (job, task_index, log_path))
+
+    workers = {key: process for key, process in processes.items() if key[0] == WORKER_JOB}
+    failed = []
+    start_time = time.time()
+    try:
+        while workers and not failed:
+            time.sleep(poll_period)
+            if timeout is not None and time.time() - start_time > timeout:
+                print('The workers %s are not done after %ds' % (sorted(workers), timeout))
+                failed += sorted(workers)
+                break
+            for key, process in list(workers.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                del workers[key]
+                print('The %s task %d exited with code %d' % (key[0], key[1], code))
+                if code != 0:
+                    failed.append(key)
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            process.wait()
+    return not failed
+
+
+if __name__ == '__main__':
+    cfg_file, script_file = sys.argv[1], sys.argv[2]
+    logs = sys.argv[3] if len(sys.argv) > 3 else './logs/cluster/'
+    sys.exit(0 if launch(script_file, cfg_file, logs) else 1)
@@ -4,7 +4,7 @@ NHWC = 'NHWC'
 NCHW = 'NCHW'
 
 
-def batch_norm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9, df=NHWC):
+def batch_norm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9, df=NHWC, groups=1):
     """
     A batch normalization layer with input x
 
@@ -15,7 +15,10 @@ def batch_norm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9, df
                       init
         act: The activation function of the layer
         name: Name of the layer
+        groups: The number of equally sized batches concatenated in x, see grouped_batch_norm
     """
+    if groups > 1:
+        return grouped_batch_norm(x, groups, train, init=init, act=act, name=name, eps=eps, decay=decay)
 
     return tf.contrib.layers.batch_norm(x,
                                         decay=decay,
@@ -29,6 +32,53 @@ def batch_norm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9, df
                                         data_format=df)
 
 
+def grouped_batch_norm(x, groups, train, init=None, act=None, name=None, eps=1e-5, decay=0.9):
+    """
+    A batch normalization layer over a channels last input x made of `groups` equally sized batches concatenated
+    along the batch axis. Every group is normalized with its own statistics, so it is equivalent to calling batch_norm
+    (with the same variables) on every group in turn. The moving averages are updated once per group, in order,
+    with the unbiased variance as the fused batch norm does.
+    """
+    init = init or {}
+    shape = x.get_shape().as_list()
+    channels = shape[-1]
+    # The epsilon of the fused batch norm is at least 1.001e-5
+    eps = max(eps, 1.001e-5)
+
+    with tf.variable_scope(name, 'BatchNorm', [x]):
+        def variable(var_name, default_init, trainable=True):
+            return tf.contrib.framework.model_variable(var_name, [channels], trainable=trainable,
+                                                       initializer=init.get(var_name, default_init))
+
+        beta = variable('beta', tf.zeros_initializer())
+        gamma = variable('gamma', tf.ones_initializer())
+        moving_mean = variable('moving_mean', tf.zeros_initializer(), trainable=False)
+        moving_variance = variable('moving_variance', tf.ones_initializer(), trainable=False)
+        if not train:
+            out = tf.nn.batch_normalization(x, moving_mean, moving_variance, beta, gamma, eps)
+        else:
+            grouped = tf.reshape(x, [groups, -1] + shape[1:])
+            axes = list(range(1, len(shape)))
+            mean, variance = tf.nn.moments(grouped, axes=axes, keep_dims=True)
+            out = tf.reshape(tf.nn.batch_normalization(grouped, mean, variance, beta, gamma, eps), tf.shape(x))
+            out.set_shape(x.get_shape())
+
+            # m <- decay * m + (1 - decay) * s_g for g = 0, ..., groups - 1, in closed form
+            n = tf.cast(tf.size(grouped) // (groups * channels), tf.float32)
+            weights = tf.constant([(1. - decay) * decay ** (groups - 1 - g) for g in range(groups)])
+            mean = tf.reshape(mean, [groups, channels])
+            variance = tf.reshape(variance, [groups, channels]) * n / (n - 1.)
+            update_mean = tf.assign(moving_mean, decay ** groups * moving_mean + tf.tensordot(weights, mean, 1))
+            update_variance = tf.assign(moving_variance,
+                                        decay ** groups * moving_variance + tf.tensordot(weights, variance, 1))
+            tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, update_mean)
+            tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, update_variance)
+
+        if act is not None:
+            out = act(out)
+    return out
+
+
 def batch_renorm(x, train, init=None, act=None, name=None, eps=1e-5, decay=0.9, df=NHWC):
     """
     A batch normalization layer with input x
@@ -87,6 +137,30 @@ def fc(x, units, act=None, init=None, bias=True, name=None):
     return tf.layers.dense(x, units=units, activation=act, kernel_initializer=init, use_bias=bias, name=name)
 
 
+def uint8_to_float(images):
+    """Maps uint8 images from [0, 255] to float32 images in [-1, 1]. Float images are returned unchanged."""
+    if images.dtype != tf.uint8:
+        return images
+    with tf.name_scope('uint8_to_float'):
+        return tf.cast(images, tf.float32) * (2. / 255) - 1.
+
+
+def average_gradients(tower_grads):
+    """Averages the (gradient, variable) lists computed by every tower for the same variables"""
+    if len(tower_grads) == 1:
+        return tower_grads[0]
+    average_grads = []
+    for grads_and_vars in zip(*tower_grads):
+        var = grads_and_vars[0][1]
+        grads = [grad for grad, _ in grads_and_vars if grad is not None]
+        if not grads:
+            average_grads.append((None, var))
+            continue
+        with tf.name_scope('average_gradients'):
+            average_grads.append((tf.add_n(grads) / len(grads), var))
+    return average_grads
+
+
 def lrelu_act(alpha=0.2):
     return lambda x: tf.nn.leaky_relu(x, alpha)
 
@@ -0,0 +1,116 @@
+"""
+On-demand op-level profiling of chosen session runs.
+
+A StepTracer runs the sess.run calls of the chosen steps with a full trace and writes, for every traced run:
+- <name>_step<step>.trace.json, a Chrome trace (open it at chrome://tracing)
+- <name>_step<step>.ops.txt, the time of every network (generator, discriminator, Inception) in the forward and
+  backward passes and the top layers and ops by time and by output memory
+"""
+
+import os
+import re
+from collections import defaultdict
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+# The variable scopes of the networks, see GanCls and inception_net
+NETWORKS = ['g_net', 'd_net', 'InceptionV3']
+OTHER_NETWORK = 'other'
+
+_SCOPE_PREFIX = re.compile(r'^(tower_\d+|gradients(_\d+)?)$')
+_OP_TYPE = re.compile(r' = ([\w.]+)\(')
+# The per stream statistics of a GPU duplicate its stream:all statistics
+_STREAM_DEVICE = re.compile(r'/stream:\d+$')
+
+
+def node_scope(node_name):
+    """Returns the network, the layer and whether it is a gradient of the op node_name"""
+    parts = node_name.split('/')
+    backward = any(part.startswith('gradients') for part in parts)
+    parts = [part for part in parts if not _SCOPE_PREFIX.match(part)]
+    if not parts or parts[0] not in NETWORKS:
+        return OTHER_NETWORK, OTHER_NETWORK, backward
+    return parts[0], '/'.join(parts[:2]), backward
+
+
+def node_stats(step_stats):
+    """Yields the name, op type, device, time (in microseconds) and output bytes of every op of a traced run"""
+    for dev_stats in step_stats.dev_stats:
+        if _STREAM_DEVICE.search(dev_stats.device):
+            continue
+        for node in dev_stats.node_stats:
+            op_type = _OP_TYPE.search(node.timeline_label)
+            output_bytes = sum(output.tensor_description.allocation_description.requested_bytes
+                               for output in node.output)
+            yield (node.node_name, op_type.group(1) if op_type else '', dev_stats.device, node.all_end_rel_micros,
+                   output_bytes)
+
+
+def op_table(step_stats, top=20):
+    """Returns the text tables of the time per network and of the top layers and ops of a traced run"""
+    networks = defaultdict(lambda: [0, 0])
+    layers = defaultdict(lambda: [0, 0, 0])
+    ops = []
+    for name, op_type, device, micros, output_bytes in node_stats(step_stats):
+        network, layer, backward = node_scope(name)
+        networks[network][int(backward)] += micros
+        layers[layer][int(backward)] += micros
+        layers[layer][2] += output_bytes
+        ops.append((name, op_type, device, micros, output_bytes))
+
+    total = max(sum(forward + backward for forward, backward in networks.values()), 1)
+    lines = ['%-14s %12s %12s %8s' % ('network', 'forward ms', 'backward ms', 'share')]
+    for network, (forward, backward) in sorted(networks.items(), key=lambda item: -sum(item[1])):
+        lines.append('%-14s %12.2f %12.2f %7.1f%%' % (network, forward / 1000., backward / 1000.,
+                                                       100. * (forward + backward) / total))
+
+    lines += ['', 'Top %d layers by time' % top, '%-40s %12s %12s %12s' % ('layer', 'forward ms', 'backward ms',
+                                                                          'output MB')]
+    for layer, (forward, backward, output_bytes) in sorted(layers.items(), key=lambda item: -sum(item[1][:2]))[:top]:
+        lines.append('%-40s %12.2f %12.2f %12.2f' % (layer, forward / 1000., backward / 1000., output_bytes / 2 ** 20))
+
+    header = '%-70s %-24s %10s %10s' % ('op', 'type', 'ms', 'output MB')
+    for title, key in [('time', 3), ('output memory', 4)]:
+        lines += ['', 'Top %d ops by %s' % (top, title), header]
+        for name, op_type, _, micros, output_bytes in sorted(ops, key=lambda op: -op[key])[:top]:
+            lines.append('%-70s %-24s %10.3f %10.2f' % (name, op_type, micros / 1000., output_bytes / 2 ** 20))
+    return '\n'.join(lines) + '\n'
+
+
+class StepTracer(object):
+    def __init__(self, out_dir, step_ranges, top=20):
+        """
+        :arg out_dir: the directory of the traces and the op tables
+        :arg step_ranges: the [first, last] (inclusive) ranges of the steps to trace
+        :arg top: the number of layers and ops of the tables
+        """
+        self.out_dir = out_dir
+        self.step_ranges = [(int(first), int(last)) for first, last in step_ranges]
+        self.top = top
+
+    def active(self, step):
+        return any(first <= step <= last for first, last in self.step_ranges)
+
+    def run(self, sess: tf.Session, name, fetches, feed_dict=None, step=None):
+        """sess.run(fetches, feed_dict), traced if step is in one of the step ranges"""
+        if step is None or not self.active(step):
+            return sess.run(fetches, feed_dict=feed_dict)
+
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        results = sess.run(fetches, feed_dict=feed_dict, options=run_options, run_metadata=run_metadata)
+        self.write(name, step, run_metadata)
+        return results
+
+    def write(self, name, step, run_metadata: tf.RunMetadata):
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        path = os.path.join(self.out_dir, '%s_step%d' % (name, step))
+
+        trace = timeline.Timeline(run_metadata.step_stats)
+        with open(path + '.trace.json', 'w') as f:
+            f.write(trace.generate_chrome_trace_format(show_memory=True))
+        with open(path + '.ops.txt', 'w') as f:
+            f.write(op_table(run_metadata.step_stats, self.top))
+        print('Traced %s at step %d to %s.trace.json and %s.ops.txt' % (name, step, path, path))
@@ -1,7 +1,13 @@
 import os
+import pickle
 import re
+import threading
+import time
 import tensorflow as tf
 
+# The suffix of the file holding the training state saved with a checkpoint
+STATE_SUFFIX = '.state'
+
 
 def save(saver: tf.train.Saver, sess: tf.Session, checkpoint_dir, step):
     if not os.path.exists(checkpoint_dir):
@@ -23,3 +29,111 @@ def load(saver: tf.train.Saver, sess: tf.Session, checkpoint_dir: str):
     else:
         print(" [*] Failed to find checkpoints")
         return False, 0
+
+
+def load_training_state(checkpoint_dir: str):
+    """Returns the training state (e.g. the dataset cursor) saved with the latest checkpoint, or None"""
+    ckpt = tf.train.get_checkpoint_state(checkpoint_dir)
+    if not ckpt or not ckpt.model_checkpoint_path:
+        return None
+    state_path = os.path.join(checkpoint_dir, os.path.basename(ckpt.model_checkpoint_path)) + STATE_SUFFIX
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'rb') as f:
+        return pickle.load(f)
+
+
+class CheckpointManager(object):
+    """Saves checkpoints every save_steps steps and/or save_secs seconds without stalling the training loop.
+
+    A checkpoint starts with a snapshot of the variables into shadow (local) variables, which is a single fast
+    sess.run. The shadow variables are then written to disk on a background thread by a Saver mapping them to the
+    names of the original variables, so the checkpoints are restored as usual. Besides max_to_keep, a checkpoint is
+    kept every keep_checkpoint_every_n_hours. A picklable training state (e.g. the dataset cursor) can be saved with
+    every checkpoint, see load_training_state.
+
+    In distributed training, only the chief saves checkpoints: the manager of the other workers (is_chief=False)
+    defines no ops and its save methods do nothing.
+    """
+
+    def __init__(self, sess: tf.Session, checkpoint_dir, var_list=None, max_to_keep=5,
+                 keep_checkpoint_every_n_hours=10000., save_steps=None, save_secs=None, is_chief=True):
+        self.sess = sess
+        self.checkpoint_dir = checkpoint_dir
+        self.save_steps = save_steps
+        self.save_secs = save_secs
+        self.is_chief = is_chief
+
+        self._thread = None
+        self._last_step = None
+        self._last_time = time.time()
+        if not is_chief:
+            return
+
+        var_list = var_list if var_list is not None else tf.global_variables()
+        shadows = {}
+        with tf.variable_scope('checkpoint_shadow'):
+            for var in var_list:
+                shadows[var.op.name] = tf.get_variable(var.op.name, var.get_shape(), var.dtype.base_dtype,
+                                                       initializer=tf.zeros_initializer(), trainable=False,
+                                                       collections=[tf.GraphKeys.LOCAL_VARIABLES])
+        self.snapshot_op = tf.group(*[tf.assign(shadows[var.op.name], var) for var in var_list],
+                                    name='checkpoint_snapshot')
+        self.saver = tf.train.Saver(shadows, max_to_keep=max_to_keep,
+                                    keep_checkpoint_every_n_hours=keep_checkpoint_every_n_hours)
+        sess.run(tf.variables_initializer(list(shadows.values())))
+
+    def _due(self, step):
+        if self._last_step is None:
+            self._last_step = step
+        if self.save_steps and step - self._last_step >= self.save_steps:
+            return True
+        return bool(self.save_secs) and time.time() - self._last_time >= self.save_secs
+
+    def maybe_save(self, step, get_state=None):
+        """Starts a checkpoint if one is due and the previous one is written. Returns whether it started one.
+        get_state returns the training state to save with the checkpoint, it is only called when one is started."""
+        if not self.is_chief or not self._due(step) or (self._thread is not None and self._thread.is_alive()):
+            return False
+        self.save(step, get_state() if get_state is not None else None, wait=False)
+        return True
+
+    def save(self, step, state=None, wait=True):
+        """Snapshots the variables and writes them (and state) in the background, or in the foreground if wait"""
+        if not self.is_chief:
+            return
+        self.wait()
+        self.sess.run(self.snapshot_op)
+        self._last_step = step
+        self._last_time = time.time()
+
+        self._thread = threading.Thread(target=self._write, args=(step, state), name='checkpoint_writer')
+        self._thread.start()
+        if wait:
+            self.wait()
+
+    def _write(self, step, state):
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+
+        path = self.saver.save(self.sess, self.checkpoint_dir, global_step=step, write_meta_graph=False)
+        if state is not None:
+            with open(path + STATE_SUFFIX + '.tmp', 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + STATE_SUFFIX + '.tmp', path + STATE_SUFFIX)
+        self._remove_stale_states()
+        print(" [*] Saved {}".format(os.path.basename(path)))
+
+    def _remove_stale_states(self):
+        """Removes the training states of the checkpoints deleted by the Saver"""
+        directory = os.path.dirname(self.checkpoint_dir) or '.'
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(STATE_SUFFIX) and not os.path.exists(path[:-len(STATE_SUFFIX)] + '.index'):
+                os.remove(path)
+
+    def wait(self):
+        """Waits for the checkpoint being written, if any"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
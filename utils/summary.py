@@ -0,0 +1,35 @@
+import queue
+import threading
+
+import tensorflow as tf
+
+
+class AsyncSummaryWriter(object):
+    """Adds the summaries evaluated by the training loop to a FileWriter from a background thread.
+
+    add_summary only blocks when max_queue summaries are already waiting to be written, so a slow disk can not
+    make the queue (and the memory) grow without bound.
+    """
+
+    def __init__(self, writer: tf.summary.FileWriter, max_queue=16):
+        self.writer = writer
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='summary_writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            summary, step = item
+            self.writer.add_summary(summary, step)
+
+    def add_summary(self, summary, step):
+        self._queue.put((summary, step))
+
+    def close(self):
+        """Writes the queued summaries and closes the FileWriter"""
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.close()
@@ -0,0 +1,128 @@
+"""
+Lightweight instrumentation of the training loops: named phase timers and counters.
+
+The time spent in every phase (e.g. 'data', 'd_step', 'checkpoint') is accumulated over a training step. At the end
+of the step, the total of every phase is added to a rolling window of the last steps, a phase not run during a step
+counting as 0. Every report gives the mean, p50, p95 and p99 of every phase over the window and the images per second,
+as TensorBoard scalars and as rows appended to a CSV and a JSON lines log.
+"""
+
+import csv
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import numpy as np
+import tensorflow as tf
+
+STEP_PHASE = 'step'
+PERCENTILES = [50, 95, 99]
+
+
+class StepTimer(object):
+    def __init__(self, log_dir=None, name='timing', window=1000):
+        """
+        :arg log_dir: the directory of the <name>.csv and <name>.jsonl logs, no logs if None
+        :arg window: the number of steps over which the statistics are computed
+        """
+        self.window = window
+        if log_dir is not None and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        self.csv_path = os.path.join(log_dir, name + '.csv') if log_dir is not None else None
+        self.json_path = os.path.join(log_dir, name + '.jsonl') if log_dir is not None else None
+
+        # The phases in the order of their first use
+        self._times = OrderedDict()
+        self._step_times = {}
+        self._images = deque(maxlen=window)
+        self._step_start = None
+
+        self.totals = {}
+        self.counters = {}
+        self.num_steps = 0
+
+    @contextmanager
+    def time(self, phase):
+        """Times the block as part of phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def add(self, phase, seconds):
+        self._step_times[phase] = self._step_times.get(phase, 0.) + seconds
+        self.totals[phase] = self.totals.get(phase, 0.) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def start_step(self):
+        self._step_start = time.perf_counter()
+
+    def end_step(self, num_images):
+        """Ends the step started by start_step, in which num_images images were trained on"""
+        self.add(STEP_PHASE, time.perf_counter() - self._step_start)
+        for phase in self._step_times:
+            if phase not in self._times:
+                # The steps before the first use of the phase did not run it
+                self._times[phase] = deque([0.] * min(self.num_steps, self.window), maxlen=self.window)
+        for phase, times in self._times.items():
+            times.append(self._step_times.get(phase, 0.))
+        self._images.append(num_images)
+        self.count('images', num_images)
+        self._step_times = {}
+        self.num_steps += 1
+
+    def mean(self, phase):
+        """The mean time of phase per step, over all the steps"""
+        return self.totals.get(phase, 0.) / max(self.num_steps, 1)
+
+    def stats(self):
+        """Returns the mean and the percentiles of every phase over the window and the images per second"""
+        stats = OrderedDict()
+        for phase, times in self._times.items():
+            times = np.array(times)
+            stats[phase] = OrderedDict([('mean', float(times.mean()))] +
+                                       [('p%d' % q, float(np.percentile(times, q))) for q in PERCENTILES])
+        step_time = sum(self._times[STEP_PHASE]) if STEP_PHASE in self._times else 0.
+        images_per_sec = sum(self._images) / step_time if step_time > 0 else 0.
+        return stats, images_per_sec
+
+    def summary(self, stats, images_per_sec) -> tf.Summary:
+        values = [tf.Summary.Value(tag='timing/images_per_sec', simple_value=images_per_sec)]
+        for phase, phase_stats in stats.items():
+            for key, value in phase_stats.items():
+                values.append(tf.Summary.Value(tag='timing/%s/%s' % (phase, key), simple_value=value))
+        return tf.Summary(value=values)
+
+    def report(self, step, writer=None):
+        """Writes the statistics of the window to the logs and, as scalar summaries, to writer. Returns them."""
+        if self.num_steps == 0:
+            return None
+        stats, images_per_sec = self.stats()
+        if writer is not None:
+            writer.add_summary(self.summary(stats, images_per_sec), step)
+
+        if self.csv_path is not None:
+            new_file = not os.path.exists(self.csv_path)
+            with open(self.csv_path, 'a', newline='') as f:
+                csv_writer = csv.writer(f)
+                if new_file:
+                    csv_writer.writerow(['step', 'phase', 'mean'] + ['p%d' % q for q in PERCENTILES] +
+                                        ['images_per_sec'])
+                for phase, phase_stats in stats.items():
+                    csv_writer.writerow([step, phase] + ['%.6f' % value for value in phase_stats.values()] +
+                                        ['%.2f' % images_per_sec])
+            with open(self.json_path, 'a') as f:
+                f.write(json.dumps({'step': step, 'time': time.time(), 'images_per_sec': images_per_sec,
+                                    'phases': stats, 'counters': self.counters}) + '\n')
+        return stats, images_per_sec
+
+    def format(self, stats, images_per_sec):
+        """A one line summary of the p50 and p99 of every phase, in milliseconds"""
+        phases = ', '.join('%s: %.1f/%.1f' % (phase, 1000 * phase_stats['p50'], 1000 * phase_stats['p99'])
+                           for phase, phase_stats in stats.items())
+        return '[Timing] p50/p99 ms per step - %s - %.1f images/s' % (phases, images_per_sec)
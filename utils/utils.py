@@ -129,12 +129,15 @@ def load_inception_data(full_path, alphabetic=False):
     return images
 
 
-def prep_incep_img(img):
+def prep_incep_img(img, normalize=True):
+    """Resizes an image to the Inception input size. The uint8 image is returned when normalize is not set."""
     # print('img', img.shape, img.max(), img.min())
     # img = Image.fromarray(img, 'RGB')
     if len(img.shape) == 2:
         img = np.resize(img, (img.shape[0], img.shape[1], 3))
     img = scipy.misc.imresize(img, (299, 299, 3), interp='bilinear')
+    if not normalize:
+        return img
     img = img.astype(np.float32)
     # [0, 255] --> [0, 1] --> [-1, 1]
     img = img / 127.5 - 1.
@@ -142,6 +145,11 @@ def prep_incep_img(img):
     return img
 
 
+def incep_inputs_are_uint8(sess):
+    """Whether the inputs placeholder of the loaded Inception network takes raw uint8 images"""
+    return sess.graph.get_tensor_by_name('inputs:0').dtype == tf.uint8
+
+
 def denormalize_images(images):
     return ((images + 1.0) * 127.5).astype('uint8')
 